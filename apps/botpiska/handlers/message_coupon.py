@@ -1,19 +1,24 @@
 from aiogram.types import User
 
 import response_system_extensions as rse
+import template
 import userdata
 from apps.coupons.methods import get_suggested_coupon, CouponError, CouponNotFound
 
+COUPON_TEMPLATE = 'apps/botpiska/templates/message-coupon-general.xml'
+
 
 async def coupon_message_handler(_, user: User):
     """ ... """
 
+    # Связи, которые проходит шаблон, загружаются вместе с купоном
+    relations = template.get_relations(COUPON_TEMPLATE).get('coupon', ())
     try:
-        coupon = await get_suggested_coupon(user.id)
+        coupon = await get_suggested_coupon(user.id, relations=relations)
     except (CouponError, CouponNotFound):
         coupon = None
 
-    return rse.tmpl_send('apps/botpiska/templates/message-coupon-general.xml', {
+    return rse.tmpl_send(COUPON_TEMPLATE, {
         'coupon': coupon
     })
 
@@ -23,7 +28,7 @@ async def coupon_deactivate_handler(_, user: User):
 
     await userdata.set_data(user.id, coupon=None)
 
-    return rse.tmpl_edit('apps/botpiska/templates/message-coupon-general.xml', {
+    return rse.tmpl_edit(COUPON_TEMPLATE, {
         'coupon': None
     })
 
@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 import aiogram
-from aiogram.types import WebAppInfo, InlineKeyboardButton
+from aiogram.types import WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
 
 import gls
 import pilgram
@@ -124,10 +124,12 @@ async def send_bill(
         'is_gifts_allowed': is_gifts_allowed
     }).extract()
 
-    tmpl.keyboard.inline_keyboard.insert(0, [InlineKeyboardButton(
-        text='Оплатить',
-        web_app=WebAppInfo(url=qiwi_bill.pay_url)
-    )])
+    # Клавиатура может быть общей для нескольких отрисовок шаблона
+    # (статические поддеревья), поэтому не изменяем её, а создаём новую
+    tmpl.keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='Оплатить', web_app=WebAppInfo(url=qiwi_bill.pay_url))],
+        *tmpl.keyboard.inline_keyboard
+    ])
 
     return (
         rs.send(tmpl, on_success=register_bill)
@@ -1,11 +1,11 @@
 import peewee
 
+import ezqr
 import gls
 from .subscription import Subscription
 from .client import Client
 from .employee import Employee
 from apps.coupons.models.coupon import Coupon
-from apps.coupons.models.coupon_type import CouponType
 
 
 class Order(gls.BaseModel):
@@ -57,18 +57,13 @@ class Order(gls.BaseModel):
         """ Возвращает Query открытых заказов """
         return cls.select(*query).where(cls.closed_at.is_null(True))
 
+    JOINED_RELATIONS = ('subscription', 'coupon.type')
+    """ Связи, загружаемые вместе с заказом в select_*_joined """
+
     @classmethod
     def select_by_id_joined(cls, pk: int):
-        return cls.select_by_id(pk) \
-            .join(Subscription) \
-            .switch(Order) \
-            .join(Coupon, peewee.JOIN.LEFT_OUTER) \
-            .join(CouponType, peewee.JOIN.LEFT_OUTER)
+        return ezqr.join_relations(cls.select_by_id(pk), cls.JOINED_RELATIONS)
 
     @classmethod
     def select_open_joined(cls):
-        return cls.select_open() \
-            .join(Subscription) \
-            .switch(Order) \
-            .join(Coupon, peewee.JOIN.LEFT_OUTER) \
-            .join(CouponType, peewee.JOIN.LEFT_OUTER)
+        return ezqr.join_relations(cls.select_open(), cls.JOINED_RELATIONS)
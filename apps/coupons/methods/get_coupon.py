@@ -1,10 +1,13 @@
 """ ... """
 from __future__ import annotations
 
+import typing
+
 import peewee
 
+import ezqr
 import response_system as rs
-from apps.coupons.models import Coupon, CouponType
+from apps.coupons.models import Coupon
 from response_system import UserFriendlyException
 
 
@@ -47,12 +50,14 @@ class CouponAlreadyUsed(CouponError):
 async def get_coupon(
         code: str,
         user_id: int = None,
-        subscription_id: str = None
+        subscription_id: str = None,
+        relations: typing.Iterable[str] = ()
 ) -> Coupon:
-    """ Получает купон из базы """
+    """ Получает купон из базы вместе с типом и связями relations
+        (цепочками ForeignKey полей купона, см. ezqr.join_relations) """
 
     try:
-        coupon: Coupon = Coupon.select_by_id(code).join(CouponType).get()
+        coupon: Coupon = ezqr.join_relations(Coupon.select_by_id(code), ['type', *relations]).get()
     except peewee.DoesNotExist:
         raise CouponNotFound(f'Купон "{code}" не найден')
 
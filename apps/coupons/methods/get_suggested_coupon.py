@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import typing
+
 import userdata
 from apps.coupons.methods import CouponWrongSubscription, CouponError, CouponNotFound, get_coupon
 from apps.coupons.models import Coupon
@@ -7,9 +9,10 @@ from apps.coupons.models import Coupon
 
 async def get_suggested_coupon(
         user_id: int,
-        subscription_id: str = None
+        subscription_id: str = None,
+        relations: typing.Iterable[str] = ()
 ) -> Coupon | None:
-    """ Получает активированный купон из базы """
+    """ Получает активированный купон из базы, relations - см. get_coupon """
 
     suggested_coupon, = await userdata.get_data(user_id, ['coupon'])
 
@@ -19,7 +22,7 @@ async def get_suggested_coupon(
 
     # Получаем купон из базы и заодно проверяем его валидность
     try:
-        return await get_coupon(suggested_coupon, user_id, subscription_id)
+        return await get_coupon(suggested_coupon, user_id, subscription_id, relations)
 
     except CouponWrongSubscription:
         raise
@@ -1,10 +1,20 @@
 """ ... """
+import html
+
 import aiogram.types
+from aiogram.filters import CommandObject
 
+import gls
+import message_render
+import rate_limit
+import retry
 import response_system as rs
 import response_system_extensions as rse
+import template
 from apps.seasons.models import Season
 
+template_profiler = template.Profiler(query_counter=lambda: gls.db.queries)
+
 
 async def unhandled_callback_query(query: aiogram.types.CallbackQuery):
     """ ... """
@@ -16,3 +26,52 @@ async def test_handler(_):
     print(prizes)
     # return rs.send(f'<code>{prizes}</code>')
     # return rse.tmpl_send('apps/debug/templates/test.xml', {'a': False, 'b': False})
+
+
+async def template_profile_handler(_, command: CommandObject):
+    """ /template_profile [start|stop|reset] - управляет профилированием
+        отрисовки шаблонов, без аргументов - выводит отчёт """
+    action = (command.args or '').strip()
+
+    if action == 'start':
+        template_profiler.start()
+        return rs.send('Профилирование шаблонов включено')
+
+    if action == 'stop':
+        template_profiler.stop()
+        return rs.send('Профилирование шаблонов выключено')
+
+    if action == 'reset':
+        template_profiler.reset()
+        return rs.send('Статистика профилирования сброшена')
+
+    if not template_profiler.stats:
+        return rs.send('Статистики нет, начать профилирование: /template_profile start')
+
+    return rs.send(f'<pre>{html.escape(template_profiler.report())}</pre>')
+
+
+async def rate_limit_handler(_):
+    """ /rate_limit - очереди и время ожидания ограничителя частоты запросов, по ботам,
+        повторы запросов после ошибок, пропущенные изменения сообщений
+        и показанные сообщения ожидания """
+    lines = [
+        f'<b>{bot_id}</b>: ожидают {stats.interactive_waiting} + {stats.broadcast_waiting} (рассылки), '
+        f'пропущено {stats.acquired}, ждали {stats.delayed}, '
+        f'в среднем {stats.average_wait * 1000:.0f} мс, наибольшее {stats.max_wait * 1000:.0f} мс'
+        for bot_id, stats in rate_limit.get_stats().items()
+    ] or ['Запросов ещё не было']
+
+    retries = retry.get_stats()
+    lines.append(
+        f'Повторы: {retries.retries} (retry_after {retries.retry_after}, сеть {retries.network_errors}), '
+        f'ожидание {retries.total_wait:.1f} сек, не удалось {retries.gave_up}'
+    )
+
+    edits = message_render.get_edit_cache_info()
+    lines.append(f'Изменения сообщений: выполнено {edits.performed}, пропущено без изменений {edits.skipped}')
+
+    waiting = rs.middleware.get_waiting_stats()
+    lines.append(f'Сообщения ожидания: показано {waiting.shown} из {waiting.scheduled}, '
+                 f'не понадобилось {waiting.skipped}')
+    return rs.send('\n'.join(lines))
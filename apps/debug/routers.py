@@ -14,5 +14,13 @@ only_in_dev_debug_router.message(
     Command(commands=['test'])
 )(handlers.test_handler)
 
+only_in_dev_debug_router.message(
+    Command(commands=['template_profile'])
+)(handlers.template_profile_handler)
+
+only_in_dev_debug_router.message(
+    Command(commands=['rate_limit'])
+)(handlers.rate_limit_handler)
+
 # Команды доступные в любом режиме
 debug_router = aiogram.Router()
@@ -1,21 +1,36 @@
+import ezqr
+import response_system as rs
 import response_system_extensions as rse
-from apps.botpiska.models import Order, Subscription
+import template
+from apps.botpiska.models import Order
+
+ORDER_LIST_TEMPLATE = 'apps/order_processing/templates/op-message-order-list.xml'
+
+
+def select_orders():
+    """ Открытые заказы вместе со связями, которые проходит шаблон списка """
+    relations = template.get_relations(ORDER_LIST_TEMPLATE).get('orders', ())
+    return ezqr.join_relations(Order.select_open(), relations).order_by(Order.created_at)
 
 
 async def get_orders_handler(_):
     """ ... """
-    orders = Order.select_open().join(Subscription).order_by(Order.created_at)
-    return rse.tmpl_send('apps/order_processing/templates/op-message-order-list.xml', {
-        'orders': list(orders)
+    return rse.tmpl_send(ORDER_LIST_TEMPLATE, {
+        'orders': list(select_orders())
     })
 
 
 async def update_orders_handler(_):
     """ ... """
-    orders = Order.select_open().join(Subscription).order_by(Order.created_at)
-    return rse.tmpl_edit('apps/order_processing/templates/op-message-order-list.xml', {
-        'orders': list(orders)
+    messages = template.render(ORDER_LIST_TEMPLATE, {
+        'orders': list(select_orders())
     })
 
+    # Длинный список разбивается на несколько сообщений, отредактировать
+    # одно сообщение так, чтобы их стало несколько, нельзя - отправляем заново
+    if len(messages) == 1:
+        return rs.edit(messages.extract())
+    return rs.delete() + rs.send(messages)
+
 
 __all__ = ('get_orders_handler', 'update_orders_handler')
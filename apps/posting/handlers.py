@@ -1,8 +1,6 @@
-import asyncio
 import logging
 
 import aiogram.types
-import aiogram.exceptions
 import peewee
 from aiogram import Bot
 from aiogram.filters import CommandObject
@@ -10,7 +8,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import default_state
 from aiogram.types import User
 
-import gls
+import broadcast
 import response_system as rs
 import response_system_extensions as rse
 import template
@@ -20,7 +18,6 @@ from apps.posting.methods import generate_lottery_prize
 from apps.posting.models import Lottery, LotteryPrize
 from apps.posting.states import PostStates
 from apps.statistics.models import Statistics
-from message_render import MessageRenderList
 from template_for_aiogram.scopes import ELEMENT
 
 logger = logging.getLogger(__name__)
@@ -52,19 +49,10 @@ async def post_button_handler(_, user: User, callback_data: callbacks.PostCallba
     except ValueError:
         pass
 
-    bot = Bot.get_current()
-    await bot.send_message(
-        user.id,
-        f'Получателей: {len(receivers)}\n'
-        f'Ожидаемое время полной отправки: {len(receivers) * 0.5} сек'
-    )
-
-    def on_completion(succeeded, total):
-        return gls.bot.send_message(user.id, f'Успешно отправлено: {succeeded} / {total}')
-
+    # Рассылка выполняется в фоне, её ход отображается в сообщении пользователю
     return (
         rs.delete()
-        + rs.notify(message, receivers, on_completion=on_completion)
+        + rs.notify(message, receivers, progress_chat=user.id)
     )
 
 
@@ -89,32 +77,14 @@ async def lottery_command_handler(_, user: User, command: CommandObject):
     receivers = Client.get_all_chats()
     prize_generator = generate_lottery_prize(lottery.prizes, len(receivers))
 
-    succeeded = 0
-
-    bot = Bot.get_current()
-    await bot.send_message(
-        user.id,
-        f'Получателей: {len(receivers)}\n'
-        f'Ожидаемое время полной отправки: {len(receivers) * 0.5} сек'
-    )
-
-    for chat_id in receivers:
-        messages: MessageRenderList = template.render('apps/posting/templates/message-lottery.xml', {
-            'banner': lottery.banner,
-            'content': content,
-            'prize': next(prize_generator)
-        })
-
-        try:
-            await messages.send(chat_id)
-        except aiogram.exceptions.TelegramAPIError:
-            pass
-        else:
-            succeeded += 1
-
-        await asyncio.sleep(0.5)
-
-    return rs.send(f'Отправлено {succeeded}/{len(receivers)}')
+    # Для разных получателей меняется только приз. Сообщения отрисовываются
+    # фоновым обработчиком рассылок по мере отправки
+    broadcast.enqueue_template('apps/posting/templates/message-lottery.xml', {
+        'banner': lottery.banner,
+        'content': content,
+    }, ((chat, {'prize': prize}) for chat, prize in zip(receivers, prize_generator)),
+        Bot.get_current(), progress_chat=user.id)
+    return rs.no_response()
 
 
 class LotteryPrizeNotFound(rs.UserFriendlyException):
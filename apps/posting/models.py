@@ -2,6 +2,7 @@ import peewee
 
 import gls
 from apps.coupons.models import CouponType
+from apps.statistics.models import JSONField
 
 
 class Lottery(gls.BaseModel):
@@ -26,3 +27,38 @@ class LotteryPrize(gls.BaseModel):
 
     class Meta:
         table_name = 'LotteryPrize'
+
+
+class BroadcastJob(gls.BaseModel):
+    """ Рассылка, отправляемая фоновыми обработчиками (см. libs/broadcast.py) """
+
+    id = peewee.AutoField()
+    """ Номер рассылки """
+    bot_id = peewee.BigIntegerField()
+    """ ID бота, от имени которого выполняется рассылка """
+    messages = JSONField()
+    """ Различающиеся сообщения рассылки: [MessageRenderList, ...] в виде JSON.
+        Для рассылки по шаблону - различающиеся изменяющиеся части контекста """
+    receivers = JSONField()
+    """ Получатели в порядке отправки: [[chat_id, индекс сообщения], ...] """
+    cursor = peewee.IntegerField(default=0)
+    """ Сколько получателей уже обработано - с этого места рассылка продолжается после перезапуска """
+    succeeded = peewee.IntegerField(default=0)
+    """ Сколько сообщений доставлено """
+    failed = peewee.IntegerField(default=0)
+    """ Сколько сообщений не удалось доставить """
+    template = peewee.CharField(null=True)
+    """ Шаблон, отрисовываемый для каждого получателя. Если не указан - messages содержит готовые сообщения """
+    context = JSONField(null=True)
+    """ Общий для всех получателей контекст шаблона """
+    progress_chat_id = peewee.BigIntegerField(null=True)
+    """ Чат, в котором отображается ход рассылки. Если не указан - ход не отображается """
+    progress_message_id = peewee.BigIntegerField(null=True)
+    """ Сообщение с ходом рассылки. Если не указано - ещё не отправлено """
+    created_at = peewee.DateTimeField()
+    """ Дата и время создания рассылки """
+    finished_at = peewee.DateTimeField(null=True)
+    """ Дата и время завершения. Если не указано - рассылка ещё не завершена """
+
+    class Meta:
+        table_name = 'BroadcastJob'
@@ -0,0 +1,116 @@
+"""
+Скорость рассылки (сообщений в секунду) в зависимости от размера окна
+отправки broadcast.send_all. Запросы обрабатывает фейковый Bot API
+с постоянной задержкой и ограничением частоты: запросы сверх server-rate
+в секунду получают TelegramRetryAfter.
+
+Сценарии:
+    rate_limit - частоту ограничивает rate_limit (30 сообщений в секунду),
+    flood      - rate_limit пропускает больше, чем Bot API; скорость
+                 держится за счёт уменьшения окна при TelegramRetryAfter.
+
+Запуск из корня проекта::
+
+    python benchmarks/broadcast_throughput.py [--latency 0.1] [--messages 150] [--windows 1 2 4 8 16 32]
+
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+
+import aiogram
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Chat, Message
+
+import broadcast
+import rate_limit
+from message_render import MessageRender, MessageRenderList
+
+
+class FakeBotAPI(BaseSession):
+    """ Отвечает через latency секунд; больше rate запросов в секунду - TelegramRetryAfter """
+
+    def __init__(self, latency: float, rate: float, retry_after: int = 1):
+        super().__init__()
+        self.latency = latency
+        self.retry_after = retry_after
+        self.bucket = rate_limit.TokenBucket(rate, rate, time.monotonic())
+        self.flood_until = 0.
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        now = time.monotonic()
+        flood = now < self.flood_until or self.bucket.delay(now) > 0
+        if flood:
+            self.flood_until = max(self.flood_until, now + self.retry_after)
+        else:
+            self.bucket.take()
+
+        await asyncio.sleep(self.latency)
+        if flood:
+            raise TelegramRetryAfter(method, 'Flood control exceeded', self.retry_after)
+
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=method.chat_id, type='private'),
+            text=method.text
+        )
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, timeout, chunk_size):
+        yield b''
+
+
+SCENARIOS = {
+    'rate_limit': rate_limit.GLOBAL_RATE,
+    'flood': 1000,
+}
+""" Сценарий -> частота, которую пропускает rate_limit """
+
+
+async def measure(window: int, client_rate: float, args) -> tuple[float, int, broadcast.SendWindowStats]:
+    """ Сообщений в секунду, число успешных отправок и статистика окна """
+    session = FakeBotAPI(args.latency, args.server_rate)
+    bot = aiogram.Bot('1:BROADCAST', session=session)
+    rate_limit._limiters[bot.id] = rate_limit.RateLimiter(rate=client_rate)
+
+    message = MessageRenderList([MessageRender('Пост')])
+    deliveries = ((chat, message) for chat in range(1, args.messages + 1))
+    send_window = broadcast.SendWindow(window)
+
+    started = time.perf_counter()
+    succeeded = await broadcast.send_all(deliveries, bot, send_window)
+    elapsed = time.perf_counter() - started
+    return succeeded / elapsed, succeeded, send_window.stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.1, help='Задержка ответа Bot API, в секундах')
+    parser.add_argument('--server-rate', type=float, default=30, help='Запросов в секунду, которые принимает Bot API')
+    parser.add_argument('--messages', type=int, default=150)
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    args = parser.parse_args()
+
+    print(f'{"scenario":<11} {"window":>6} {"msg/s":>7} {"delivered":>10} {"retry_after":>12} {"min window":>11}')
+    for scenario in args.scenarios:
+        for window in args.windows:
+            speed, succeeded, stats = await measure(window, SCENARIOS[scenario], args)
+            print(f'{scenario:<11} {window:>6} {speed:>7.1f} {succeeded:>6}/{args.messages:<3} '
+                  f'{stats.retry_after:>12} {stats.min_limit:>11}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
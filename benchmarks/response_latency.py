@@ -0,0 +1,159 @@
+"""
+Время выполнения Response: последовательное выполнение действий (как раньше
+в ResponseMiddleware) и Response.execute, где действия одного приоритета,
+пишущие в разные переписки, выполняются одновременно. Запросы к Telegram
+обрабатывает фейковая сессия aiogram с постоянной задержкой.
+
+Запуск из корня проекта::
+
+    python benchmarks/response_latency.py [--latency 0.05] [--rounds 10]
+
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+
+import aiogram
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message
+
+import response_system as rs
+import message_render
+from message_render import MessageRender
+from response_system.core.responses import chat_keys
+
+USER = 1001
+EMPLOYEES = [2001, 2002, 2003]
+ROUND_OFFSET = 10_000
+""" Каждый раунд пишет в свои чаты, чтобы не упираться в ограничение частоты для одного чата """
+
+
+class FakeSession(BaseSession):
+    """ Отвечает на любой запрос через latency секунд, запоминая (бот, чат, метод) """
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls: list[tuple[int, int, str]] = []
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        chat = getattr(method, 'chat_id', None)
+        self.calls.append((bot.id, chat, type(method).__name__))
+        await asyncio.sleep(self.latency)
+
+        if method.__returning__ is bool:
+            return True
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat, type='private'),
+            text=getattr(method, 'text', None)
+        )
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, timeout, chunk_size):
+        yield b''
+
+
+def message(chat: int) -> Message:
+    return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=chat, type='private'))
+
+
+async def notify_employees(operator_bot: aiogram.Bot, employees: list[int], text: str):
+    """ Как action_tmpl_notify: по сообщению каждому сотруднику, по очереди """
+    for chat in employees:
+        await MessageRender(text).send(chat, bot=operator_bot)
+
+
+def purchase(bot: aiogram.Bot, operator_bot: aiogram.Bot, user: int, employees: list[int]) -> rs.Response:
+    """ buy_for_user: удаление счёта, заказ, начисленные баллы, уведомление сотрудников """
+    response = (
+        rs.delete(10, chat=user, bot=bot)
+        + rs.send('Заказ', chat=user, bot=bot)
+        + rs.send('Баллы сезона', chat=user, bot=bot)
+    )
+    response.add_action(notify_employees(operator_bot, employees, 'Новый заказ'), 4,
+                        chat_keys(operator_bot, employees))
+    return response
+
+
+def order_take(bot: aiogram.Bot, operator_bot: aiogram.Bot, user: int, employees: list[int]) -> rs.Response:
+    """ take_order_handler: изменение сообщения оператора и уведомление клиента """
+    return (
+        rs.edit('Заказ взят', original=message(employees[0]), bot=operator_bot)
+        + rs.send('Ваш заказ обрабатывается', chat=user, bot=bot)
+    )
+
+
+def one_band(bot: aiogram.Bot, operator_bot: aiogram.Bot, user: int, employees: list[int]) -> rs.Response:
+    """ Несколько сообщений одного приоритета: два клиенту (порядок важен)
+        и по одному каждому сотруднику """
+    response = rs.send('Первое', chat=user, bot=bot) + rs.send('Второе', chat=user, bot=bot)
+    for chat in employees:
+        response += rs.send('Сотруднику', chat=chat, bot=operator_bot)
+    return response
+
+
+SCENARIOS = {
+    'purchase': purchase,
+    'order take': order_take,
+    'one band, 4 chats': one_band,
+}
+
+
+async def sequential(response: rs.Response):
+    for action in response:
+        await action
+
+
+async def measure(scenario, run, latency: float, rounds: int) -> tuple[float, dict]:
+    """ Медиана времени выполнения в мс и запросы по перепискам (в порядке отправки) """
+    # Иначе изменения, уже выполненные предыдущим прогоном, будут пропущены
+    message_render.forget_all()
+    session = FakeSession(latency)
+    bot = aiogram.Bot('1:MAIN', session=session)
+    operator_bot = aiogram.Bot('2:OPERATOR', session=session)
+
+    timings = []
+    for i in range(rounds):
+        session.calls.clear()
+        offset = i * ROUND_OFFSET
+        response = scenario(bot, operator_bot, USER + offset, [chat + offset for chat in EMPLOYEES])
+
+        started = time.perf_counter()
+        await run(response)
+        timings.append(time.perf_counter() - started)
+
+    chats = {}
+    for bot_id, chat, method in session.calls:
+        chats.setdefault((bot_id, chat % ROUND_OFFSET), []).append(method)
+    return statistics.median(timings) * 1000, chats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа Bot API, в секундах')
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"scenario":<20} {"sequential, ms":>15} {"execute, ms":>12} {"speedup":>8}  per-chat order')
+    for name, scenario in SCENARIOS.items():
+        before, expected = await measure(scenario, sequential, args.latency, args.rounds)
+        after, actual = await measure(scenario, rs.Response.execute, args.latency, args.rounds)
+        order = 'same' if expected == actual else 'DIFFERENT'
+        print(f'{name:<20} {before:>15.1f} {after:>12.1f} {before / after:>7.2f}x  {order}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Микро-бенчмарк assembler-ов областей: поток токенов, который получает
+MESSAGE при отрисовке списка заказов, и потоки для ELEMENT и INLINE_KEYBOARD.
+
+Запуск из корня проекта::
+
+    python benchmarks/template_assemblers.py
+
+"""
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from template.dev import StopParsing
+from template_for_aiogram.scopes import MESSAGE, ELEMENT, INLINE_KEYBOARD
+from template_for_aiogram.types import Text, Paragraph, Section, ImageID, KeyboardLayoutRow
+
+
+def message_stream(orders: int) -> list:
+    """ Изображение, заголовок, по параграфу на заказ, пара секций и клавиатура """
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='Обновить', callback_data='order-list-update')]
+    ])
+    tokens = [ImageID('FILE-ID'), Paragraph('<b>СПИСОК ЗАКАЗОВ</b>')]
+    for i in range(orders):
+        tokens += [Text('🔸'), Text(f'#{i}'), Text('Spotify Individual'), Paragraph('')]
+    tokens += [Section('Итого'), Text('всего'), Text(str(orders)), keyboard]
+    return tokens
+
+
+def element_stream(words: int) -> list:
+    return [Text(f'word{i}') if i % 10 else Paragraph(f'paragraph {i}') for i in range(words)]
+
+
+def keyboard_stream(rows: int) -> list:
+    button = InlineKeyboardButton(text='Кнопка', callback_data='button')
+    tokens = []
+    for i in range(rows):
+        tokens += [KeyboardLayoutRow([button, button]), button]
+    return tokens
+
+
+def feed(scope, tokens: list):
+    parser = scope.parsing_function()
+    next(parser)
+    for token in tokens:
+        parser.send(token)
+    return parser.send(StopParsing)
+
+
+def main():
+    cases = [
+        ('MESSAGE, 10 orders', MESSAGE, message_stream(10)),
+        ('MESSAGE, 100 orders', MESSAGE, message_stream(100)),
+        ('ELEMENT, 200 tokens', ELEMENT, element_stream(200)),
+        ('INLINE_KEYBOARD, 20 rows', INLINE_KEYBOARD, keyboard_stream(20)),
+    ]
+
+    print(f'{"stream":<28} {"tokens":>7} {"us":>10} {"ns/token":>10}')
+    for name, scope, tokens in cases:
+        timer = timeit.Timer(lambda: feed(scope, tokens))
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(repeat=5, number=number)) / number
+        print(f'{name:<28} {len(tokens):>7} {seconds * 1e6:>10.1f} {seconds / len(tokens) * 1e9:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Время холодного запуска: загрузка и проверка всех шаблонов и первая отрисовка
+в новом процессе - без дискового кеша, с пустым и с заполненным кешем.
+
+Запуск из корня проекта::
+
+    python benchmarks/template_cold_start.py
+
+"""
+import glob
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PATTERNS = ['apps/*/templates/**/*.xml', 'events/templates/**/*.xml']
+RUNS = 7
+
+# settings.py (через template_extensions) требует переменные окружения,
+# для отрисовки шаблонов их значения не важны
+SETTINGS_ENVIRONMENT = dict.fromkeys([
+    'TOKEN', 'OPERATOR_TOKEN', 'BOT_NAME', 'SUPPORT_CHAT_ID', 'TECH_SUPPORT_CHAT_ID',
+    'PAYMENTS', 'DATABASE_URL', 'LOGGING_DIRECTORY'
+], '0')
+
+
+def child(cache_directory: str):
+    """ Выполняется в отдельном процессе, печатает время импорта и время
+        от начала загрузки шаблонов до первой отрисовки, в мс """
+    started = time.perf_counter()
+
+    os.chdir(ROOT)
+    sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+
+    import template
+    from template_for_aiogram import aiogram_syntax, aiogram_scopes
+
+    template.set_default_syntax(aiogram_syntax)
+    template.set_disk_cache_directory(cache_directory or None)
+
+    # noinspection PyUnresolvedReferences
+    import template_extensions
+
+    imported = time.perf_counter()
+
+    paths = itertools.chain(*(sorted(glob.glob(pattern, recursive=True)) for pattern in PATTERNS))
+    template.preload(paths, aiogram_scopes)
+    template.render('apps/botpiska/templates/message-terms.xml', {})
+
+    finished = time.perf_counter()
+    print((imported - started) * 1000, (finished - imported) * 1000)
+
+
+def run(cache_directory: str) -> tuple[float, float]:
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', cache_directory],
+        check=True, capture_output=True, text=True, env={**os.environ, **SETTINGS_ENVIRONMENT}
+    ).stdout
+    imports, templates = map(float, output.split())
+    return imports, templates
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        disabled = [run('') for _ in range(RUNS)]
+        cold = run(directory)
+        warm = [run(directory) for _ in range(RUNS)]
+
+    print(f'{"mode":<20} {"imports, ms":>12} {"templates, ms":>14} {"total, ms":>10}')
+    for mode, runs in (('no disk cache', disabled), ('empty disk cache', [cold]), ('filled disk cache', warm)):
+        imports = statistics.median(imports for imports, _ in runs)
+        templates = statistics.median(templates for _, templates in runs)
+        print(f'{mode:<20} {imports:>12.1f} {templates:>14.1f} {imports + templates:>10.1f}')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,91 @@
+"""
+Сравнение отрисовки шаблонов через скомпилированные функции и
+через интерпретацию дерева элементов.
+
+Запуск из корня проекта::
+
+    python benchmarks/template_compilation.py
+
+"""
+import sys
+import timeit
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+
+import template
+import template.dev
+from template_for_aiogram import aiogram_syntax
+
+ORDER_LIST = """
+<message requires="orders">
+    <heading> СПИСОК ЗАКАЗОВ </heading>
+    <p for="order in orders">
+        <span if="order.processing_employee_id"> 🔹 </span>
+        <span else=""> 🔸 </span>
+        #{order.id} {order.subscription.title}
+    </p>
+    <p if="not orders"> Нет заказов. </p>
+
+    <inline-keyboard>
+        <row> <button callback_data="order-list-update"> Обновить </button> </row>
+        <row> <button callback_data="order-get-unprocessed"> Получить необработанный </button> </row>
+    </inline-keyboard>
+</message>
+"""
+
+
+def make_orders(count: int) -> list:
+    subscription = types.SimpleNamespace(title='Spotify Individual')
+    return [
+        types.SimpleNamespace(id=i, processing_employee_id=i if i % 3 else None, subscription=subscription)
+        for i in range(count)
+    ]
+
+
+def cases():
+    subscription = types.SimpleNamespace(title='Spotify Individual')
+    bill = types.SimpleNamespace(pay_url='https://example.com/bill')
+
+    yield 'message-terms.xml', \
+        template.load_template(ROOT / 'apps/botpiska/templates/message-terms.xml').document, {}
+
+    yield 'message-bill.xml', \
+        template.load_template(ROOT / 'apps/botpiska/templates/message-bill.xml').document, {
+            'bill-image': 'FILE-ID',
+            'subscription': subscription,
+            'bill': bill,
+            'is_gifts_allowed': True
+        }
+
+    document = template.dev.parse_string(ORDER_LIST)
+    for count in (10, 100):
+        yield f'order-list x{count}', document, {'orders': make_orders(count)}
+
+
+def measure(document, context, compiled: bool) -> float:
+    """ Возвращает среднее время одной отрисовки в микросекундах """
+    template.dev.set_compilation_enabled(compiled)
+
+    def run():
+        template.dev.render_document(document, context, syntax=aiogram_syntax)
+
+    run()  # прогрев, в том числе компиляция
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def main():
+    print(f'{"template":<24} {"interpreted, us":>16} {"compiled, us":>14} {"speedup":>8}')
+    for name, document, context in cases():
+        interpreted = measure(document, context, compiled=False)
+        compiled = measure(document, context, compiled=True)
+        print(f'{name:<24} {interpreted:>16.1f} {compiled:>14.1f} {interpreted / compiled:>7.2f}x')
+    template.dev.set_compilation_enabled(True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Сравнение разбора шаблонов в minidom и в компактное представление движка:
+время разбора, время обхода дерева (узлы, атрибуты, текст) и память,
+занимаемая деревьями всех шаблонов.
+
+Запуск из корня проекта::
+
+    python benchmarks/template_parsing.py
+
+"""
+import glob
+import itertools
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+from xml.dom import minidom
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+PATTERNS = ['apps/*/templates/**/*.xml', 'events/templates/**/*.xml']
+
+import template.dev
+
+
+def traverse_minidom(node) -> int:
+    """ Обходит дерево так, как это делал движок: атрибуты копируются в словарь """
+    count = 1
+    if node.nodeType == node.ELEMENT_NODE:
+        dict(node.attributes.items())
+    elif node.nodeType == node.TEXT_NODE:
+        node.nodeValue.strip()
+    for child in node.childNodes:
+        count += traverse_minidom(child)
+    return count
+
+
+def traverse_compact(node) -> int:
+    count = 1
+    if node.nodeType == node.ELEMENT_NODE:
+        dict(node.attrs)
+    elif node.nodeType == node.TEXT_NODE:
+        len(node.nodeValue)
+    for child in node.childNodes:
+        count += traverse_compact(child)
+    return count
+
+
+def measure(function) -> float:
+    """ Среднее время вызова, в микросекундах """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def memory(function) -> int:
+    """ Память, занимаемая результатом function, в байтах """
+    tracemalloc.start()
+    try:
+        result = function()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    paths = sorted(set(itertools.chain.from_iterable(
+        glob.glob(str(ROOT / pattern), recursive=True) for pattern in PATTERNS
+    )))
+    contents = [Path(path).read_bytes() for path in paths]
+
+    front_ends = [
+        ('minidom', minidom.parseString, traverse_minidom),
+        ('compact', template.dev.parse_string, traverse_compact),
+    ]
+
+    print(f'{len(paths)} templates, {sum(map(len, contents)) / 1024:.1f} KiB')
+    print(f'{"front-end":<10} {"parse, ms":>10} {"traverse, ms":>13} {"nodes":>7} {"memory, KiB":>12}')
+    for name, parse, traverse in front_ends:
+        documents = [parse(content) for content in contents]
+        parse_time = measure(lambda: [parse(content) for content in contents])
+        traverse_time = measure(lambda: [traverse(document) for document in documents])
+        nodes = sum(map(traverse, documents))
+        size = memory(lambda: [parse(content) for content in contents])
+        print(f'{name:<10} {parse_time / 1000:>10.2f} {traverse_time / 1000:>13.2f} {nodes:>7} {size / 1024:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""
+Бенчмарк отрисовки всех шаблонов из apps/*/templates и events/templates
+на сгенерированных контекстах: поддельные подписки, заказы, сезоны и клиенты,
+списки заказов из 10/100/1000 элементов. Для каждого шаблона выводятся
+пропускная способность, задержки p50/p99 и пик выделенной памяти (tracemalloc).
+
+Запуск из корня проекта::
+
+    python benchmarks/template_render.py
+    python benchmarks/template_render.py --save benchmarks/baseline.json
+    python benchmarks/template_render.py --compare benchmarks/baseline.json
+
+С --compare выводится изменение p50 относительно сохранённого результата,
+код возврата 1 - если хоть один шаблон замедлился больше, чем на --threshold.
+
+"""
+import argparse
+import dataclasses
+import datetime
+import decimal
+import gc
+import glob
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+PATTERNS = ['apps/*/templates/**/*.xml', 'events/templates/**/*.xml']
+ORDER_LIST_SIZES = (10, 100, 1000)
+
+MIN_ROUNDS = 30
+MAX_ROUNDS = 2000
+MIN_TIME = 0.5
+""" Каждый шаблон отрисовывается, пока не пройдёт MIN_TIME секунд,
+    но не меньше MIN_ROUNDS и не больше MAX_ROUNDS раз """
+
+# settings.py (через template_extensions) требует переменные окружения,
+# для отрисовки шаблонов их значения не важны
+SETTINGS_ENVIRONMENT = dict.fromkeys([
+    'TOKEN', 'OPERATOR_TOKEN', 'BOT_NAME', 'SUPPORT_CHAT_ID', 'TECH_SUPPORT_CHAT_ID',
+    'PAYMENTS', 'DATABASE_URL', 'LOGGING_DIRECTORY'
+], '0')
+
+
+# FIXTURES ----------------------------------------------------------
+# Повторяют поля и свойства моделей, которые используют шаблоны, но
+# не обращаются к базе данных
+
+@dataclasses.dataclass
+class FakeSubscriptionGroup:
+    description: str = 'все подписки Spotify'
+
+
+@dataclasses.dataclass
+class FakeCouponType:
+    id: str = 'SPOTIFY-15'
+    discount: decimal.Decimal = decimal.Decimal(15)
+    subscription_group: FakeSubscriptionGroup = dataclasses.field(default_factory=FakeSubscriptionGroup)
+
+
+@dataclasses.dataclass
+class FakeCoupon:
+    code: str = 'SUMMER2023'
+    discount: decimal.Decimal = decimal.Decimal(15)
+    type: FakeCouponType = dataclasses.field(default_factory=FakeCouponType)
+
+
+@dataclasses.dataclass
+class FakeSubscription:
+    id: str = 'spotify-individual-1m'
+    service_id: str = 'spotify'
+    short_title: str = 'Individual, 1 месяц'
+    title: str = 'Spotify Individual, 1 месяц'
+    price: decimal.Decimal = decimal.Decimal('199.00')
+    duration: datetime.timedelta = datetime.timedelta(days=30)
+    is_featured: bool = False
+
+    @property
+    def monthly_price(self) -> decimal.Decimal:
+        return self.price / decimal.Decimal(self.duration.days / 30)
+
+
+@dataclasses.dataclass
+class FakeClient:
+    chat_id: int = 100001
+    season_points: int = 150
+    rating_position: int = 12
+    clients_invited: int = 3
+
+
+@dataclasses.dataclass
+class FakeOrder:
+    id: int = 1
+    client_id: int = 100001
+    subscription: FakeSubscription = dataclasses.field(default_factory=FakeSubscription)
+    coupon: Optional[FakeCoupon] = None
+    processing_employee_id: Optional[int] = None
+    paid_amount: decimal.Decimal = decimal.Decimal('169.15')
+    closed_at: Optional[datetime.datetime] = None
+
+    @property
+    def coupon_id(self) -> Optional[str]:
+        return self.coupon and self.coupon.code
+
+    @property
+    def is_free(self) -> bool:
+        return self.processing_employee_id is None and self.closed_at is None
+
+    @property
+    def is_processed(self) -> bool:
+        return self.processing_employee_id is not None and self.closed_at is None
+
+    @property
+    def is_closed(self) -> bool:
+        return self.closed_at is not None
+
+
+@dataclasses.dataclass
+class FakePrize:
+    """ Приз сезона или лотереи """
+    id: int = 1
+    coupon_type_id: str = 'SPOTIFY-15'
+    banner: str = 'apps/seasons/resources/prize.png'
+    title: str = 'Скидка 15% на Spotify'
+    description: str = 'Купон на скидку 15% на любую подписку Spotify'
+    cost: int = 300
+
+
+@dataclasses.dataclass
+class FakeSeason:
+    title: str = 'Лето'
+    prizes: tuple = (FakePrize(1, cost=100), FakePrize(2, cost=300), FakePrize(3, cost=600))
+    current_prize_index: int = 1
+    current_prize_days_left: int = 12
+
+    @property
+    def current_prize(self) -> FakePrize:
+        return self.prizes[self.current_prize_index]
+
+
+SUBSCRIPTIONS = [
+    FakeSubscription(),
+    FakeSubscription('spotify-individual-3m', short_title='Individual, 3 месяца',
+                     title='Spotify Individual, 3 месяца', price=decimal.Decimal('549.00'),
+                     duration=datetime.timedelta(days=90), is_featured=True),
+    FakeSubscription('spotify-duo-1m', short_title='Duo, 1 месяц', title='Spotify Duo, 1 месяц',
+                     price=decimal.Decimal('269.00')),
+]
+
+
+def fake_order(number: int) -> FakeOrder:
+    """ Заказы по очереди: свободный, взятый в обработку, с купоном """
+    return FakeOrder(
+        id=number,
+        client_id=100000 + number,
+        subscription=SUBSCRIPTIONS[number % len(SUBSCRIPTIONS)],
+        coupon=FakeCoupon() if number % 3 == 2 else None,
+        processing_employee_id=200001 if number % 3 == 1 else None,
+    )
+
+
+FIXTURES: dict[str, Callable[[], object]] = {
+    'a': lambda: True,
+    'b': lambda: False,
+    'banner': lambda: 'apps/posting/resources/banner.png',
+    'bill': lambda: dataclasses.make_dataclass('FakeBill', [('pay_url', str)])('https://pay.example/bill?id=1&sign=2'),
+    'bill-image': lambda: 'BILL-IMAGE-FILE-ID',
+    'bonus': lambda: 50,
+    'client': FakeClient,
+    'content': lambda: 'Розыгрыш среди подписчиков!',
+    'coupon': FakeCoupon,
+    'deep-link': lambda: 'https://t.me/botpiska_bot?start=100001',
+    'featured': lambda: SUBSCRIPTIONS[1],
+    'gift-card-image': lambda: 'GIFT-CARD-FILE-ID',
+    'is_gifts_allowed': lambda: True,
+    'is_prize_bought': lambda: False,
+    'operator': lambda: 200001,
+    'order': lambda: fake_order(2),
+    'prize': FakePrize,
+    'reference_id': lambda: 42,
+    'season': FakeSeason,
+    'services': lambda: [],
+    'subscription': lambda: SUBSCRIPTIONS[0],
+    'subscription_plans': lambda: [(SUBSCRIPTIONS[0], None), (SUBSCRIPTIONS[1], 10), (SUBSCRIPTIONS[2], None)],
+}
+""" Значение переменной контекста по её имени """
+
+VARIANTS: dict[str, dict[str, Callable[[], object]]] = {
+    'orders': {f'{size} orders': (lambda size=size: [fake_order(i) for i in range(size)]) for size in ORDER_LIST_SIZES},
+}
+""" Переменные, для которых каждый шаблон отрисовывается в нескольких вариантах """
+
+
+def uploaded_resource(value, context, _) -> str:
+    """ Спецификатор rs для уже загруженных ресурсов: file-id без обращения к базе """
+    from template.dev import compile_format
+    return f'FILE-ID:{compile_format(value).format(context)}'
+
+
+# BENCHMARK ---------------------------------------------------------
+
+def setup():
+    os.chdir(ROOT)
+    os.environ.update({**SETTINGS_ENVIRONMENT, **os.environ})
+    sys.path[:0] = [str(ROOT), str(ROOT / 'libs')]
+
+    import template
+    from template.dev import specifiers
+    from template_for_aiogram import aiogram_syntax
+
+    template.set_default_syntax(aiogram_syntax)
+
+    # noinspection PyUnresolvedReferences
+    import template_extensions
+
+    specifiers['rs'] = uploaded_resource
+
+
+def cases() -> list[tuple[str, str, dict]]:
+    """ (путь, вариант, контекст) для каждого шаблона-документа """
+    import template
+    from template.dev import str2list
+    from template_for_aiogram import aiogram_syntax, aiogram_scopes
+
+    paths = itertools.chain(*(sorted(glob.glob(pattern, recursive=True)) for pattern in PATTERNS))
+    report = template.preload(paths, aiogram_scopes)
+
+    result = []
+    for info in report.templates:
+        # Встраиваемые шаблоны (<template>) отрисовываются в составе документов
+        document = template.load_template(info.path).document
+        if document.documentElement.tagName not in aiogram_syntax.handlers:
+            continue
+
+        # <message requires="..."> может требовать переменные, которые сам не использует
+        variables = info.variables.union(*(
+            str2list(element.getAttribute('requires'))
+            for element in document.getElementsByTagName('*') if element.hasAttribute('requires')
+        ))
+
+        if missing := variables - FIXTURES.keys() - VARIANTS.keys():
+            raise SystemExit(f'{info.path}: No fixtures for {sorted(missing)}, add them to FIXTURES')
+
+        fixed = {name: FIXTURES[name] for name in variables if name in FIXTURES}
+        varying = [
+            [(variant, name, factory) for variant, factory in VARIANTS[name].items()]
+            for name in sorted(variables & VARIANTS.keys())
+        ]
+
+        for combination in itertools.product(*varying):
+            context = {name: factory() for name, factory in fixed.items()}
+            context.update((name, factory()) for _, name, factory in combination)
+            variant = ', '.join(variant for variant, _, _ in combination)
+            result.append((info.path, variant, context))
+
+    return result
+
+
+def measure(path: str, context: dict) -> dict:
+    import template
+
+    template.render(path, context)
+
+    # Как и timeit, сборщик мусора на время замеров выключается
+    durations = []
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while len(durations) < MAX_ROUNDS and (len(durations) < MIN_ROUNDS or time.perf_counter() - started < MIN_TIME):
+            render_started = time.perf_counter_ns()
+            template.render(path, context)
+            durations.append(time.perf_counter_ns() - render_started)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        template.render(path, context)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'rounds': len(durations),
+        'throughput': len(durations) / (sum(durations) / 1e9),
+        'p50_us': statistics.median(durations) / 1000,
+        'p99_us': durations[min(len(durations) - 1, int(len(durations) * 0.99))] / 1000,
+        'peak_kib': (peak - before) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Template rendering benchmark')
+    parser.add_argument('--save', metavar='PATH', help='save results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare p50 against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative p50 slowdown treated as a regression (default: 0.10)')
+    parser.add_argument('--filter', default='', help='only templates whose path contains this string')
+    args = parser.parse_args()
+
+    setup()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)['templates']
+
+    results = {}
+    regressions = []
+
+    print(f'{"template":<72} {"renders/s":>10} {"p50, us":>9} {"p99, us":>9} {"peak, KiB":>10}'
+          + (f' {"p50 diff":>9}' if baseline is not None else ''))
+
+    for path, variant, context in cases():
+        if args.filter not in path:
+            continue
+
+        name = f'{path} [{variant}]' if variant else path
+        result = results[name] = measure(path, context)
+
+        line = f'{name:<72} {result["throughput"]:>10.0f} {result["p50_us"]:>9.1f} ' \
+               f'{result["p99_us"]:>9.1f} {result["peak_kib"]:>10.1f}'
+
+        if baseline is not None and name in baseline:
+            change = result['p50_us'] / baseline[name]['p50_us'] - 1
+            line += f' {change:>+9.1%}'
+            if change > args.threshold:
+                regressions.append(name)
+
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'templates': results,
+            }, file, indent=2, ensure_ascii=False)
+        print(f'Saved to {args.save}')
+
+    if regressions:
+        print(f'{len(regressions)} template(s) got slower by more than {args.threshold:.0%}:')
+        print('\n'.join(f'  {name}' for name in regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,622 @@
+"""
+Рассылки, переживающие перезапуск бота.
+
+Рассылка (задача) сохраняется в таблицу BroadcastJob: различающиеся
+сообщения, получатели и курсор - сколько получателей уже обработано.
+Рассылка по шаблону (enqueue_template) вместо готовых сообщений хранит
+шаблон, общий контекст и различающиеся изменяющиеся части контекста, а
+сообщения отрисовываются обработчиком по мере отправки: обработка события
+не тратит время на отрисовку для всех получателей, а файлы, загруженные
+первыми получателями, остальным отрисовываются уже с file_id.
+Фоновые обработчики (start) отправляют сообщения через rate_limit и
+периодически сохраняют курсор (каждые CHECKPOINT_EVERY получателей или
+CHECKPOINT_INTERVAL секунд), так что после перезапуска задача
+продолжается с последней контрольной точки. Ход рассылки отображается в
+сообщении, которое периодически изменяется.
+
+Внутри задачи сообщения отправляются одновременно (send_all): получатели
+читаются по мере освобождения окна отправки (SendWindow), размер окна
+уменьшается вдвое при TelegramRetryAfter (отправку при этом повторяет
+retry) и постепенно восстанавливается.
+Курсор - число получателей, до которого обработаны все, поэтому после
+перезапуска повторно могут получить сообщение только получатели,
+обработанные после последней контрольной точки, и не более WINDOW
+отправлявшихся в момент остановки.
+
+Использование::
+
+    >>> broadcast.start([gls.bot, gls.operator_bot])
+    ...
+    >>> broadcast.enqueue(((chat, post) for chat in receivers), gls.bot, progress_chat=user.id)
+    >>> broadcast.enqueue_template('message-lottery.xml', {'banner': banner},
+    ...                            ((chat, {'prize': prize}) for chat, prize in prizes), gls.bot)
+
+"""
+import asyncio
+import dataclasses
+import datetime
+import importlib
+import inspect
+import json
+import logging
+import time
+import typing
+
+import aiogram
+import aiogram.exceptions
+import aiogram.types
+import peewee
+
+import rate_limit
+import resources
+import retry
+import template
+from message_render import MessageRender, MessageRenderList
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+""" Количество одновременно выполняемых рассылок """
+WINDOW = 8
+""" Наибольшее число одновременно отправляемых сообщений одной рассылки """
+PROGRESS_INTERVAL = 5
+""" Как часто обновляется сообщение с ходом рассылки, в секундах """
+CHECKPOINT_EVERY = 50
+""" Через сколько обработанных получателей сохраняется курсор рассылки """
+CHECKPOINT_INTERVAL = 2
+""" Наибольшее время между сохранениями курсора рассылки, в секундах """
+
+_KEYBOARD_TYPES = {
+    cls.__name__: cls
+    for cls in (aiogram.types.InlineKeyboardMarkup, aiogram.types.ReplyKeyboardMarkup,
+                aiogram.types.ReplyKeyboardRemove)
+}
+
+
+# Сохранение сообщений ----------------------------------------------
+
+def _dump_media(media) -> typing.Optional[dict]:
+    if media is None:
+        return None
+    if isinstance(media, str):
+        return {'file_id': media}
+    if isinstance(media, aiogram.types.FSInputFile):
+        return {'path': str(media.path)}
+    raise ValueError(f'{type(media).__name__} can not be stored in a broadcast, use file_id or FSInputFile')
+
+
+def _load_media(data: typing.Optional[dict]):
+    if data is None:
+        return None
+    if 'file_id' in data:
+        return data['file_id']
+    return aiogram.types.FSInputFile(data['path'])
+
+
+def dump_messages(messages: MessageRenderList) -> list[dict]:
+    """ Приводит сообщения к виду, пригодному для сохранения в JSON """
+    return [
+        {
+            'text': message.text,
+            'photo': _dump_media(message.photo),
+            'animation': _dump_media(message.animation),
+            'keyboard': None if message.keyboard is None else {
+                'type': type(message.keyboard).__name__,
+                'data': message.keyboard.dict(exclude_none=True)
+            }
+        }
+        for message in messages
+    ]
+
+
+def load_messages(data: list[dict]) -> MessageRenderList:
+    """ Восстанавливает сообщения, сохранённые dump_messages """
+    return MessageRenderList(
+        MessageRender(
+            item['text'],
+            photo=_load_media(item['photo']),
+            animation=_load_media(item['animation']),
+            keyboard=None if item['keyboard'] is None else
+            _KEYBOARD_TYPES[item['keyboard']['type']](**item['keyboard']['data'])
+        )
+        for item in data
+    )
+
+
+def _has_files(messages: MessageRenderList) -> bool:
+    """ Есть ли в сообщениях файлы, которые будут загружаться в Telegram """
+    return any(
+        isinstance(media, aiogram.types.FSInputFile)
+        for message in messages
+        for media in (message.photo, message.animation)
+    )
+
+
+def _use_uploaded(messages: MessageRenderList, bot: aiogram.Bot) -> MessageRenderList:
+    """ Заменяет файлы, которые бот уже загрузил в Telegram, их file_id. Исходные
+        сообщения не изменяются - они могут быть общими для многих получателей """
+    def uploaded(media):
+        if isinstance(media, aiogram.types.FSInputFile):
+            return resources.find(media.path, bot) or media
+        return media
+
+    return MessageRenderList(
+        dataclasses.replace(message, photo=uploaded(message.photo), animation=uploaded(message.animation))
+        for message in messages
+    )
+
+
+def _dump_value(value):
+    """ Приводит значение контекста шаблона к виду, пригодному для сохранения в JSON.
+        Модели peewee сохраняются ссылкой (класс и первичный ключ) """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_dump_value(item) for item in value]
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value) and '$model' not in value:
+        return {key: _dump_value(item) for key, item in value.items()}
+    if isinstance(value, peewee.Model):
+        return {'$model': f'{type(value).__module__}.{type(value).__qualname__}', 'id': value.get_id()}
+    raise ValueError(f'{type(value).__name__} can not be stored in a broadcast, use JSON values or peewee models')
+
+
+def _load_value(data, models: dict = None):
+    """ Восстанавливает значение, сохранённое _dump_value. Модели загружаются
+        из базы, по разу на models (общий для всех значений задачи) """
+    models = {} if models is None else models
+
+    if isinstance(data, list):
+        return [_load_value(item, models) for item in data]
+    if not isinstance(data, dict):
+        return data
+    if '$model' not in data:
+        return {key: _load_value(item, models) for key, item in data.items()}
+
+    key = data['$model'], data['id']
+    if key not in models:
+        module, _, name = data['$model'].rpartition('.')
+        models[key] = getattr(importlib.import_module(module), name).get_by_id(data['id'])
+    return models[key]
+
+
+# Одновременная отправка -------------------------------------------
+
+@dataclasses.dataclass
+class JobCallbacks:
+    """ Обработчики событий рассылки. Хранятся только в памяти процесса,
+        после перезапуска рассылка продолжается без них """
+    on_every_success: typing.Callable = None
+    on_every_forbidden: typing.Callable = None
+    on_every_error: typing.Callable = None
+    on_completion: typing.Callable = None
+
+
+async def _handle(handler: typing.Optional[typing.Callable], *args):
+    if handler is None:
+        return
+    result = handler(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _handle_safely(handler: typing.Optional[typing.Callable], *args):
+    """ Как _handle, но ошибка обработчика только пишется в лог - она не должна
+        менять результат отправки """
+    # noinspection PyBroadException
+    try:
+        await _handle(handler, *args)
+    except Exception:
+        logger.exception(f'Broadcast callback {getattr(handler, "__name__", handler)} failed')
+
+
+@dataclasses.dataclass
+class SendWindowStats:
+    sent: int = 0
+    """ Обработано получателей """
+    retry_after: int = 0
+    """ Получено TelegramRetryAfter """
+    paused: float = 0
+    """ Суммарное время остановки отправки по TelegramRetryAfter, в секундах """
+    min_limit: int = 0
+    """ Наименьший размер окна за время работы """
+
+
+class SendWindow:
+    """
+    Ограничивает число одновременно отправляемых сообщений. Размер окна
+    меняется по AIMD: при TelegramRetryAfter он уменьшается вдвое, а отправка
+    останавливается на retry_after секунд; после limit успешных отправок
+    подряд окно увеличивается на 1, но не больше maximum.
+    """
+
+    def __init__(self, maximum: int = WINDOW, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.in_flight = 0
+        self.paused_until = 0.
+        self.stats = SendWindowStats(min_limit=maximum)
+
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """ Ожидает свободного места в окне """
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.in_flight < self.limit)
+                # Пока ждали места, отправку могли остановить
+                if self.paused_until <= time.monotonic():
+                    self.in_flight += 1
+                    return
+
+    async def release(self):
+        """ Освобождает место в окне """
+        async with self._condition:
+            self.in_flight -= 1
+            self.stats.sent += 1
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+            self._condition.notify_all()
+
+    def throttle(self, retry_after: float):
+        """ Telegram ответил TelegramRetryAfter: окно уменьшается, отправка останавливается """
+        self.stats.retry_after += 1
+        self._successes = 0
+        self.limit = max(self.minimum, self.limit // 2)
+        self.stats.min_limit = min(self.stats.min_limit, self.limit)
+
+        now = time.monotonic()
+        resume = now + retry_after
+        if resume > self.paused_until:
+            self.stats.paused += resume - max(self.paused_until, now)
+            self.paused_until = resume
+
+
+async def send_all(deliveries: typing.Iterable[tuple[int, MessageRenderList]], bot: aiogram.Bot,
+                   window: SendWindow = None, callbacks: JobCallbacks = None,
+                   on_result: typing.Callable[[int, bool], typing.Any] = None) -> int:
+    """
+    Отправляет сообщения получателям, по window.limit одновременно.
+    Получатели читаются из deliveries по мере освобождения окна.
+
+    :param deliveries: Пары (чат, сообщения).
+    :param bot: Бот, от имени которого выполняется отправка.
+    :param window: Окно отправки, по умолчанию - новое на WINDOW сообщений.
+    :param callbacks: Обработчики событий рассылки (кроме on_completion).
+    :param on_result: Вызывается после обработки каждого получателя
+        с его номером в deliveries и признаком успешной отправки.
+    :return: Количество успешных отправок.
+    """
+    window = window or SendWindow()
+    callbacks = callbacks or JobCallbacks()
+    # Очередь не длиннее окна: получатели не читаются заранее
+    queue = asyncio.Queue(maxsize=window.maximum)
+    uploading = asyncio.Lock()
+    succeeded = 0
+
+    async def send(chat: int, messages: MessageRenderList):
+        # Повторы после TelegramRetryAfter выполняет retry, окно только уменьшается
+        with rate_limit.broadcast(), retry.listen(window.throttle):
+            return await messages.send(chat, bot=bot)
+
+    async def transmit(chat: int, messages: MessageRenderList):
+        if not _has_files(messages):
+            return await send(chat, messages)
+
+        # Файл загружается в Telegram одним получателем, остальные ждут
+        # загрузки и отправляют уже его file_id
+        async with uploading:
+            messages = _use_uploaded(messages, bot)
+            if _has_files(messages):
+                return await send(chat, messages)
+        return await send(chat, messages)
+
+    async def deliver(chat: int, messages: MessageRenderList) -> bool:
+        nonlocal succeeded
+
+        await window.acquire()
+        try:
+            result = await transmit(chat, messages)
+
+        except Exception as error:
+            if isinstance(error, aiogram.exceptions.TelegramForbiddenError):
+                await _handle_safely(callbacks.on_every_forbidden, chat)
+            elif not isinstance(error, aiogram.exceptions.TelegramAPIError):
+                logger.exception(f'Broadcast failed to send to {chat}')
+            await _handle_safely(callbacks.on_every_error, chat)
+            return False
+
+        finally:
+            await window.release()
+
+        # Сообщение уже доставлено - ошибка обработчика этого не меняет
+        succeeded += 1
+        await _handle_safely(callbacks.on_every_success, result)
+        return True
+
+    async def sender():
+        while (item := await queue.get()) is not None:
+            position, chat, messages = item
+            await _handle(on_result, position, await deliver(chat, messages))
+
+    async def producer():
+        for position, (chat, messages) in enumerate(deliveries):
+            await queue.put((position, chat, messages))
+        for _ in range(window.maximum):
+            await queue.put(None)
+
+    # Ошибка в любой из задач (например, в on_result) прерывает остальные
+    tasks = [asyncio.create_task(producer())]
+    tasks.extend(asyncio.create_task(sender()) for _ in range(window.maximum))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return succeeded
+
+
+# Задачи ------------------------------------------------------------
+
+_bots: dict[int, aiogram.Bot] = {}
+_queue: typing.Optional[asyncio.Queue] = None
+_workers: list[asyncio.Task] = []
+_callbacks: dict[int, JobCallbacks] = {}
+
+
+def _create_job(payloads: typing.Iterable[tuple[int, typing.Any]], bot: aiogram.Bot,
+                progress_chat: typing.Optional[int], callbacks: dict, **fields) -> int:
+    """ Сохраняет рассылку и ставит её в очередь. payloads - пары (чат, данные
+        в JSON виде), одинаковые данные сохраняются один раз """
+    from apps.posting.models import BroadcastJob
+
+    keys: dict[str, int] = {}
+    receivers = []
+    previous = key = None
+    for chat, data in payloads:
+        # Одни и те же данные для всех получателей (rs.notify) сериализуются один раз
+        if data is not previous:
+            previous, key = data, json.dumps(data, ensure_ascii=False, sort_keys=True)
+        receivers.append([chat, keys.setdefault(key, len(keys))])
+
+    job = BroadcastJob.create(
+        bot_id=bot.id,
+        messages=[json.loads(key) for key in keys],
+        receivers=receivers,
+        progress_chat_id=progress_chat,
+        created_at=datetime.datetime.now(),
+        **fields
+    )
+
+    if callbacks:
+        _callbacks[job.id] = JobCallbacks(**callbacks)
+    if _queue is not None:
+        _queue.put_nowait(job.id)
+    else:
+        logger.warning(f'Broadcast #{job.id} is saved, but workers are not started - '
+                       f'it will be sent after broadcast.start()')
+
+    return job.id
+
+
+def enqueue(deliveries: typing.Iterable[tuple[int, MessageRenderList]], bot: aiogram.Bot,
+            progress_chat: int = None, **callbacks) -> int:
+    """
+    Сохраняет рассылку готовых сообщений и ставит её в очередь фоновых обработчиков.
+    Если сообщения для разных получателей отрисовываются из шаблона - см. enqueue_template.
+
+    :param deliveries: Пары (чат, сообщения) в порядке отправки. Одинаковые
+        сообщения сохраняются один раз.
+    :param bot: Бот, от имени которого выполняется рассылка.
+    :param progress_chat: Чат, в котором отображается ход рассылки.
+    :param callbacks: Обработчики событий, см. JobCallbacks.
+    :return: ID рассылки. Если обработчики ещё не запущены (start), рассылка
+        только сохраняется и начнётся после вызова start.
+    :raises ValueError: Если сообщения содержат файлы, которые нельзя сохранить
+        (например, BufferedInputFile).
+    """
+    def dump(items):
+        previous = data = None
+        for chat, messages in items:
+            if messages is not previous:
+                previous, data = messages, dump_messages(messages)
+            yield chat, data
+
+    return _create_job(dump(deliveries), bot, progress_chat, callbacks)
+
+
+def enqueue_template(path: str, context: dict, receivers: typing.Iterable[tuple[int, dict]],
+                     bot: aiogram.Bot, progress_chat: int = None, **callbacks) -> int:
+    """
+    Сохраняет рассылку по шаблону и ставит её в очередь фоновых обработчиков.
+    Сообщения отрисовываются обработчиком по мере отправки (template.render_many).
+
+    :param path: Путь к файлу шаблона.
+    :param context: Общий для всех получателей контекст.
+    :param receivers: Пары (чат, изменяющаяся часть контекста) в порядке отправки.
+        Одинаковые части сохраняются один раз.
+    :param bot: Бот, от имени которого выполняется рассылка.
+    :param progress_chat: Чат, в котором отображается ход рассылки.
+    :param callbacks: Обработчики событий, см. JobCallbacks.
+    :return: ID рассылки (см. enqueue).
+    :raises ValueError: Если контекст содержит значения, которые нельзя сохранить -
+        допустимы значения JSON и модели peewee (загружаются заново по первичному ключу).
+    """
+    return _create_job(
+        ((chat, _dump_value(item)) for chat, item in receivers),
+        bot, progress_chat, callbacks,
+        template=str(path), context=_dump_value(context)
+    )
+
+
+def _progress_text(job, finished: bool) -> str:
+    total = len(job.receivers)
+    text = f'Рассылка #{job.id}: отправлено {job.succeeded} из {total}, не доставлено {job.failed}'
+    if finished:
+        return f'{text}. Рассылка завершена'
+
+    limiter = rate_limit.get_limiter(_bots[job.bot_id])
+    return f'{text}. Осталось не менее {(total - job.cursor) / limiter.rate:.0f} сек'
+
+
+async def _show_progress(job, bot: aiogram.Bot, finished: bool = False):
+    """ Отправляет или изменяет сообщение с ходом рассылки. Ошибки игнорируются -
+        рассылка важнее отображения её хода """
+    if job.progress_chat_id is None:
+        return
+
+    text = _progress_text(job, finished)
+    try:
+        if job.progress_message_id is None:
+            message = await MessageRender(text).send(job.progress_chat_id, bot=bot)
+            job.progress_message_id = message.message_id
+            job.save(only=[type(job).progress_message_id])
+        else:
+            await rate_limit.acquire(bot, job.progress_chat_id)
+            await bot.edit_message_text(text, chat_id=job.progress_chat_id, message_id=job.progress_message_id)
+    except aiogram.exceptions.TelegramAPIError as error:
+        logger.warning(f'Could not show progress of broadcast #{job.id}: {error}')
+
+
+async def _run(job_id: int, window: int):
+    from apps.posting.models import BroadcastJob
+
+    job = BroadcastJob.get_by_id(job_id)
+    if job.finished_at is not None:
+        return
+
+    bot = _bots[job.bot_id]
+    # Обработчики запущены не из обработки события - бота в контексте нет,
+    # а он нужен отрисовке шаблонов и ресурсам (rs)
+    aiogram.Bot.set_current(bot)
+    callbacks = _callbacks.get(job.id) or JobCallbacks()
+
+    await _show_progress(job, bot)
+    shown = time.monotonic()
+
+    offset = job.cursor
+    completed: set[int] = set()
+    """ Обработанные получатели за курсором (отправленные раньше предыдущих) """
+    unsaved = 0
+    saved = time.monotonic()
+
+    def checkpoint(**fields):
+        nonlocal unsaved, saved
+        BroadcastJob.update(cursor=job.cursor, succeeded=job.succeeded, failed=job.failed, **fields) \
+            .where(BroadcastJob.id == job.id).execute()
+        unsaved, saved = 0, time.monotonic()
+
+    async def on_result(position: int, ok: bool):
+        nonlocal shown, unsaved
+
+        if ok:
+            job.succeeded += 1
+        else:
+            job.failed += 1
+
+        # Курсор сдвигается до первого необработанного получателя
+        completed.add(offset + position)
+        while job.cursor in completed:
+            completed.remove(job.cursor)
+            job.cursor += 1
+
+        # Запрос к базе блокирует event loop, поэтому курсор сохраняется не после каждого получателя
+        unsaved += 1
+        if unsaved >= CHECKPOINT_EVERY or time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+            checkpoint()
+
+        if time.monotonic() - shown >= PROGRESS_INTERVAL:
+            shown = time.monotonic()
+            await _show_progress(job, bot)
+
+    receivers = job.receivers[offset:]
+    if job.template is None:
+        messages = [load_messages(data) for data in job.messages]
+        renders = (messages[index] for _, index in receivers)
+    else:
+        # Получатели читаются по мере освобождения окна отправки, поэтому
+        # и отрисовываются - по мере отправки
+        models = {}
+        contexts = [_load_value(data, models) for data in job.messages]
+        renders = template.render_many(job.template, _load_value(job.context, models),
+                                       (contexts[index] for _, index in receivers))
+
+    deliveries = zip((chat for chat, _ in receivers), renders)
+    await send_all(deliveries, bot, SendWindow(window), callbacks, on_result)
+
+    job.finished_at = datetime.datetime.now()
+    checkpoint(finished_at=job.finished_at)
+
+    await _show_progress(job, bot, finished=True)
+    _callbacks.pop(job.id, None)
+    await _handle(callbacks.on_completion, job.succeeded, len(job.receivers))
+
+
+async def _worker(window: int):
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _run(job_id, window)
+        except Exception:
+            logger.exception(f'Broadcast #{job_id} was interrupted')
+        finally:
+            _queue.task_done()
+
+
+def start(bots: typing.Iterable[aiogram.Bot], workers: int = WORKERS, window: int = WINDOW):
+    """
+    Запускает фоновые обработчики рассылок и ставит в очередь все незавершённые
+    рассылки (прерванные перезапуском). Должна вызываться из запущенного event loop-а,
+    после подключения к базе данных.
+
+    :param bots: Боты, от имени которых выполняются рассылки.
+    :param workers: Количество одновременно выполняемых рассылок.
+    :param window: Наибольшее число одновременно отправляемых сообщений одной рассылки.
+    """
+    global _queue
+    from apps.posting.models import BroadcastJob
+
+    _bots.update((bot.id, bot) for bot in bots)
+    _queue = asyncio.Queue()
+
+    unfinished = BroadcastJob.select(BroadcastJob.id) \
+        .where(BroadcastJob.finished_at.is_null()) \
+        .order_by(BroadcastJob.id)
+    for job in unfinished:
+        logger.info(f'Resuming broadcast #{job.id}')
+        _queue.put_nowait(job.id)
+
+    _workers.extend(asyncio.create_task(_worker(window)) for _ in range(workers))
+
+
+def get_queue_size() -> int:
+    """ Количество рассылок, ожидающих обработчика """
+    return 0 if _queue is None else _queue.qsize()
+
+
+__all__ = (
+    'WORKERS',
+    'PROGRESS_INTERVAL',
+    'CHECKPOINT_EVERY',
+    'CHECKPOINT_INTERVAL',
+    'WINDOW',
+    'dump_messages',
+    'load_messages',
+    'JobCallbacks',
+    'SendWindowStats',
+    'SendWindow',
+    'send_all',
+    'enqueue',
+    'enqueue_template',
+    'start',
+    'get_queue_size',
+)
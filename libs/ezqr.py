@@ -119,3 +119,42 @@ def single(model: typing.Type[T], query: str, args: QueryArgs, db: peewee.Databa
     row = next(query_result)
     fields = dict(zip(columns, row))
     return model(**fields)
+
+
+def join_relations(query: peewee.ModelSelect, relations: typing.Iterable[str]) -> peewee.ModelSelect:
+    """
+    Присоединяет к запросу модели по цепочкам ForeignKey полей и добавляет их
+    в выборку. Связанные объекты загружаются тем же запросом, а не отдельным
+    запросом на каждую запись при первом обращении к полю. Связи, которые могут
+    быть пустыми, и всё, что идёт после них, присоединяются через LEFT OUTER JOIN.
+
+    >>> orders = join_relations(Order.select(), ['subscription', 'coupon.type'])
+    >>> orders[0].coupon.type  # Без дополнительных запросов
+    CouponType(...)
+    """
+    joined = {'': (query.model, False)}
+
+    for relation in relations:
+        path = ''
+        for name in relation.split('.'):
+            source, outer = joined[path]
+            path = f'{path}.{name}' if path else name
+            if path in joined:
+                continue
+
+            model = source.model if isinstance(source, peewee.ModelAlias) else source
+            field = model._meta.fields.get(name)
+            if not isinstance(field, peewee.ForeignKeyField):
+                raise ValueError(f'"{relation}": {model.__name__}.{name} is not a ForeignKeyField')
+
+            target = field.rel_model.alias()
+            outer = outer or field.null
+            query = query.join_from(
+                source, target,
+                peewee.JOIN.LEFT_OUTER if outer else peewee.JOIN.INNER,
+                on=(getattr(source, name) == getattr(target, field.rel_field.name)),
+                attr=name
+            ).select_extend(target)
+            joined[path] = target, outer
+
+    return query
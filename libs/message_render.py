@@ -1,11 +1,73 @@
 """ ... """
+import collections
 import dataclasses
+import logging
 import typing
 
 import aiogram.types
 import aiogram.exceptions
 
+import rate_limit
 import resources
+import retry
+
+logger = logging.getLogger(__name__)
+
+EDIT_CACHE_SIZE = 1024
+""" Для скольких сообщений запоминается содержимое после изменения """
+
+TMessageKey = tuple[int, int, int]
+""" (id бота, id чата, id сообщения) """
+
+
+@dataclasses.dataclass
+class EditCacheInfo:
+    skipped: int = 0
+    """ Изменения, не отправленные в Telegram, так как содержимое не изменилось """
+    performed: int = 0
+    """ Изменения, отправленные в Telegram """
+    currsize: int = 0
+    """ Сколько сообщений сейчас запомнено """
+
+
+_edit_cache: collections.OrderedDict[TMessageKey, tuple] = collections.OrderedDict()
+_edit_cache_info = EditCacheInfo()
+
+
+def _media_fingerprint(media) -> typing.Optional[typing.Hashable]:
+    if media is None or isinstance(media, str):
+        return media
+    if isinstance(media, aiogram.types.FSInputFile):
+        return 'path', str(media.path)
+    raise TypeError('Media can not be fingerprinted')
+
+
+def _remember_upload(media, file_id: str, bot: aiogram.Bot):
+    """ Если медиа было загружено из файла - запоминает его file_id. Сообщение
+        уже отправлено, поэтому ошибка сохранения только пишется в лог """
+    if not isinstance(media, aiogram.types.FSInputFile):
+        return
+    # noinspection PyBroadException
+    try:
+        resources.load(media.path, file_id, bot)
+    except Exception:
+        logger.exception(f'Could not save file_id of {media.path}')
+
+
+def forget_message(bot: aiogram.Bot, chat_id: int, message_id: int):
+    """ Забывает содержимое сообщения (например, после удаления) """
+    _edit_cache.pop((bot.id, chat_id, message_id), None)
+
+
+def forget_all():
+    """ Забывает содержимое всех сообщений (например, между прогонами бенчмарка) """
+    _edit_cache.clear()
+
+
+def get_edit_cache_info() -> EditCacheInfo:
+    """ Статистика пропуска изменений с неизменившимся содержимым """
+    _edit_cache_info.currsize = len(_edit_cache)
+    return _edit_cache_info
 
 
 @dataclasses.dataclass
@@ -24,10 +86,15 @@ class MessageRender:
             raise ValueError('Message can not contain both a photo and an animation at the same time')
 
     async def send(self, chat_id: int, bot: aiogram.Bot = None):
-        """ Отправляет сообщение в указанный чат """
+        """ Отправляет сообщение в указанный чат. При TelegramRetryAfter
+            и временных ошибках отправка повторяется (см. retry) """
 
         self.validate()
         bot = bot or aiogram.Bot.get_current()
+        return await retry.call(lambda: self._send(chat_id, bot))
+
+    async def _send(self, chat_id: int, bot: aiogram.Bot):
+        await rate_limit.acquire(bot, chat_id)
 
         if self.photo:
             message = await bot.send_photo(
@@ -39,10 +106,7 @@ class MessageRender:
 
             # Если фото было загружено из файла - запоминаем его file_id
             # NOTICE: Создаёт зависимость между message_render и resources
-            if isinstance(self.photo, aiogram.types.FSInputFile):
-                file_id = message.photo[0].file_id
-                path = self.photo.path
-                resources.load(path, file_id)
+            _remember_upload(self.photo, message.photo[0].file_id, bot)
 
             return message
 
@@ -54,10 +118,7 @@ class MessageRender:
                 reply_markup=self.keyboard
             )
 
-            if isinstance(self.animation, aiogram.types.FSInputFile):
-                file_id = message.animation.file_id
-                path = self.animation.path
-                resources.load(path, file_id)
+            _remember_upload(self.animation, message.animation.file_id, bot)
 
             return message
 
@@ -67,12 +128,48 @@ class MessageRender:
             reply_markup=self.keyboard
         )
 
+    def fingerprint(self) -> typing.Optional[tuple]:
+        """ Содержимое сообщения в сравнимом виде: текст, медиа, клавиатура.
+            None - сравнить нельзя (медиа загружается не из файла) """
+        try:
+            media = _media_fingerprint(self.photo), _media_fingerprint(self.animation)
+        except TypeError:
+            return None
+        keyboard = None if self.keyboard is None else self.keyboard.json(exclude_none=True)
+        return self.text, media, keyboard
+
     async def edit(self, message: aiogram.types.Message, bot: aiogram.Bot = None):
-        """ Редактирует указанное сообщение """
+        """ Редактирует указанное сообщение. При TelegramRetryAfter
+            и временных ошибках изменение повторяется (см. retry).
+
+            Если это сообщение уже было изменено на такое же содержимое,
+            запрос к Telegram не выполняется и возвращается message """
 
         self.validate()
 
         bot = bot or aiogram.Bot.get_current()
+        key = bot.id, message.chat.id, message.message_id
+        fingerprint = self.fingerprint()
+
+        if fingerprint is not None and _edit_cache.get(key) == fingerprint:
+            _edit_cache.move_to_end(key)
+            _edit_cache_info.skipped += 1
+            return message
+
+        # Пока изменение не выполнено, содержимое сообщения неизвестно
+        _edit_cache.pop(key, None)
+        result = await retry.call(lambda: self._edit(message, bot))
+        _edit_cache_info.performed += 1
+
+        if fingerprint is not None:
+            _edit_cache[key] = fingerprint
+            if len(_edit_cache) > EDIT_CACHE_SIZE:
+                _edit_cache.popitem(last=False)
+
+        return result
+
+    async def _edit(self, message: aiogram.types.Message, bot: aiogram.Bot):
+        await rate_limit.acquire(bot, message.chat.id)
         config = {}
 
         if self.keyboard:
@@ -97,10 +194,7 @@ class MessageRender:
                 **config
             )
 
-            if isinstance(self.photo, aiogram.types.FSInputFile):
-                file_id = message.photo[0].file_id
-                path = self.photo.path
-                resources.load(path, file_id)
+            _remember_upload(self.photo, message.photo[0].file_id, bot)
 
             return message
 
@@ -115,10 +209,7 @@ class MessageRender:
                 **config
             )
 
-            if isinstance(self.animation, aiogram.types.FSInputFile):
-                file_id = message.animation.file_id
-                path = self.animation.path
-                resources.load(path, file_id)
+            _remember_upload(self.animation, message.animation.file_id, bot)
 
             return message
 
@@ -137,14 +228,16 @@ class MessageRenderList(list[MessageRender]):
     """ ... """
 
     async def send(self, chat_id: int, bot: aiogram.Bot = None) -> list[typing.Optional[aiogram.types.Message]]:
-        """ Отправляет все сообщения в указанный чат """
+        """ Отправляет все сообщения в указанный чат. Ожидание повторов
+            ограничено для всех сообщений вместе (см. retry.action) """
         sent_messages = []
-        for message in self:
-            try:
-                sent_message = await message.send(chat_id, bot=bot)
-            except aiogram.exceptions.TelegramForbiddenError:
-                sent_message = None
-            sent_messages.append(sent_message)
+        with retry.action():
+            for message in self:
+                try:
+                    sent_message = await message.send(chat_id, bot=bot)
+                except aiogram.exceptions.TelegramForbiddenError:
+                    sent_message = None
+                sent_messages.append(sent_message)
         return sent_messages
 
     def extract(self) -> typing.Optional[MessageRender]:
@@ -159,6 +252,11 @@ class MessageRenderList(list[MessageRender]):
 
 
 __all__ = (
+    'EDIT_CACHE_SIZE',
+    'EditCacheInfo',
+    'forget_message',
+    'forget_all',
+    'get_edit_cache_info',
     'MessageRender',
     'MessageRenderList'
 )
@@ -0,0 +1,214 @@
+"""
+Ограничение частоты запросов к Telegram Bot API.
+
+У каждого бота (aiogram.Bot, по id) свой планировщик: общий token bucket
+на GLOBAL_RATE сообщений в секунду и по token bucket-у на каждый чат
+(PER_CHAT_RATE в секунду, до PER_CHAT_BURST подряд). Запросы, выполняемые
+внутри `with broadcast()`, считаются рассылкой и пропускают вперёд
+интерактивные запросы, ожидающие общего лимита.
+
+Использование::
+
+    >>> await rate_limit.acquire(bot, chat_id)
+    >>> await bot.send_message(chat_id, text)
+
+"""
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import time
+import typing
+
+import aiogram
+
+GLOBAL_RATE = 30
+""" Сообщений в секунду от одного бота во все чаты """
+PER_CHAT_RATE = 1
+""" Сообщений в секунду от одного бота в один чат """
+PER_CHAT_BURST = 3
+""" Сколько сообщений подряд можно отправить в чат без ожидания """
+CHAT_BUCKETS_LIMIT = 10_000
+""" При превышении из планировщика удаляются корзины чатов, которые давно не использовались """
+
+_broadcast: contextvars.ContextVar[bool] = contextvars.ContextVar('rate_limit_broadcast', default=False)
+
+
+@contextlib.contextmanager
+def broadcast():
+    """ Запросы внутри блока считаются рассылкой: они уступают интерактивным """
+    token = _broadcast.set(True)
+    try:
+        yield
+    finally:
+        _broadcast.reset(token)
+
+
+class TokenBucket:
+    """ Корзина на capacity токенов, пополняемая со скоростью rate токенов в секунду """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """ Время до появления токена, в секундах. 0 - токен есть """
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclasses.dataclass
+class RateLimiterStats:
+    interactive_waiting: int = 0
+    """ Интерактивные запросы, ожидающие сейчас """
+    broadcast_waiting: int = 0
+    """ Запросы рассылок, ожидающие сейчас """
+    acquired: int = 0
+    """ Всего пропущенных запросов """
+    delayed: int = 0
+    """ Сколько из них пришлось ждать """
+    total_wait: float = 0
+    """ Суммарное время ожидания, в секундах """
+    max_wait: float = 0
+    """ Наибольшее время ожидания, в секундах """
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.delayed if self.delayed else 0
+
+
+class RateLimiter:
+    """ Планировщик запросов одного бота """
+
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 per_chat_burst: float = PER_CHAT_BURST, clock: typing.Callable[[], float] = time.monotonic):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.clock = clock
+
+        self.bucket = TokenBucket(rate, rate, clock())
+        self.chats: dict[int, TokenBucket] = {}
+        self.stats = RateLimiterStats()
+
+        self._interactive_blocked = 0
+        """ Интерактивные запросы, ожидающие общего лимита - рассылки их пропускают """
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        try:
+            return self.chats[chat_id]
+        except KeyError:
+            pass
+
+        if len(self.chats) >= CHAT_BUCKETS_LIMIT:
+            # Полная корзина ничем не отличается от новой
+            self.chats = {chat: bucket for chat, bucket in self.chats.items() if not bucket.is_full(now)}
+
+        bucket = self.chats[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst, now)
+        return bucket
+
+    async def acquire(self, chat_id: int, broadcast: bool = None) -> float:
+        """
+        Ожидает, пока запрос в чат можно будет выполнить, не превысив лимиты.
+
+        :param chat_id: Чат, в который выполняется запрос.
+        :param broadcast: Является ли запрос частью рассылки,
+            по умолчанию - выполняется ли он внутри `with broadcast()`.
+        :return: Время ожидания, в секундах.
+        """
+        if broadcast is None:
+            broadcast = _broadcast.get()
+
+        started = self.clock()
+        waiting = 'broadcast_waiting' if broadcast else 'interactive_waiting'
+        setattr(self.stats, waiting, getattr(self.stats, waiting) + 1)
+        blocked = False
+        slept = False
+
+        try:
+            while True:
+                now = self.clock()
+                chat = self._chat_bucket(chat_id, now)
+                global_delay = self.bucket.delay(now)
+                delay = max(global_delay, chat.delay(now))
+
+                if broadcast and self._interactive_blocked:
+                    delay = max(delay, 1 / self.bucket.rate)
+
+                if not broadcast and blocked != (global_delay > 0):
+                    blocked = not blocked
+                    self._interactive_blocked += 1 if blocked else -1
+
+                if delay <= 0:
+                    break
+                slept = True
+                await asyncio.sleep(delay)
+
+            self.bucket.take()
+            chat.take()
+
+        finally:
+            setattr(self.stats, waiting, getattr(self.stats, waiting) - 1)
+            if blocked:
+                self._interactive_blocked -= 1
+
+        waited = self.clock() - started if slept else 0
+        self.stats.acquired += 1
+        if slept:
+            self.stats.delayed += 1
+            self.stats.total_wait += waited
+            self.stats.max_wait = max(self.stats.max_wait, waited)
+        return waited
+
+
+_limiters: dict[int, RateLimiter] = {}
+
+
+def get_limiter(bot: aiogram.Bot) -> RateLimiter:
+    """ Возвращает планировщик бота, создавая его при первом обращении """
+    try:
+        return _limiters[bot.id]
+    except KeyError:
+        limiter = _limiters[bot.id] = RateLimiter()
+        return limiter
+
+
+async def acquire(bot: aiogram.Bot, chat_id: int) -> float:
+    """ Ожидает возможности выполнить запрос от bot в chat_id (см. RateLimiter.acquire) """
+    return await get_limiter(bot).acquire(chat_id)
+
+
+def get_stats() -> dict[int, RateLimiterStats]:
+    """ Статистика планировщиков: id бота -> статистика """
+    return {bot_id: limiter.stats for bot_id, limiter in _limiters.items()}
+
+
+__all__ = (
+    'GLOBAL_RATE',
+    'PER_CHAT_RATE',
+    'PER_CHAT_BURST',
+    'broadcast',
+    'TokenBucket',
+    'RateLimiterStats',
+    'RateLimiter',
+    'get_limiter',
+    'acquire',
+    'get_stats',
+)
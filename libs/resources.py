@@ -4,52 +4,76 @@ import typing
 import aiogram.types
 import peewee
 
-_resource_cache = {}
+_resource_cache: dict[tuple[int, str], str] = {}
+""" (id бота, путь) -> file-id. У каждого бота file-id свои """
+_database_queries = 0
+""" Запросы к базе данных, выполненные модулем (поиск и сохранение file-id) """
 
 
-def resource(path: str) -> typing.Union[aiogram.types.InputFile, str]:
-    """ Возвращает file-id ресурса, или InputFile для его загрузки """
+def find(path: str, bot: aiogram.Bot = None) -> typing.Optional[str]:
+    """ Возвращает file-id ресурса, None - если файл ещё не загружен ботом """
     from apps.maintenance.models import ResourceCache
-    global _resource_cache
+    global _resource_cache, _database_queries
+
+    bot = bot or aiogram.Bot.get_current()
+    key = bot.id, str(path)
 
     # Will try to get resource from cache, if failed continues
     with contextlib.suppress(KeyError):
-        return _resource_cache[path]
+        return _resource_cache[key]
 
-    # Tries to get resource from database, if failed continues
-    bot = aiogram.Bot.get_current()
+    # Tries to get resource from database, if failed returns None
     with contextlib.suppress(peewee.DoesNotExist):
 
         # Getting from database
+        _database_queries += 1
         res = ResourceCache.select().where(
-            ResourceCache.bot_id == bot.id, ResourceCache.path == path
+            ResourceCache.bot_id == bot.id, ResourceCache.path == key[1]
         ).get()
 
         # Saving to cache (if found in database)
-        _resource_cache[path] = res.file_id
+        _resource_cache[key] = res.file_id
 
         return res.file_id
 
+
+def resource(path: str, bot: aiogram.Bot = None) -> typing.Union[aiogram.types.InputFile, str]:
+    """ Возвращает file-id ресурса, или InputFile для его загрузки """
+    file_id = find(path, bot)
+
     # Returns resource from file system
-    return aiogram.types.FSInputFile(path)
+    if file_id is None:
+        return aiogram.types.FSInputFile(path)
+    return file_id
 
 
-def load(path: str, file_id: str) -> None:
-    """ Загружает file-id в систему """
+def load(path: str, file_id: str, bot: aiogram.Bot = None) -> None:
+    """ Загружает file-id в систему. Бот указывается явно, если его
+        нет в контексте (например, в фоновых задачах) """
     from apps.maintenance.models import ResourceCache
-    global _resource_cache
+    global _resource_cache, _database_queries
 
-    bot = aiogram.Bot.get_current()
+    bot = bot or aiogram.Bot.get_current()
 
     # Saving to cache
-    _resource_cache[path] = file_id
+    _resource_cache[bot.id, str(path)] = file_id
 
-    # Saving to database
-    ResourceCache(
-        path=path,
+    # Saving to database. The same file may be uploaded by several
+    # concurrent sends, the last file-id wins
+    _database_queries += 1
+    ResourceCache.insert(
+        path=str(path),
         bot_id=bot.id,
         file_id=file_id
-    ).save(force_insert=True)
+    ).on_conflict(
+        conflict_target=[ResourceCache.bot_id, ResourceCache.path],
+        update={ResourceCache.file_id: file_id}
+    ).execute()
+
+
+def get_database_queries() -> int:
+    """ Число запросов к базе данных, выполненных модулем с запуска бота """
+    return _database_queries
 
 
-__all__ = ('resource',)
+__all__ = ('find', 'resource', 'load', 'get_database_queries')
@@ -10,12 +10,14 @@ class ResponseConfig:
     waiting: MessageRender | None
     answer: str | None
     lock: str
+    waiting_delay: float | None = None
+    """ Через сколько секунд показывать waiting, None - WAITING_DELAY (см. middleware) """
 
 
-def configure(waiting: MessageRender = None, answer: str = None, lock: str = None):
+def configure(waiting: MessageRender = None, answer: str = None, lock: str = None, waiting_delay: float = None):
     """ ... """
 
     async def _filter(*_, **__) -> dict | bool:
-        return {'__response_config': ResponseConfig(waiting, answer, lock)}
+        return {'__response_config': ResponseConfig(waiting, answer, lock, waiting_delay)}
 
     return _filter
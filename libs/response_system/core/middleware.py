@@ -1,4 +1,6 @@
+import asyncio
 import contextlib
+import dataclasses
 import datetime
 import logging
 import typing
@@ -15,6 +17,28 @@ from .responses import Response
 
 logger = logging.getLogger(__name__)
 
+WAITING_DELAY = 0.4
+""" Через сколько секунд после начала обработки показывается сообщение ожидания """
+
+
+@dataclasses.dataclass
+class WaitingStats:
+    scheduled: int = 0
+    """ Обработчики, для которых было запланировано сообщение ожидания """
+    shown: int = 0
+    """ Сколько раз сообщение ожидания было отправлено """
+
+    @property
+    def skipped(self) -> int:
+        """ Обработчики, завершившиеся раньше, чем понадобилось сообщение ожидания """
+        return self.scheduled - self.shown
+
+
+waiting_stats = WaitingStats()
+
+_cleanups: set[asyncio.Task] = set()
+""" Фоновые удаления сообщений ожидания (ссылки, чтобы задачи не собрал сборщик мусора) """
+
 
 class ResponseMiddleware:
     def __init__(self):
@@ -49,7 +73,10 @@ class ResponseMiddleware:
 
         waiting = None
         if config and config.waiting:
-            waiting = WaitingMessageManager(config.waiting)
+            waiting = WaitingMessageManager(
+                config.waiting,
+                WAITING_DELAY if config.waiting_delay is None else config.waiting_delay
+            )
 
         with lock or contextlib.nullcontext():
 
@@ -68,12 +95,11 @@ class ResponseMiddleware:
                 except UserFriendlyException as error:
                     response = error.response()
 
-            for action in response:
-                try:
-                    await action
-                except Exception:
-                    logger.error('RESPONSE EXCEPTION AT (' + getattr(handler, '__name__', 'handler') + ')')
-                    raise
+            try:
+                await response.execute()
+            except Exception:
+                logger.error('RESPONSE EXCEPTION AT (' + getattr(handler, '__name__', 'handler') + ')')
+                raise
 
             globals_.global_time.reset(global_time_cv_token)
             globals_.response_var.reset(response_var_cv_token)
@@ -103,21 +129,59 @@ class CallbackQueryResponseMiddleware(ResponseMiddleware):
 
 
 class WaitingMessageManager:
-    def __init__(self, render: MessageRender):
+    """ Показывает сообщение ожидания, если обработчик выполняется дольше delay
+        секунд, и удаляет его после выполнения. Быстрые обработчики не тратят
+        на него ни одного запроса к Telegram """
+
+    def __init__(self, render: MessageRender, delay: float = WAITING_DELAY):
         self.render: MessageRender = render
-        self.message: aiogram.types.Message
+        self.delay = delay
+        self.task: typing.Optional[asyncio.Task] = None
+        self.sending = False
+
+    async def _show(self, chat_id: int, bot: aiogram.Bot) -> typing.Optional[aiogram.types.Message]:
+        await asyncio.sleep(self.delay)
+
+        # Начатую отправку не отменяем - иначе сообщение может остаться в чате
+        self.sending = True
+        waiting_stats.shown += 1
+        with contextlib.suppress(aiogram.exceptions.TelegramForbiddenError):
+            return await self.render.send(chat_id, bot=bot)
 
     async def __aenter__(self):
         # noinspection PyTypeChecker
         chat: aiogram.types.Chat = aiogram.types.Chat.get_current()
-        with contextlib.suppress(aiogram.exceptions.TelegramForbiddenError):
-            self.message = await self.render.send(chat.id)
+        waiting_stats.scheduled += 1
+        self.task = asyncio.create_task(self._show(chat.id, aiogram.Bot.get_current()))
+
+    async def _delete(self):
+        # Задача выполняется в фоне, её результат никто не получит - поэтому
+        # перехватываются все ошибки, а не только ошибки Telegram
+        try:
+            message = await self.task
+            if message is not None:
+                with contextlib.suppress(aiogram.exceptions.TelegramForbiddenError):
+                    await message.delete()
+        except aiogram.exceptions.TelegramAPIError as error:
+            logger.warning(f'Waiting message failed: {error}')
+        except Exception:
+            logger.exception('Waiting message failed')
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if not hasattr(self, 'message'):
+        if not self.sending:
+            self.task.cancel()
             return
-        with contextlib.suppress(aiogram.exceptions.TelegramForbiddenError):
-            await self.message.delete()
+
+        # Отправка может ждать повтора (retry) до MAX_WAIT секунд - ответ
+        # обработчика её не ждёт, сообщение удаляется в фоне после отправки
+        cleanup = asyncio.create_task(self._delete())
+        _cleanups.add(cleanup)
+        cleanup.add_done_callback(_cleanups.discard)
+
+
+def get_waiting_stats() -> WaitingStats:
+    """ Как часто сообщение ожидания действительно показывалось """
+    return waiting_stats
 
 
 class Lock:
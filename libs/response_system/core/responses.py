@@ -2,12 +2,15 @@ from __future__ import annotations
 
 import asyncio
 import inspect
+import itertools
 import typing
 
 import aiogram
 import aiogram.exceptions
 from sortedcontainers import SortedList
 
+import broadcast
+import message_render
 from message_render import MessageRender, MessageRenderList
 from . import globals_
 
@@ -24,10 +27,22 @@ FEEDBACK_VISIBILITY_TIME = 2
 __debugging__ = False
 
 
+TChatKey = tuple[int, int]
+""" (id бота, id чата) - переписка, в которую пишет действие """
+
+
+def chat_keys(bot: aiogram.Bot, chats: typing.Iterable[int]) -> frozenset[TChatKey]:
+    """ Переписки, в которые пишет действие, отправляющее сообщения от bot в chats """
+    return frozenset((bot.id, chat) for chat in chats)
+
+
 class Response:
     class ResponseActionItem(typing.NamedTuple):
         action: typing.Awaitable
         priority: int
+        chats: typing.Optional[frozenset[TChatKey]] = None
+        """ Переписки, в которые пишет действие. None - неизвестно, такое действие
+            выполняется отдельно от остальных действий с тем же приоритетом """
 
     def __init__(self):
         self.actions: SortedList = SortedList(key=lambda x: x.priority)
@@ -35,6 +50,15 @@ class Response:
     def __iter__(self):
         return (i.action for i in self.actions)
 
+    async def execute(self):
+        """
+        Выполняет действия в порядке приоритета. Действия с одинаковым
+        приоритетом выполняются одновременно, кроме пишущих в одну и ту же
+        переписку - они выполняются в порядке добавления.
+        """
+        for _, items in itertools.groupby(self.actions, key=lambda x: x.priority):
+            await _execute_band(list(items))
+
     def __add__(self, other: 'Response'):
         if other is None:
             return self
@@ -45,8 +69,57 @@ class Response:
 
     __iadd__ = __add__
 
-    def add_action(self, action: typing.Awaitable, priority: int):
-        self.actions.add(self.ResponseActionItem(action, priority))
+    def add_action(self, action: typing.Awaitable, priority: int,
+                   chats: typing.Iterable[TChatKey] = None):
+        self.actions.add(self.ResponseActionItem(action, priority, None if chats is None else frozenset(chats)))
+
+
+async def _execute_after(previous: list[asyncio.Future], action: typing.Awaitable):
+    try:
+        await asyncio.gather(*previous)
+    except BaseException:
+        # Предшествующее действие не выполнилось - это действие не выполняется вовсе
+        if inspect.iscoroutine(action):
+            action.close()
+        raise
+    await action
+
+
+async def _execute_band(items: list[Response.ResponseActionItem]):
+    """ Выполняет действия одного приоритета. Каждое действие ждёт только предыдущие
+        действия, пишущие в те же переписки, действие с неизвестными переписками - все
+        предыдущие (а все последующие - его) """
+    if len(items) == 1:
+        await items[0].action
+        return
+
+    tasks: list[asyncio.Future] = []
+    last: dict[TChatKey, asyncio.Future] = {}
+    barrier: typing.Optional[asyncio.Future] = None
+
+    for item in items:
+        if item.chats is None:
+            previous = list(tasks)
+        else:
+            previous = list({last[chat] for chat in item.chats if chat in last})
+            if barrier is not None:
+                previous.append(barrier)
+
+        task = asyncio.ensure_future(_execute_after(previous, item.action))
+        tasks.append(task)
+
+        if item.chats is None:
+            barrier = task
+            last.clear()
+        else:
+            last.update(dict.fromkeys(item.chats, task))
+
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
 
 
 def to_MessageRender(value: typing.Union[MessageRender, str]) -> MessageRender:
@@ -113,6 +186,8 @@ async def action_delete(
     if delay:
         await asyncio.sleep(delay)
 
+    message_render.forget_message(bot, chat, original)
+
     # noinspection PyBroadException
     try:
         result = await bot.delete_message(chat, original)
@@ -202,32 +277,20 @@ async def action_notify(
         on_every_success: TNotifyEverySuccessHandler = None,
         on_every_forbidden: TNotifyBasicSuccessHandler = None,
         on_every_error: TNotifyBasicSuccessHandler = None,
-        on_completion: TNotifyCompletionHandler = None
+        on_completion: TNotifyCompletionHandler = None,
+        progress_chat: int = None
 ):
-    succeeded = 0
-    # noinspection DuplicatedCode
-    for chat in receivers:
-        # noinspection PyBroadException
-        try:
-            result = await message.send(chat, bot=bot)
-            await handle(on_every_success, result)
-            succeeded += 1
-
-        except Exception as error:
-            do_raise = __debugging__ and on_every_error is None
-
-            if isinstance(error, aiogram.exceptions.TelegramForbiddenError):
-                do_raise = __debugging__ and on_every_forbidden is None
-                await handle(on_every_forbidden, chat)
-
-            await handle(on_every_error, chat)
-
-            if do_raise:
-                raise
-
-        await asyncio.sleep(0.5)
-
-    await on_completion(succeeded, len(receivers))
+    # Рассылка сохраняется в базу и выполняется фоновыми обработчиками,
+    # поэтому переживает перезапуск бота и не задерживает ответ
+    broadcast.enqueue(
+        ((chat, message) for chat in receivers),
+        bot,
+        progress_chat=progress_chat,
+        on_every_success=on_every_success,
+        on_every_forbidden=on_every_forbidden,
+        on_every_error=on_every_error,
+        on_completion=on_completion
+    )
 
 
 # ---
@@ -244,17 +307,21 @@ def edit(
 
         priority: int = 0
 ) -> Response:
+    original = original or globals_.message_var.get()
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_edit(
             to_MessageRender(message),
-            original or globals_.message_var.get(),
-            bot or aiogram.Bot.get_current(),
+            original,
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error
         ),
-        priority
+        priority,
+        chat_keys(bot, [original.chat.id])
     )
     return response
 
@@ -282,17 +349,20 @@ def delete(
     if isinstance(original, aiogram.types.Message):
         original, chat = original.message_id, original.chat.id
 
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_delete(
             original,
             chat,
-            bot or aiogram.Bot.get_current(),
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error
         ),
-        priority
+        priority,
+        chat_keys(bot, [chat])
     )
     return response
 
@@ -308,17 +378,21 @@ def send(
 
         priority: int = 2
 ) -> Response:
+    chat = chat or globals_.message_var.get().chat.id
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_send(
             to_MessageRenderList(message),
-            chat or globals_.message_var.get().chat.id,
-            bot or aiogram.Bot.get_current(),
+            chat,
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error
         ),
-        priority
+        priority,
+        chat_keys(bot, [chat])
     )
     return response
 
@@ -335,18 +409,22 @@ def feedback(
 
         priority: int = 3
 ) -> Response:
+    chat = chat or globals_.message_var.get().chat.id
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_feedback(
             to_MessageRender(message),
-            chat or globals_.message_var.get().chat.id,
-            bot or aiogram.Bot.get_current(),
+            chat,
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error,
             on_delete=on_delete
         ),
-        priority
+        priority,
+        chat_keys(bot, [chat])
     )
     return response
 
@@ -360,21 +438,27 @@ def notify(
         on_every_forbidden: TNotifyBasicSuccessHandler = None,
         on_every_error: TNotifyBasicSuccessHandler = None,
         on_completion: TNotifyCompletionHandler = None,
+        progress_chat: int = None,
 
         priority: int = 4
 ) -> Response:
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_notify(
             to_MessageRenderList(message),
             receivers,
-            bot or aiogram.Bot.get_current(),
+            bot,
             on_every_success=on_every_success,
             on_every_forbidden=on_every_forbidden,
             on_every_error=on_every_error,
-            on_completion=on_completion
+            on_completion=on_completion,
+            progress_chat=progress_chat
         ),
-        priority
+        priority,
+        # Действие только ставит рассылку в очередь, ни в одну переписку не пишет
+        frozenset()
     )
     return response
 
@@ -1,2 +1,3 @@
-from .core.middleware import ResponseMiddleware, MessageResponseMiddleware, CallbackQueryResponseMiddleware
+from .core.middleware import ResponseMiddleware, MessageResponseMiddleware, CallbackQueryResponseMiddleware, \
+    get_waiting_stats
 from .core.configure import configure
@@ -0,0 +1,159 @@
+"""
+Повтор запросов к Telegram Bot API.
+
+TelegramRetryAfter - запрос повторяется через retry_after секунд (с
+небольшой случайной добавкой, чтобы ожидавшие запросы не отправлялись
+одновременно). Временные ошибки сети и 5xx от Telegram - запрос
+повторяется с экспоненциально растущей задержкой. Суммарное ожидание
+одного действия ограничено MAX_WAIT секундами, после чего ошибка
+передаётся вызывающему.
+
+Использование::
+
+    >>> message = await retry.call(lambda: bot.send_message(chat_id, text))
+
+    >>> with retry.action():  # Общее ограничение ожидания для нескольких запросов
+    ...     for render in renders:
+    ...         await render.send(chat_id)
+
+"""
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import logging
+import random
+import time
+import typing
+
+import aiogram.exceptions
+
+logger = logging.getLogger(__name__)
+
+MAX_WAIT = 30
+""" Наибольшее суммарное ожидание одного действия, в секундах """
+MAX_ATTEMPTS = 5
+""" Наибольшее число попыток выполнить запрос при ошибках сети """
+BACKOFF_BASE = 0.5
+""" Задержка перед первым повтором при ошибке сети, в секундах. Далее удваивается """
+BACKOFF_MAX = 8
+""" Наибольшая задержка между повторами при ошибке сети, в секундах """
+JITTER = 0.1
+""" Случайная добавка к retry_after, доля от него """
+
+T = typing.TypeVar('T')
+
+_deadline: contextvars.ContextVar[typing.Optional[float]] = contextvars.ContextVar('retry_deadline', default=None)
+_listener: contextvars.ContextVar[typing.Optional[typing.Callable[[float], typing.Any]]] = \
+    contextvars.ContextVar('retry_listener', default=None)
+
+
+@dataclasses.dataclass
+class RetryStats:
+    retries: int = 0
+    """ Всего повторов """
+    retry_after: int = 0
+    """ Из них - после TelegramRetryAfter """
+    network_errors: int = 0
+    """ Из них - после ошибок сети и 5xx """
+    total_wait: float = 0
+    """ Суммарное время ожидания перед повторами, в секундах """
+    gave_up: int = 0
+    """ Сколько раз ошибка была передана вызывающему из-за ограничения ожидания или попыток """
+
+
+stats = RetryStats()
+
+
+@contextlib.contextmanager
+def action(max_wait: float = MAX_WAIT):
+    """ Запросы внутри блока - одно действие с общим ограничением ожидания.
+        Вложенные блоки используют ограничение внешнего """
+    if _deadline.get() is not None:
+        yield
+        return
+
+    token = _deadline.set(time.monotonic() + max_wait)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def listen(on_retry_after: typing.Callable[[float], typing.Any]):
+    """ on_retry_after(retry_after) вызывается при каждом TelegramRetryAfter
+        внутри блока - до ожидания (используется окном рассылки) """
+    token = _listener.set(on_retry_after)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def _backoff(attempt: int) -> float:
+    """ Задержка перед повтором номер attempt (с 1) после ошибки сети, "full jitter" """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+async def _wait(error: Exception, delay: float, deadline: float, counter: str):
+    """ Ожидает перед повтором или передаёт ошибку, если ожидание превысит ограничение """
+    if time.monotonic() + delay > deadline:
+        stats.gave_up += 1
+        raise error
+
+    logger.warning(f'Retrying in {delay:.2f}s after {type(error).__name__}: {error}')
+    stats.retries += 1
+    setattr(stats, counter, getattr(stats, counter) + 1)
+    stats.total_wait += delay
+    await asyncio.sleep(delay)
+
+
+async def call(request: typing.Callable[[], typing.Awaitable[T]]) -> T:
+    """
+    Выполняет запрос, повторяя его при TelegramRetryAfter и временных ошибках.
+    request вызывается заново для каждой попытки.
+
+    :raises aiogram.exceptions.TelegramRetryAfter: Если ожидание превысило бы MAX_WAIT.
+    :raises aiogram.exceptions.TelegramNetworkError: Если попытки закончились.
+    :raises aiogram.exceptions.TelegramServerError: Если попытки закончились.
+    """
+    with action():
+        deadline = _deadline.get()
+        failures = 0
+
+        while True:
+            try:
+                return await request()
+
+            except aiogram.exceptions.TelegramRetryAfter as error:
+                listener = _listener.get()
+                if listener is not None:
+                    listener(error.retry_after)
+                await _wait(error, error.retry_after * (1 + random.uniform(0, JITTER)), deadline, 'retry_after')
+
+            except (aiogram.exceptions.TelegramNetworkError, aiogram.exceptions.TelegramServerError) as error:
+                failures += 1
+                if failures >= MAX_ATTEMPTS:
+                    stats.gave_up += 1
+                    raise
+                await _wait(error, _backoff(failures), deadline, 'network_errors')
+
+
+def get_stats() -> RetryStats:
+    """ Счётчики повторов с запуска бота """
+    return stats
+
+
+__all__ = (
+    'MAX_WAIT',
+    'MAX_ATTEMPTS',
+    'BACKOFF_BASE',
+    'BACKOFF_MAX',
+    'JITTER',
+    'RetryStats',
+    'action',
+    'listen',
+    'call',
+    'get_stats',
+)
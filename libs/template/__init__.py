@@ -4,6 +4,22 @@
     >>> import template
     >>> template.render('path_to_template.xml', {}, syntax=...)
 
+Разобранные шаблоны кешируются, статистику кеша можно получить так::
+
+    >>> template.get_cache_info()
+    CacheInfo(hits=41, misses=3, currsize=3)
+
+Шаблоны можно загрузить и проверить заранее, например при запуске::
+
+    >>> template.preload(paths, scopes).elapsed
+    0.0312
+
+Время отрисовки по тегам можно замерить профилировщиком::
+
+    >>> with template.Profiler() as profiler:
+    ...     template.render('path_to_template.xml', {})
+    >>> print(profiler.report())
+
 """
 from ._template import (
 
@@ -14,11 +30,33 @@ from ._template import (
     ParsingCoroutineError,
     SpecifierError,
     ConvertingError,
+    QueryLimitError,
 
     get_default_syntax,
     set_default_syntax,
     get_global_context,
     set_global_context,
+    set_disk_cache_directory,
+    get_disk_cache_directory,
+    set_query_limit,
+    load_template,
+    include_template,
+    get_relations,
+    get_dependents,
+    get_cache_info,
+    clear_cache,
     render_string,
     render,
+    render_many,
+)
+from ._preload import (
+    TemplateInfo,
+    PreloadReport,
+    preload_template,
+    preload,
+)
+from ._profile import (
+    TagKey,
+    TagStats,
+    Profiler,
 )
@@ -0,0 +1,341 @@
+"""
+Компактное представление разобранных шаблонов.
+
+Шаблон разбирается expat-ом напрямую в узлы со __slots__: атрибуты хранятся
+кортежем пар (имя, значение), текст - уже без пробелов по краям, текст из
+одних пробелов не сохраняется вовсе. Имена полей повторяют minidom (nodeType,
+tagName, childNodes, nodeValue, ...), поэтому обработчикам, как правило,
+не важно, с каким из представлений они работают.
+
+Узлы minidom, переданные в движок (например, через Tag.process), приводятся
+к компактному виду функцией from_minidom.
+"""
+import sys
+import xml.dom
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Union
+from xml.parsers import expat
+
+
+class Node:
+    """ Базовый класс узлов. Константы типов совпадают с xml.dom.Node """
+    __slots__ = ('parentNode', 'ownerDocument', 'compiled_node', '__weakref__')
+
+    ELEMENT_NODE = xml.dom.Node.ELEMENT_NODE
+    TEXT_NODE = xml.dom.Node.TEXT_NODE
+    PROCESSING_INSTRUCTION_NODE = xml.dom.Node.PROCESSING_INSTRUCTION_NODE
+    DOCUMENT_NODE = xml.dom.Node.DOCUMENT_NODE
+
+    nodeType: int
+    nodeName: str
+
+    childNodes: tuple['Node', ...] = ()
+
+    def __init__(self, parent: Optional['Node'], document: Optional['Document']):
+        self.parentNode = parent
+        self.ownerDocument = document
+        self.compiled_node: Optional[dict] = None
+        """ Скомпилированные функции узла (см. ParsingScope.compile_node) """
+
+    # Скомпилированные функции - замыкания, они не сохраняются (дисковый кеш)
+
+    _TRANSIENT = frozenset({'compiled_node', 'compiled_children'})
+
+    def __getstate__(self):
+        return {
+            name: getattr(self, name)
+            for cls in type(self).__mro__
+            for name in getattr(cls, '__slots__', ())
+            if name != '__weakref__' and name not in self._TRANSIENT
+        }
+
+    def __setstate__(self, state: dict):
+        for name in self._TRANSIENT:
+            if hasattr(type(self), name):
+                setattr(self, name, None)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def getElementsByTagName(self, name: str) -> list['Element']:
+        """ Все элементы-потомки с указанным именем тега, '*' - все элементы """
+        return [node for node in self._iter_elements() if name == '*' or node.tagName == name]
+
+    def _iter_elements(self) -> Iterator['Element']:
+        for child in self.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE:
+                yield child
+                yield from child._iter_elements()
+
+
+class Attr(NamedTuple):
+    name: str
+    value: str
+
+
+class Attributes:
+    """ Атрибуты элемента в виде, совместимом с minidom.NamedNodeMap (только чтение) """
+    __slots__ = ('_pairs',)
+
+    def __init__(self, pairs: tuple[tuple[str, str], ...]):
+        self._pairs = pairs
+
+    def __getitem__(self, name: str) -> Attr:
+        for attribute, value in self._pairs:
+            if attribute == name:
+                return Attr(attribute, value)
+        raise KeyError(name)
+
+    def __contains__(self, name: str) -> bool:
+        return any(attribute == name for attribute, _ in self._pairs)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def get(self, name: str, default=None) -> Optional[Attr]:
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self) -> list[str]:
+        return [attribute for attribute, _ in self._pairs]
+
+    def values(self) -> list[str]:
+        return [value for _, value in self._pairs]
+
+    def items(self) -> list[tuple[str, str]]:
+        return list(self._pairs)
+
+
+class Element(Node):
+    __slots__ = ('tagName', 'attrs', 'childNodes', 'line', 'compiled_children')
+
+    nodeType = Node.ELEMENT_NODE
+
+    def __init__(self, tag_name: str, attrs: tuple[tuple[str, str], ...], parent: Optional[Node],
+                 document: Optional['Document'], line: Optional[int] = None):
+        super().__init__(parent, document)
+        self.tagName = tag_name
+        self.attrs = attrs
+        """ Атрибуты в порядке их следования в шаблоне: ((имя, значение), ...) """
+        self.childNodes: tuple[Node, ...] = ()
+        self.line = line
+        """ Номер строки файла шаблона, на которой начинается элемент """
+        self.compiled_children: Optional[dict] = None
+
+    @property
+    def nodeName(self) -> str:
+        return self.tagName
+
+    @property
+    def attributes(self) -> Attributes:
+        return Attributes(self.attrs)
+
+    def getAttribute(self, name: str) -> str:
+        for attribute, value in self.attrs:
+            if attribute == name:
+                return value
+        return ''
+
+    def hasAttribute(self, name: str) -> bool:
+        for attribute, _ in self.attrs:
+            if attribute == name:
+                return True
+        return False
+
+    def __repr__(self):
+        return f'<Element {self.tagName!r} at line {self.line}>'
+
+
+class Text(Node):
+    __slots__ = ('nodeValue',)
+
+    nodeType = Node.TEXT_NODE
+    nodeName = '#text'
+
+    def __init__(self, value: str, parent: Optional[Node], document: Optional['Document']):
+        super().__init__(parent, document)
+        self.nodeValue = value
+
+    @property
+    def data(self) -> str:
+        return self.nodeValue
+
+    def __repr__(self):
+        return f'<Text {self.nodeValue!r}>'
+
+
+class ProcessingInstruction(Node):
+    __slots__ = ('target', 'data')
+
+    nodeType = Node.PROCESSING_INSTRUCTION_NODE
+
+    def __init__(self, target: str, data: str, parent: Optional[Node], document: Optional['Document']):
+        super().__init__(parent, document)
+        self.target = target
+        self.data = data
+
+    @property
+    def nodeName(self) -> str:
+        return self.target
+
+    @property
+    def nodeValue(self) -> str:
+        return self.data
+
+
+class Document(Node):
+    __slots__ = ('childNodes', 'path', 'compiled_children')
+
+    nodeType = Node.DOCUMENT_NODE
+    nodeName = '#document'
+
+    def __init__(self):
+        super().__init__(None, None)
+        self.childNodes: tuple[Node, ...] = ()
+        self.path: Optional[str] = None
+        """ Путь к файлу шаблона, заполняется load_template """
+        self.compiled_children: Optional[dict] = None
+
+    @property
+    def documentElement(self) -> Optional[Element]:
+        for child in self.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE:
+                return child
+        return None
+
+
+class _Builder:
+    """ Строит документ по событиям expat """
+
+    def __init__(self):
+        self.document = Document()
+        self.parser = expat.ParserCreate()
+        self.parser.ordered_attributes = True
+        self.parser.buffer_text = True
+
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.character_data
+        self.parser.ProcessingInstructionHandler = self.processing_instruction
+        # Комментарий разделяет текст так же, как в minidom
+        self.parser.CommentHandler = lambda _: self.flush_text()
+
+        # Открытые элементы и их уже разобранные потомки
+        self.stack: list[tuple[Node, list[Node]]] = [(self.document, [])]
+        self.text: list[str] = []
+
+    def flush_text(self):
+        if not self.text:
+            return
+        value = ''.join(self.text).strip()
+        self.text.clear()
+        if value:
+            parent, children = self.stack[-1]
+            children.append(Text(value, parent, self.document))
+
+    def start_element(self, name: str, attributes: list[str]):
+        self.flush_text()
+        parent, children = self.stack[-1]
+        # [имя, значение, ...] -> ((имя, значение), ...)
+        attributes = map(sys.intern, attributes)
+        element = Element(sys.intern(name), tuple(zip(attributes, attributes)), parent, self.document,
+                          self.parser.CurrentLineNumber)
+        children.append(element)
+        self.stack.append((element, []))
+
+    def end_element(self, _):
+        self.flush_text()
+        element, children = self.stack.pop()
+        element.childNodes = tuple(children)
+
+    def character_data(self, data: str):
+        # Текст вне корневого элемента expat сюда не передаёт
+        self.text.append(data)
+
+    def processing_instruction(self, target: str, data: str):
+        self.flush_text()
+        parent, children = self.stack[-1]
+        children.append(ProcessingInstruction(target, data, parent, self.document))
+
+    def close(self) -> Document:
+        document, children = self.stack.pop()
+        document.childNodes = tuple(children)
+        # Обработчики parser-а ссылаются на builder - разрываем цикл, чтобы
+        # parser (вместе с буфером текста) освобождался сразу
+        self.parser = None
+        return document
+
+
+def parse_string(string: Union[str, bytes]) -> Document:
+    """ Разбирает шаблон из строки.
+
+        :raises xml.parsers.expat.ExpatError: Если шаблон - не корректный XML """
+    builder = _Builder()
+    builder.parser.Parse(string, True)
+    return builder.close()
+
+
+def parse_file(file: BinaryIO) -> Document:
+    """ Разбирает шаблон из открытого в бинарном режиме файла.
+
+        :raises xml.parsers.expat.ExpatError: Если шаблон - не корректный XML """
+    builder = _Builder()
+    builder.parser.ParseFile(file)
+    return builder.close()
+
+
+_ADAPTED_ATTRIBUTE = '_template_adapted'
+
+
+def _adapt(node: xml.dom.Node, parent: Optional[Node], document: Optional[Document]) -> Optional[Node]:
+    if node.nodeType in (node.TEXT_NODE, node.CDATA_SECTION_NODE):
+        value = node.nodeValue.strip()
+        return Text(value, parent, document) if value else None
+
+    if node.nodeType == node.PROCESSING_INSTRUCTION_NODE:
+        return ProcessingInstruction(node.target, node.data, parent, document)
+
+    if node.nodeType == node.ELEMENT_NODE:
+        result = Element(node.tagName, tuple(node.attributes.items()), parent, document,
+                         getattr(node, '_template_line', None))
+    elif node.nodeType == node.DOCUMENT_NODE:
+        result = document = Document()
+    else:
+        return None
+
+    result.childNodes = tuple(filter(None, (_adapt(child, result, document) for child in node.childNodes)))
+    return result
+
+
+def from_minidom(node: Union[Node, xml.dom.Node]) -> Optional[Node]:
+    """
+    Приводит узел minidom (вместе с потомками) к компактному представлению.
+    Узлы, уже имеющие компактный вид, возвращаются как есть. Результат
+    запоминается на исходном узле, чтобы скомпилированные функции не
+    создавались заново при каждой обработке. None - узел ничего не отображает
+    (комментарий, текст из одних пробелов).
+    """
+    if isinstance(node, Node):
+        return node
+
+    adapted = getattr(node, _ADAPTED_ATTRIBUTE, None)
+    if adapted is None:
+        adapted = _adapt(node, None, None)
+        try:
+            setattr(node, _ADAPTED_ATTRIBUTE, adapted)
+        except AttributeError:
+            pass
+    return adapted
+
+
+__all__ = (
+    'Node',
+    'Element',
+    'Document',
+    'parse_string',
+    'parse_file',
+    'from_minidom',
+)
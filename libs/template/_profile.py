@@ -0,0 +1,161 @@
+""" Профилирование отрисовки шаблонов по тегам """
+import dataclasses
+import time
+from typing import Callable, Generator, NamedTuple, Optional
+
+from ._nodes import Node
+from ._template import MutableVariable, RenderContext, get_template_line, get_template_path, set_profiler
+
+
+class TagKey(NamedTuple):
+    template: str
+    """ Путь к файлу шаблона, '<string>' для render_string """
+    tag: str
+    """ Имя тега, '#text' для текста """
+    line: Optional[int]
+
+
+@dataclasses.dataclass
+class TagStats:
+    calls: int = 0
+    """ Сколько раз узел был обработан """
+    total: float = 0
+    """ Время обработки узла вместе с вложенными узлами, в секундах """
+    own: float = 0
+    """ Время обработки узла без вложенных узлов, в секундах """
+    evaluations: int = 0
+    """ Выполненные python-выражения (if, for, спецификатор py) """
+    queries: int = 0
+    """ Запросы к базе данных, без запросов вложенных узлов """
+
+
+class Profiler:
+    """
+    Собирает время, количество обработок и выполненных выражений для каждого
+    тега шаблонов (шаблон, тег, строка), а также количество запросов к базе
+    данных, если передан query_counter - функция, возвращающая число
+    выполненных к данному моменту запросов.
+
+    Пока профилировщик активен, узлы шаблонов обрабатываются через него,
+    без пакетной отрисовки render_many. Статистика накапливается между
+    запусками, до вызова reset().
+
+    Пример использования::
+
+        >>> profiler = Profiler(query_counter=lambda: database.queries)
+        >>> with profiler:
+        ...     template.render('op-message-order-list.xml', {'orders': orders})
+        >>> print(profiler.report(limit=10))
+
+    """
+
+    def __init__(self, query_counter: Callable[[], int] = None):
+        self.query_counter = query_counter
+        self.stats: dict[TagKey, TagStats] = {}
+
+        # Обрабатываемые сейчас узлы: [статистика, время вложенных, запросы вложенных]
+        self._stack: list[list] = []
+        self._active = False
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def start(self):
+        self._active = True
+        set_profiler(self)
+
+    def stop(self):
+        self._active = False
+        set_profiler(None)
+
+    def reset(self):
+        self.stats.clear()
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    # Вызываются из движка ------------------------------------------
+
+    def _queries(self) -> int:
+        return 0 if self.query_counter is None else self.query_counter()
+
+    def count_evaluation(self):
+        if self._stack:
+            self._stack[-1][0].evaluations += 1
+
+    def process(self, process: Callable, parser: Generator, node: Node, context: RenderContext,
+                cond_status: MutableVariable[Optional[bool]]):
+        """ Обрабатывает узел функцией process, замеряя время и запросы """
+        key = TagKey(
+            get_template_path(node) or '<string>',
+            node.nodeName,
+            get_template_line(node)
+        )
+
+        try:
+            stats = self.stats[key]
+        except KeyError:
+            stats = self.stats[key] = TagStats()
+
+        frame = [stats, 0.0, 0]
+        self._stack.append(frame)
+
+        queries = self._queries()
+        started = time.perf_counter()
+        try:
+            return process(parser, node, context, cond_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            queries = self._queries() - queries
+            self._stack.pop()
+
+            stats.calls += 1
+            stats.total += elapsed
+            stats.own += elapsed - frame[1]
+            stats.queries += queries - frame[2]
+
+            if self._stack:
+                self._stack[-1][1] += elapsed
+                self._stack[-1][2] += queries
+
+    # Отчёт ---------------------------------------------------------
+
+    def templates(self) -> dict[str, TagStats]:
+        """ Статистика по шаблонам: суммы собственного времени, выражений
+            и запросов всех тегов шаблона. total и calls не заполняются """
+        result = {}
+        for key, stats in self.stats.items():
+            summary = result.setdefault(key.template, TagStats())
+            summary.own += stats.own
+            summary.evaluations += stats.evaluations
+            summary.queries += stats.queries
+        return result
+
+    def report(self, limit: int = 20) -> str:
+        """ Текстовый отчёт: limit самых долгих (по собственному времени) шаблонов и тегов """
+        lines = [f'{"own, ms":>9} {"evals":>6} {"queries":>7}  template']
+        templates = sorted(self.templates().items(), key=lambda item: item[1].own, reverse=True)[:limit]
+        for path, stats in templates:
+            lines.append(f'{stats.own * 1000:>9.2f} {stats.evaluations:>6} {stats.queries:>7}  {path}')
+
+        lines += ['', f'{"own, ms":>9} {"total, ms":>9} {"calls":>6} {"evals":>6} {"queries":>7}  tag']
+        tags = sorted(self.stats.items(), key=lambda item: item[1].own, reverse=True)[:limit]
+        for key, stats in tags:
+            lines.append(
+                f'{stats.own * 1000:>9.2f} {stats.total * 1000:>9.2f} {stats.calls:>6} '
+                f'{stats.evaluations:>6} {stats.queries:>7}  {key.template}:{key.line} <{key.tag}>'
+            )
+
+        return '\n'.join(lines)
+
+
+__all__ = (
+    'TagKey',
+    'TagStats',
+    'Profiler',
+)
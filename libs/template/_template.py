@@ -1,12 +1,28 @@
+import ast
+import builtins
+import collections
+import contextlib
 import dataclasses
 import functools
+import hashlib
+import logging
+import marshal
+import os
+import pickle
+import sys
+import string
+import _string
 from pathlib import Path
-from typing import Callable, Generator, Optional, Type, Any, Union, Iterable, Generic, TypeVar
-from xml.dom import minidom
-from xml.dom.minidom import Element, Document
+from types import CodeType
+from collections.abc import Mapping
+from typing import Callable, Generator, Optional, Type, Any, Union, Iterable, Generic, TypeVar, NamedTuple
+
+from ._nodes import Node, Element, Document, parse_file, parse_string, from_minidom
 
 T = TypeVar('T')
 
+logger = logging.getLogger(__name__)
+
 
 class ReadOnlyDict(dict):
     def __readonly__(self, *args, **kwargs):
@@ -22,6 +38,70 @@ class ReadOnlyDict(dict):
     del __readonly__
 
 
+class RenderContext(Mapping):
+    """
+    Неизменяемый слоёный контекст отрисовки: небольшой локальный слой и
+    ссылка на родительский контекст. Создание дочернего контекста (например,
+    на каждой итерации "for") не копирует родительский, поиск идёт от
+    локального слоя к корню.
+
+    Переданные слои не копируются, поэтому не должны изменяться во время отрисовки.
+
+    Пример::
+
+        >>> root = RenderContext({'a': 1, 'b': 2})
+        >>> child = root.child({'b': 3})
+        >>> child['a'], child['b'], root['b']
+        (1, 3, 2)
+
+    """
+    __slots__ = ('_frame', '_parent')
+
+    def __init__(self, frame: Mapping = None, parent: 'RenderContext' = None):
+        self._frame: Mapping = frame if frame is not None else {}
+        self._parent: Optional[RenderContext] = parent
+
+    def child(self, frame: Mapping) -> 'RenderContext':
+        """ Создаёт дочерний контекст, значения которого перекрывают текущие """
+        return RenderContext(frame, self)
+
+    def __getitem__(self, key):
+        context = self
+        while context is not None:
+            value = context._frame.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            context = context._parent
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        context = self
+        while context is not None:
+            if key in context._frame:
+                return True
+            context = context._parent
+        return False
+
+    def __iter__(self):
+        seen = set()
+        context = self
+        while context is not None:
+            for key in context._frame:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+            context = context._parent
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)!r})'
+
+
+_MISSING = object()
+
+
 class MutableVariable(Generic[T]):
     __slots__ = ('_value',)
 
@@ -65,6 +145,10 @@ class ConvertingError(SpecifierError):
     pass
 
 
+class QueryLimitError(TemplateModuleError):
+    pass
+
+
 class ConvertBy:
     class _Convert:
         __slots__ = ('convert',)
@@ -142,6 +226,111 @@ def converting_specifier(value, _, target_type) -> Any:
     return converter(value)
 
 
+_FORMATTER = string.Formatter()
+
+
+class FormatString:
+    """
+    Строка форматирования, разобранная заранее на литералы и поля. Результат
+    `FormatString.format(context)` совпадает с `source.format_map(context)`,
+    но сама строка разбирается один раз.
+
+    Если указана функция escape, она применяется к литералам при разборе
+    и к значениям полей при форматировании.
+
+    Пример::
+
+        >>> compile_format('{a} < {b.real}', escape=html_escape).format({'a': '<i>', 'b': 1})
+        '&lt;i&gt; &lt; 1'
+
+    """
+    __slots__ = ('source', 'escape', 'literal', '_segments')
+
+    def __init__(self, source: str, escape: Callable[[str], str] = None):
+        self.source = source
+        self.escape = escape
+
+        self.literal: Optional[str] = None
+        """ Результат форматирования, если строка не содержит полей """
+
+        # None - строку не удалось разобрать заранее, форматирование
+        # производится через str.format_map, которая и выбросит ошибку
+        self._segments: Optional[tuple] = None
+
+        try:
+            segments = tuple(self._parse(source))
+        except ValueError:
+            return
+
+        if escape is not None:
+            segments = tuple((escape(literal), field) for literal, field in segments)
+
+        if all(field is None for _, field in segments):
+            self.literal = ''.join(literal for literal, _ in segments)
+
+        self._segments = segments
+
+    @staticmethod
+    def _parse(source: str):
+        for literal, field_name, format_spec, conversion in _FORMATTER.parse(source):
+            if field_name is None:
+                yield literal, None
+                continue
+
+            first, rest = _string.formatter_field_name_split(field_name)
+
+            # Позиционные поля, вложенные поля в спецификации формата и
+            # неизвестные преобразования оставляются на str.format_map
+            if isinstance(first, int) or not first or '{' in format_spec \
+                    or conversion not in (None, 'r', 's', 'a'):
+                raise ValueError
+
+            yield literal, (first, tuple(rest), conversion, format_spec)
+
+    def format(self, context) -> str:
+        if self.literal is not None:
+            return self.literal
+
+        if self._segments is None:
+            result = self.source.format_map(context)
+            return result if self.escape is None else self.escape(result)
+
+        parts = []
+        for literal, field in self._segments:
+            if literal:
+                parts.append(literal)
+            if field is None:
+                continue
+
+            first, rest, conversion, format_spec = field
+            value = context[first]
+            for is_attribute, key in rest:
+                value = getattr(value, key) if is_attribute else value[key]
+
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 's':
+                value = str(value)
+            elif conversion == 'a':
+                value = ascii(value)
+
+            value = format(value, format_spec)
+            parts.append(value if self.escape is None else self.escape(value))
+
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_format(source: str, escape: Callable[[str], str] = None) -> FormatString:
+    """ Разбирает строку форматирования. Результат кешируется по тексту строки """
+    return FormatString(source, escape)
+
+
+def html_escape(text: str) -> str:
+    """ Экранирует символы, которые telegram воспринимает как html-разметку """
+    return text.replace('<', '&lt;').replace('>', '&gt;')
+
+
 def f_converting_specifier(value, context, target_type) -> Any:
     """
     Конвертирует переданную строку в указанный тип, предварительно форматируя
@@ -163,7 +352,7 @@ def f_converting_specifier(value, context, target_type) -> Any:
     :return: Преобразованное значение.
     """
 
-    return converting_specifier(value.format_map(context), context, target_type)
+    return converting_specifier(compile_format(value).format(context), context, target_type)
 
 
 def context_var_specifier(value, context, _) -> Any:
@@ -217,7 +406,48 @@ def exec_python_specifier(value, context, target_type) -> Any:
     :param target_type: Тип, который будет передан в код.
     :return: Значение переменной с указанным именем в контексте.
     """
-    return eval(value, {}, {**context, '__target__': target_type, '__context__': context})
+    if _profiler is not None:
+        _profiler.count_evaluation()
+    return eval(compile_expression(value), _EVALUATION_GLOBALS, _EvaluationNamespace(context, target_type))
+
+
+_EVALUATION_GLOBALS = {'__builtins__': builtins}
+
+
+EXPRESSION_CACHE_SIZE = 4096
+
+_compiled_expressions: dict[str, CodeType] = {}
+
+
+def compile_expression(source: str) -> CodeType:
+    """ Компилирует python-выражение из шаблона. Результат кешируется по тексту
+        выражения, так что каждое выражение компилируется один раз. Кеш также
+        заполняется из дискового кеша шаблонов (см. set_disk_cache_directory) """
+    try:
+        return _compiled_expressions[source]
+    except KeyError:
+        pass
+
+    code = compile(source, '<template>', 'eval')
+
+    if len(_compiled_expressions) >= EXPRESSION_CACHE_SIZE:
+        del _compiled_expressions[next(iter(_compiled_expressions))]
+    _compiled_expressions[source] = code
+    return code
+
+
+class _EvaluationNamespace(dict):
+    """ Локальное пространство имён для выполнения выражений. Содержит только
+        "__target__" и "__context__", остальные имена ищутся в контексте напрямую,
+        без копирования контекста """
+    __slots__ = ('_context',)
+
+    def __init__(self, context, target_type):
+        super().__init__(__target__=target_type, __context__=context)
+        self._context = context
+
+    def __missing__(self, key):
+        return self._context[key]
 
 
 converters = {
@@ -234,9 +464,311 @@ specifiers = {
     'py': exec_python_specifier,
 }
 
+
+def format_variables(value: str) -> set[str]:
+    """
+    Возвращает имена переменных контекста, используемых в строке форматирования.
+
+    Пример::
+
+        >>> format_variables('{order.id} от {order.created_at:{date_format}}')
+        {'order', 'date_format'}
+
+    """
+    names = set()
+
+    try:
+        fields = list(_FORMATTER.parse(value))
+    except ValueError:
+        return names
+
+    for _, field, spec, _ in fields:
+        if field:
+            first, _ = _string.formatter_field_name_split(field)
+            if isinstance(first, str):
+                names.add(first)
+        if spec:
+            names |= format_variables(spec)
+
+    return names
+
+
+def expression_variables(value: str) -> set[str]:
+    """
+    Возвращает имена переменных контекста, используемых в python-выражении.
+    Имена, связываемые внутри выражения (генераторы, lambda), не учитываются.
+
+    Пример::
+
+        >>> expression_variables('[p.title for p in season.prizes if p.id != skip]')
+        {'season', 'skip'}
+
+    """
+    loaded, bound = set(), set()
+
+    for node in ast.walk(ast.parse(value.strip(), mode='eval')):
+        if isinstance(node, ast.Name):
+            (loaded if isinstance(node.ctx, ast.Load) else bound).add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+
+    return loaded - bound
+
+
+variable_collectors: dict[str, Callable[[str], set[str]]] = {
+    '': format_variables,
+    'nf': lambda _: set(),
+    'cv': lambda value: {value},
+    'py': expression_variables,
+}
+""" Функции, извлекающие имена переменных контекста из значения атрибута, по спецификатору.
+    Используются для статического анализа шаблонов (preload, render_many) """
+
+
 StopParsing = object()
 """ Объект, используемый для указания parser-у о завершении обработки """
 
+_compilation_enabled: bool = True
+
+_COMPILED_NODE_ATTRIBUTE = 'compiled_node'
+_COMPILED_CHILDREN_ATTRIBUTE = 'compiled_children'
+
+
+def set_compilation_enabled(enabled: bool):
+    """ Включает/выключает выполнение шаблонов через скомпилированные функции.
+        При выключенной компиляции дерево элементов интерпретируется при каждой отрисовке """
+    global _compilation_enabled
+    _compilation_enabled = enabled
+
+
+def get_compilation_enabled() -> bool:
+    """ Возвращает True, если шаблоны выполняются через скомпилированные функции """
+    return _compilation_enabled
+
+
+STATIC_SPECIFIERS = {'', 'nf'}
+""" Спецификаторы, значение которых не зависит от контекста (для '' - если в нём нет полей) """
+
+
+class _StaticRecorder:
+    """ Запоминает токены, переданные в parser при первой отрисовке статического
+        поддерева. Если при этом выполнился хоть один динамический узел - поддерево
+        помечается динамическим """
+    __slots__ = ('parser', 'tokens', 'dynamic')
+
+    def __init__(self, parser: Generator):
+        self.parser = parser
+        self.tokens: list = []
+        self.dynamic: bool = False
+
+    def send(self, token: Any):
+        result = self.parser.send(token)
+        self.tokens.append(token)
+        return result
+
+
+_static_recorders: list[_StaticRecorder] = []
+
+
+def _mark_dynamic():
+    """ Вызывается динамическими узлами: поддеревья, которые сейчас записываются,
+        не могут быть закешированы """
+    for recorder in _static_recorders:
+        recorder.dynamic = True
+
+
+def _is_static_attribute(attribute: str, value: str) -> bool:
+    _, _, spec = attribute.partition('.')
+    if spec not in STATIC_SPECIFIERS:
+        return False
+    return spec != '' or ('{' not in value and '}' not in value)
+
+
+class _BatchReplay:
+    """
+    Состояние render_many. Узлы документа, не зависящие от изменяющихся между
+    отрисовками переменных, выполняются один раз, а их токены повторяются
+    для остальных отрисовок.
+    """
+
+    def __init__(self, document: Document):
+        self.document = document
+        self.dependencies = _document_dependencies(document)
+        self.varying: frozenset[str] = frozenset()
+        self.plans: dict[tuple[ParsingScope, Element], tuple[list, ...]] = {}
+        """ Для каждого элемента - шаги [run, неизменяющийся ли узел, токены узла
+            (None, пока узел не выполнен)] для его потомков """
+
+    def set_varying(self, varying: frozenset[str]):
+        if varying != self.varying:
+            self.varying = varying
+            self.plans.clear()
+
+    def is_invariant(self, node: Node) -> bool:
+        # Узлы встраиваемых шаблонов отрисовываются в другом контексте
+        if node.ownerDocument is not self.document:
+            return False
+
+        # Условия зависят от предыдущих узлов (cond_status)
+        if node.nodeType == Node.ELEMENT_NODE and (
+                node.hasAttribute(ParsingScope.DISPLAY_ATTRIBUTE_IF)
+                or node.hasAttribute(ParsingScope.DISPLAY_ATTRIBUTE_ELSE_IF)
+                or node.hasAttribute(ParsingScope.DISPLAY_ATTRIBUTE_ELSE)):
+            return False
+
+        dependencies = self.dependencies.get(node)
+        return dependencies is not None and dependencies.isdisjoint(self.varying)
+
+    def plan(self, scope: 'ParsingScope', element: Element) -> tuple[list, ...]:
+        try:
+            return self.plans[scope, element]
+        except KeyError:
+            pass
+
+        plan = tuple(
+            [run, self.is_invariant(node), None]
+            for node in element.childNodes
+            if (run := scope.compile_node(node)) is not None
+        )
+        self.plans[scope, element] = plan
+        return plan
+
+    def run(self, scope: 'ParsingScope', parser: Generator, element: Element, context: RenderContext,
+            cond_status: MutableVariable[Optional[bool]]):
+        global _uncacheable
+
+        for step in self.plan(scope, element):
+            run, invariant, tokens = step
+
+            if not invariant:
+                run(parser, context, cond_status)
+
+            elif tokens is not None:
+                for token in tokens:
+                    scope.send(parser, token)
+
+            else:
+                recorder = _StaticRecorder(parser)
+                previous, _uncacheable = _uncacheable, False
+                try:
+                    run(recorder, context, cond_status)
+                    if _uncacheable:
+                        step[1] = False
+                    else:
+                        step[2] = tuple(recorder.tokens)
+                finally:
+                    _uncacheable = previous or _uncacheable
+
+
+_batch_replay: Optional[_BatchReplay] = None
+
+_profiler = None
+""" Активный профилировщик (см. template.Profiler) или None """
+
+
+def set_profiler(profiler):
+    """ Устанавливает профилировщик, через который будут обрабатываться все узлы
+        шаблонов. None - выключает профилирование """
+    global _profiler
+    _profiler = profiler
+
+
+_uncacheable: bool = False
+
+
+def mark_uncacheable():
+    """ Вызывается обработчиками и спецификаторами, результат которых нельзя
+        переиспользовать (например, файл, который ещё не загружен). Текущая отрисовка
+        не будет запомнена (render), а узел - повторён для других отрисовок (render_many) """
+    global _uncacheable
+    _uncacheable = True
+
+
+def _document_dependencies(document: Document) -> dict[Node, Optional[frozenset[str]]]:
+    """
+    Для каждого узла документа возвращает имена переменных контекста документа, от
+    которых зависит отрисовка узла вместе с его потомками. Переменные циклов заменяются
+    переменными, от которых зависит источник цикла. None - зависимости не удалось
+    определить (например, атрибут с неизвестным спецификатором) или узел находится
+    внутри цикла.
+    """
+    dependencies = {}
+
+    def resolve(names: Iterable[str], bound: dict[str, frozenset[str]]) -> Optional[frozenset[str]]:
+        if '__context__' in names:
+            return None
+        return frozenset().union(*(bound.get(name, {name}) for name in names))
+
+    def analyze(node: Node, bound: dict[str, frozenset[str]]) -> Optional[frozenset[str]]:
+        if node.nodeType == Node.TEXT_NODE:
+            return resolve(format_variables(node.nodeValue), bound)
+
+        if node.nodeType != Node.ELEMENT_NODE:
+            return frozenset()
+
+        attributes = dict(node.attrs)
+
+        # Условия и источник цикла вычисляются во внешнем контексте
+
+        names = set()
+        for attribute in (ParsingScope.DISPLAY_ATTRIBUTE_IF, ParsingScope.DISPLAY_ATTRIBUTE_ELSE_IF):
+            if (value := attributes.pop(attribute, None)) is not None:
+                names |= expression_variables(value)
+        attributes.pop(ParsingScope.DISPLAY_ATTRIBUTE_ELSE, None)
+
+        if (outer := resolve(names, bound)) is None:
+            return None
+
+        if (value := attributes.pop(ParsingScope.DUPLICATE_ATTRIBUTE, None)) is not None:
+            cvs, _, source = value.partition(ParsingScope.DUPLICATE_SEPARATOR)
+            if (source := resolve(expression_variables(source), bound)) is None:
+                return None
+            outer |= source
+            bound = {**bound, **dict.fromkeys(map(str.strip, cvs.split(',')), source)}
+
+        # Остальные атрибуты и потомки - в контексте итерации
+
+        names = set()
+        for attribute, value in attributes.items():
+            _, _, spec = attribute.partition('.')
+            if (collector := variable_collectors.get(spec)) is None:
+                return None
+            names |= collector(value)
+
+        inner = resolve(names, bound)
+        children = [walk(child, bound) for child in node.childNodes]
+        if inner is None or None in children:
+            return None
+
+        return outer.union(inner, *children)
+
+    def walk(node: Node, bound: dict[str, frozenset[str]]) -> Optional[frozenset[str]]:
+        try:
+            result = analyze(node, bound)
+        except (SyntaxError, ValueError):
+            result = None
+        # Узлы тела цикла выполняются по разу на итерацию, а план повтора общий
+        # для всех итераций - такие узлы повторять нельзя, даже если сам цикл можно
+        dependencies[node] = None if bound else result
+        return result
+
+    for child in document.childNodes:
+        walk(child, {})
+
+    return dependencies
+
+
+def _node_cache(node: Node, name: str) -> dict:
+    """ Возвращает словарь скомпилированных функций, хранящийся на самом узле. Таким
+        образом скомпилированное представление живёт ровно столько же, сколько и шаблон """
+    cache = getattr(node, name, None)
+    if cache is None:
+        cache = {}
+        # Узлы без соответствующего поля (например, текст для compile) просто не кешируются
+        with contextlib.suppress(AttributeError):
+            setattr(node, name, cache)
+    return cache
+
 
 class ParsingScope:
     DISPLAY_ATTRIBUTE_IF = 'if'
@@ -257,12 +789,19 @@ class ParsingScope:
         annotations: dict[str, Type]
         defaults: dict[str, Any]
         takes_remaining: bool
+        static: bool = False
 
     def __init__(self, parsing_function: Callable[[], Generator]):
         self.parsing_function = parsing_function
         self.text_handler: Optional[Callable] = None
+        self.text_handler_static: bool = False
         self.handlers: dict[str, ParsingScope.Handler] = {}
 
+        # Ключ, под которым скомпилированные функции хранятся на узлах.
+        # Заменяется при регистрации обработчиков, что инвалидирует
+        # всё скомпилированное ранее
+        self._compiled_key = object()
+
     # Parsing -------------------------------------------------------
 
     def __arguments__(
@@ -271,7 +810,7 @@ class ParsingScope:
             defaults: dict[str, Any],
             takes_remaining: bool,
             attributes: dict[str, str],
-            context: ReadOnlyDict
+            context: RenderContext
     ) -> dict[str, Any]:
         """ По переданным аттрибутам тега и ожидаемым аргументам собирает
             значения для передачи в обработчик """
@@ -321,7 +860,7 @@ class ParsingScope:
 
         return args
 
-    def __display__(self, attributes: dict[str, str], context: ReadOnlyDict,
+    def __display__(self, attributes: dict[str, str], context: RenderContext,
                     cond_status: MutableVariable[Optional[bool]]) -> bool:
         """ Вызывается на каждом элементе, чтобы определить должен
             ли он быть отображён """
@@ -378,14 +917,14 @@ class ParsingScope:
         # Should be unreachable, unless there is an error in this code
         raise
 
-    def __duplicate__(self, attributes: dict[str, str], context: ReadOnlyDict) -> Iterable[ReadOnlyDict]:
+    def __duplicate__(self, attributes: dict[str, str], context: RenderContext) -> Iterable[RenderContext]:
         """ Вызывается на каждом элементе, чтобы определить сколько
             раз он должен быть отображён """
         try:
             value = attributes.pop(self.DUPLICATE_ATTRIBUTE)
         except KeyError:
-            # Таким образом при отсутствии необходимости в
-            # дублировании элемента контекст не копируется
+            # При отсутствии необходимости в дублировании
+            # элемента дочерний контекст не создаётся
             yield context
             return
 
@@ -401,16 +940,17 @@ class ParsingScope:
 
         # <tag for="a,b in [(val1, val2), (val3, val4), ...]"/>
         if len(cvs) > 1:
-            yield from (ReadOnlyDict(**context, **{cv: item for cv, item in zip(cvs, value)})
-                        for value in source)
+            yield from (context.child(dict(zip(cvs, value))) for value in source)
             return
 
         # <tag for="a in [val1, val2, ...]"/>
         cv, = cvs
-        yield from (ReadOnlyDict(**context, **{cv: value}) for value in source)
+        yield from (context.child({cv: value}) for value in source)
 
-    def parse(self, element: Element, context: ReadOnlyDict) -> Any:
-        parser = self.parsing_function()
+    def parse(self, element: Element, context: RenderContext, **options) -> Any:
+        """ Отрисовывает потомков элемента, options передаются в parsing-функцию """
+        element = from_minidom(element)
+        parser = self.parsing_function(**options)
 
         try:
             next(parser)
@@ -418,17 +958,49 @@ class ParsingScope:
             raise ParsingCoroutineError('Parser returned StopIteration after initialization')
 
         cond_status = MutableVariable(None)
-        for element in element.childNodes:
-            self.process(parser, element, context, cond_status)
+        if _profiler is not None:
+            for node in element.childNodes:
+                self.process(parser, node, context, cond_status)
+        elif _batch_replay is not None and _compilation_enabled:
+            _batch_replay.run(self, parser, element, context, cond_status)
+        elif _compilation_enabled:
+            for run in self.compile(element):
+                run(parser, context, cond_status)
+        else:
+            for element in element.childNodes:
+                self.interpret(parser, element, context, cond_status)
 
         try:
             return parser.send(StopParsing)
         except StopIteration:
             raise ParsingCoroutineError('Parser returned StopIteration after receiving StopParsing')
 
-    def process(self, parser: Generator, element: Element, context: ReadOnlyDict,
+    def process(self, parser: Generator, element: Element, context: RenderContext,
                 cond_status: MutableVariable[Optional[bool]]):
 
+        # Узлы minidom (например, переданные через Tag.process) приводятся к компактному виду
+        if not isinstance(element, Node) and (element := from_minidom(element)) is None:
+            return
+
+        if _profiler is not None:
+            return _profiler.process(self._process, parser, element, context, cond_status)
+        return self._process(parser, element, context, cond_status)
+
+    def _process(self, parser: Generator, element: Element, context: RenderContext,
+                 cond_status: MutableVariable[Optional[bool]]):
+
+        if not _compilation_enabled:
+            return self.interpret(parser, element, context, cond_status)
+
+        run = self.compile_node(element)
+        if run is not None:
+            run(parser, context, cond_status)
+
+    def interpret(self, parser: Generator, element: Element, context: RenderContext,
+                  cond_status: MutableVariable[Optional[bool]]):
+        """ Обрабатывает элемент, разбирая его атрибуты заново. Используется
+            при выключенной компиляции """
+
         if element.nodeType == Element.TEXT_NODE and self.text_handler:
             tag = Tag(self, parser, element, context)
             token = self.text_handler(tag)
@@ -441,7 +1013,7 @@ class ParsingScope:
         # Предполагается, что словарь будет изменяться методами
         # __display__ и __duplicate__, конкретно - будут удаляться
         # атрибуты 'if' и 'for', если они есть
-        attributes = dict(element.attributes.items())
+        attributes = dict(element.attrs)
 
         if not self.__display__(attributes, context, cond_status):
             return
@@ -468,6 +1040,323 @@ class ParsingScope:
 
             self.send(parser, token)
 
+    # Компиляция ----------------------------------------------------
+
+    def compile(self, element: Element) -> tuple[Callable, ...]:
+        """
+        Компилирует дочерние узлы элемента в последовательность функций вида
+        `run(parser, context, cond_status)`. Разбор атрибутов, поиск обработчиков
+        и сопоставление аргументов производятся один раз, при последующих
+        отрисовках вызываются только готовые функции. Результат хранится
+        на самом элементе.
+        """
+        cache = _node_cache(element, _COMPILED_CHILDREN_ATTRIBUTE)
+
+        try:
+            return cache[self._compiled_key]
+        except KeyError:
+            pass
+
+        compiled = tuple(filter(None, map(self.compile_node, element.childNodes)))
+        cache[self._compiled_key] = compiled
+        return compiled
+
+    def compile_node(self, node: Element) -> Optional[Callable]:
+        """ Компилирует отдельный узел. Возвращает None, если узел ничего не отображает """
+        cache = _node_cache(node, _COMPILED_NODE_ATTRIBUTE)
+
+        try:
+            return cache[self._compiled_key]
+        except KeyError:
+            pass
+
+        if node.nodeType == Element.TEXT_NODE and self.text_handler:
+            compiled = self.__compile_text__(node)
+        elif node.nodeType == Element.ELEMENT_NODE:
+            compiled = self.__compile_element__(node)
+        else:
+            compiled = None
+
+        cache[self._compiled_key] = compiled
+        return compiled
+
+    def __compile_text__(self, node: Element) -> Callable:
+        text_handler = self.text_handler
+
+        if self.text_handler_static and '{' not in node.nodeValue and '}' not in node.nodeValue:
+            tokens = []
+
+            def run(parser, context, _):
+                if not tokens:
+                    tokens.append(text_handler(Tag(self, parser, node, context)))
+                self.send(parser, tokens[0])
+
+            return run
+
+        def run(parser, context, _):
+            if _static_recorders:
+                _mark_dynamic()
+
+            token = text_handler(Tag(self, parser, node, context))
+            self.send(parser, token)
+
+        return run
+
+    def __compile_element__(self, element: Element) -> Callable:
+        # Порядок компиляции и момент возникновения ошибок повторяют
+        # ParsingScope.interpret: ошибки откладываются до отрисовки
+        attributes = dict(element.attrs)
+
+        display = self.__compile_display__(attributes)
+
+        try:
+            handler = self.handlers[element.tagName]
+        except KeyError:
+            def run(_, context, cond_status):
+                if display is None or display(context, cond_status):
+                    raise ParsingError(f'Got unexpected tag "{element.tagName}"')
+            return run
+
+        duplicate = self.__compile_duplicate__(attributes)
+        bind = self.__compile_arguments__(handler, attributes)
+        function = handler.function
+
+        if handler.static and display is None and duplicate is None \
+                and all(map(_is_static_attribute, attributes.keys(), attributes.values())):
+            return self.__compile_static__(element, function, bind)
+
+        if duplicate is None:
+            def run(parser, context, cond_status):
+                if _static_recorders:
+                    _mark_dynamic()
+
+                if display is not None and not display(context, cond_status):
+                    return
+
+                token = function(Tag(self, parser, element, context), **bind(context))
+                if token is not None:
+                    self.send(parser, token)
+
+            return run
+
+        def run(parser, context, cond_status):
+            if _static_recorders:
+                _mark_dynamic()
+
+            if display is not None and not display(context, cond_status):
+                return
+
+            for child_context in duplicate(context):
+                token = function(Tag(self, parser, element, child_context), **bind(child_context))
+
+                # Обработчик не вернул значения
+                if token is None:
+                    return
+
+                self.send(parser, token)
+
+        return run
+
+    def __compile_static__(self, element: Element, function: Callable,
+                           bind: Callable[[RenderContext], dict[str, Any]]) -> Callable:
+        """ Элемент со статическим обработчиком и статическими атрибутами. При первой
+            отрисовке переданные им токены запоминаются, и если во всём поддереве не
+            встретилось динамических узлов - в дальнейшем отправляются готовые токены """
+        tokens: Optional[tuple] = None
+        dynamic = False
+
+        def run(parser, context, _):
+            nonlocal tokens, dynamic
+
+            if tokens is not None:
+                for token in tokens:
+                    self.send(parser, token)
+                return
+
+            if dynamic:
+                if _static_recorders:
+                    _mark_dynamic()
+
+                token = function(Tag(self, parser, element, context), **bind(context))
+                if token is not None:
+                    self.send(parser, token)
+                return
+
+            recorder = _StaticRecorder(parser)
+            _static_recorders.append(recorder)
+            try:
+                token = function(Tag(self, recorder, element, context), **bind(context))
+                if token is not None:
+                    self.send(recorder, token)
+            finally:
+                _static_recorders.pop()
+
+            if recorder.dynamic:
+                dynamic = True
+            else:
+                tokens = tuple(recorder.tokens)
+
+        return run
+
+    def __compile_display__(self, attributes: dict[str, str]) \
+            -> Optional[Callable[[RenderContext, MutableVariable[Optional[bool]]], bool]]:
+        """ Аналог __display__, возвращает None, если элемент отображается всегда """
+        cond_attr_present = (
+            (self.DISPLAY_ATTRIBUTE_IF in attributes)
+            + (self.DISPLAY_ATTRIBUTE_ELSE_IF in attributes)
+            + (self.DISPLAY_ATTRIBUTE_ELSE in attributes)
+        )
+
+        if cond_attr_present > 1:
+            def display(*_):
+                raise ParsingError('There must be only one of "if", "else-if" or "else" in a single tag')
+            return display
+
+        if cond_attr_present == 0:
+            return None
+
+        # "if" attribute
+
+        cond = attributes.pop(self.DISPLAY_ATTRIBUTE_IF, None)
+
+        if cond is not None:
+            def display(context, cond_status):
+                cond_status.value = bool(exec_python_specifier(cond, context, bool))
+                return cond_status.value
+            return display
+
+        # "else-if" attribute
+
+        cond = attributes.pop(self.DISPLAY_ATTRIBUTE_ELSE_IF, None)
+
+        if cond is not None:
+            def display(context, cond_status):
+                if cond_status.value is None:
+                    raise ParsingError('Tag with "else-if" attribute must come somewhere after '
+                                       'a tag with "if" attribute')
+
+                cond_status.value = not cond_status.value \
+                    and bool(exec_python_specifier(cond, context, bool))
+
+                return cond_status.value
+            return display
+
+        # "else" attribute
+
+        cond = attributes.pop(self.DISPLAY_ATTRIBUTE_ELSE)
+
+        def display(_, cond_status):
+            if cond_status.value is None:
+                raise ParsingError('Tag with "else" attribute must come somewhere after '
+                                   'a tag with "if" or "else-if" attribute')
+
+            if len(cond) != 0:
+                raise ParsingError('Content of the "else" attribute must be empty')
+
+            result = not cond_status.value
+            cond_status.value = None
+            return result
+
+        return display
+
+    def __compile_duplicate__(self, attributes: dict[str, str]) \
+            -> Optional[Callable[[RenderContext], Iterable[RenderContext]]]:
+        """ Аналог __duplicate__, возвращает None, если элемент не дублируется """
+        try:
+            value = attributes.pop(self.DUPLICATE_ATTRIBUTE)
+        except KeyError:
+            return None
+
+        try:
+            cvs, source_cv = value.split(self.DUPLICATE_SEPARATOR, maxsplit=1)
+        except ValueError:
+            def duplicate(_):
+                raise ParsingError('Value of the "for" argument must contain "in" in it')
+            return duplicate
+
+        # 'a, b , c' -> ['a', 'b', 'c']
+        cvs = list(map(lambda x: x.strip(), cvs.split(',')))
+
+        # <tag for="a,b in [(val1, val2), (val3, val4), ...]"/>
+        if len(cvs) > 1:
+            def duplicate(context):
+                source = exec_python_specifier(source_cv, context, None)
+                return (context.child(dict(zip(cvs, value))) for value in source)
+            return duplicate
+
+        # <tag for="a in [val1, val2, ...]"/>
+        cv, = cvs
+
+        def duplicate(context):
+            source = exec_python_specifier(source_cv, context, None)
+            return (context.child({cv: value}) for value in source)
+
+        return duplicate
+
+    def __compile_arguments__(self, handler: 'ParsingScope.Handler', attributes: dict[str, str]) \
+            -> Callable[[RenderContext], dict[str, Any]]:
+        """ Аналог __arguments__. План связывания аргументов составляется один раз,
+            при отрисовке остаётся только вызвать конвертеры """
+
+        def fail(message: str):
+            def bind(_):
+                raise ParsingError(message)
+            return bind
+
+        # Отделение спецификаторов от имён аргументов
+        arguments = {}
+        for attribute, value in attributes.items():
+            try:
+                attribute, spec = attribute.split('.', maxsplit=1)
+            except ValueError:
+                spec = ''
+
+            try:
+                converter = specifiers[spec]
+            except KeyError:
+                return fail(f'No such specifier as "{spec}" is registered')
+
+            arguments[attribute] = value, converter
+
+        # Проверка соответствия между переданными аргументами и ожидаемыми
+        provided = set(arguments)
+        annotated = set(handler.annotations)
+        mandatory = annotated - set(handler.defaults)
+
+        if unprovided := mandatory - provided:
+            return fail(f'Arguments {unprovided} were expected, but not provided')
+        if not handler.takes_remaining and (unexpected := provided - annotated):
+            return fail(f'Got unexpected arguments {unexpected}')
+
+        # План формирования аргументов
+        bindings = tuple(
+            (arg, *arguments[arg], handler.annotations[arg])
+            for arg in provided.intersection(annotated)
+        )
+        defaults = {arg: handler.defaults[arg] for arg in annotated - provided}
+        remaining = None
+        if handler.takes_remaining:
+            remaining = tuple((arg, *arguments[arg]) for arg in provided - annotated)
+
+        if not bindings and remaining is None:
+            # Словарь всё равно копируется при распаковке в **kwargs
+            return lambda _: defaults
+
+        def bind(context):
+            args = defaults.copy()
+            for arg, value, convert, target_type in bindings:
+                args[arg] = convert(value, context, target_type)
+
+            if remaining is not None:
+                args[self.REMAINING_ARGUMENT] = {
+                    arg: convert(value, context, str)
+                    for arg, value, convert in remaining
+                }
+
+            return args
+
+        return bind
+
     def send(self, parser: Generator, token: Any):
         if token is StopParsing:
             raise ParsingError('Attempt to return "StopParsing" from the handler')
@@ -481,7 +1370,7 @@ class ParsingScope:
     # Регистрация обработчиков --------------------------------------
 
     def _register(self, func, name: str = None, override: bool = False,
-                  annotations: dict = None, defaults: dict = None):
+                  annotations: dict = None, defaults: dict = None, static: bool = False):
 
         # Получаем имя тега
         if name is None:
@@ -515,11 +1404,12 @@ class ParsingScope:
         if unexpected := set(defaults.keys()) - set(annotations.keys()):
             raise RegistrationError(f'You cannot provide defaults to unlisted arguments: {unexpected}')
 
-        self.handlers[name] = self.Handler(func, annotations, defaults, takes_remaining)
+        self.handlers[name] = self.Handler(func, annotations, defaults, takes_remaining, static)
+        self._compiled_key = object()
         return func
 
     def register(self, func=None, /, name: str = None, override: bool = False,
-                 annotations: dict = None, defaults: dict = None) -> Callable:
+                 annotations: dict = None, defaults: dict = None, static: bool = False) -> Callable:
         """
         Регистрирует обработчик тега. Данный обработчик будет вызываться для элементов с указанным
         именем тега
@@ -534,41 +1424,54 @@ class ParsingScope:
             будет автоматически извлечено из __annotations__
         :param defaults: Значения по умолчанию для аргументов обработчика. Если не указано,
             будет автоматически извлечено из __kwdefaults__
+        :param static: Результат обработчика зависит только от атрибутов и содержимого тега.
+            Поддеревья из таких тегов без динамических атрибутов отрисовываются один раз
         """
 
         if func is None:
-            return functools.partial(self._register, name, override, annotations, defaults)
-        return self._register(func, name, override, annotations, defaults)
+            return functools.partial(self._register, name=name, override=override,
+                                     annotations=annotations, defaults=defaults, static=static)
+        return self._register(func, name, override, annotations, defaults, static)
 
-    def register_text(self, func=None):
+    def register_text(self, func=None, static: bool = False):
         """
         Регистрирует текстовый обработчик. Данный обработчик будет вызываться для каждого xml элемента
         с типом TEXT_ELEMENT
+
+        :param static: Результат обработчика зависит от контекста только через поля
+            форматирования ("{...}"), текст без полей обрабатывается один раз
         """
 
+        if func is None:
+            return functools.partial(self.register_text, static=static)
+
         if self.text_handler:
             raise RegistrationError('There is already a text handler')
 
         self.text_handler = func
+        self.text_handler_static = static
+        self._compiled_key = object()
         return func
 
 
-def register_text(parsers: Iterable[ParsingScope]) -> Callable:
+def register_text(parsers: Iterable[ParsingScope], static: bool = False) -> Callable:
     """
     Регистрирует текстовый обработчик. Данный обработчик будет вызываться для каждого xml элемента
     с типом TEXT_ELEMENT
 
     :param parsers: Области в которых необходимо зарегистрировать обработчик
+    :param static: Результат обработчика зависит от контекста только через поля
+        форматирования ("{...}"), текст без полей обрабатывается один раз
     """
     def decorator(func):
         for parser in parsers:
-            parser.register_text(func)
+            parser.register_text(func, static=static)
         return func
     return decorator
 
 
 def register(scopes: Iterable[ParsingScope], name: str = None, override: bool = False,
-             annotations: dict = None, defaults: dict = None) -> Callable:
+             annotations: dict = None, defaults: dict = None, static: bool = False) -> Callable:
     """
     Регистрирует обработчик тега. Данный обработчик будет вызываться для элементов с указанным
     именем тега
@@ -582,6 +1485,8 @@ def register(scopes: Iterable[ParsingScope], name: str = None, override: bool =
         будет автоматически извлечено из __annotations__
     :param defaults: Значения по умолчанию для аргументов обработчика. Если не указано,
         будет автоматически извлечено из __kwdefaults__
+    :param static: Результат обработчика зависит только от атрибутов и содержимого тега.
+        Поддеревья из таких тегов без динамических атрибутов отрисовываются один раз
     """
     def decorator(func):
         for scope in scopes:
@@ -590,7 +1495,8 @@ def register(scopes: Iterable[ParsingScope], name: str = None, override: bool =
                 name=name,
                 override=override,
                 annotations=annotations,
-                defaults=defaults
+                defaults=defaults,
+                static=static
             )
         return func
     return decorator
@@ -602,7 +1508,7 @@ class Tag:
             scope: ParsingScope,
             parser: Generator,
             element: Element,
-            context: ReadOnlyDict
+            context: RenderContext
     ):
         self._scope = scope
         self._parser = parser
@@ -617,7 +1523,7 @@ class Tag:
     def context(self):
         return self._context
 
-    def process(self, element: Element, context: Union[ReadOnlyDict, dict] = None,
+    def process(self, element: Element, context: Union[RenderContext, dict] = None,
                 cond_status: MutableVariable[Optional[bool]] = None):
         """
         Обрабатывает элемент как если бы он был частью шаблона.
@@ -626,11 +1532,14 @@ class Tag:
         должен пройти через весь процесс parsing-а. В большинстве
         случаев возможно ограничиться `Tag.send()`.
 
+        Элемент - узел, полученный через parse_string, или, для совместимости,
+        узел minidom (он будет приведён к компактному виду, см. from_minidom).
+
         Например::
 
             @register([EXAMPLE])
             def wow(tag: Tag):
-                elem = minidom.parseString('<p> WOW! </p>')
+                elem = parse_string('<p> WOW! </p>').documentElement
                 tag.process(elem, tag.context)
 
             <example>
@@ -647,7 +1556,7 @@ class Tag:
 
             @register([EXAMPLE])
             def wow(tag: Tag):
-                elem = minidom.parseString('<p for="i in range(5)"> WOW #{i}! </p>')
+                elem = parse_string('<p for="i in range(5)"> WOW #{i}! </p>').documentElement
                 tag.process(elem, tag.context)
 
             <example>
@@ -664,7 +1573,7 @@ class Tag:
 
             @register([EXAMPLE])
             def wow(tag: Tag):
-                elem = minidom.parseString('''
+                elem = parse_string('''
                     <section>
                         <p if="a"> WOW #1! </p>
                         <p else-if="b"> WOW #2! </p>
@@ -683,8 +1592,8 @@ class Tag:
             </example>
 
         """
-        if context and not isinstance(context, ReadOnlyDict):
-            context = ReadOnlyDict(context)
+        if context and not isinstance(context, RenderContext):
+            context = RenderContext(context)
         if context is None:
             context = self._context
 
@@ -775,35 +1684,548 @@ def render_document(document: Document, context: dict, path: str = None, syntax:
     if syntax is None:
         raise ValueError('No default syntax is set, so it must be provided manually')
 
-    _context = _global_context.copy()
+    # Контекст собирается слоями: глобальный <- путь к шаблону <- переданный,
+    # ни один из словарей при этом не копируется
+    _context = RenderContext(_global_context)
     if path:
         path = Path(path)
-        _context.update(__dir__=path.parent, __file__=path)
-    _context.update(context)
+        _context = _context.child({'__dir__': path.parent, '__file__': path})
+    _context = _context.child(context)
 
+    if _query_counter is None:
+        # noinspection PyTypeChecker
+        return syntax.parse(document, _context)
+
+    queries = _query_counter()
     # noinspection PyTypeChecker
-    return syntax.parse(document, ReadOnlyDict(_context))
+    result = syntax.parse(document, _context)
+    _check_query_limit(path or '<string>', _query_counter() - queries)
+    return result
+
+
+_query_counter: Optional[Callable[[], int]] = None
+_query_limit: int = 0
+_query_limit_strict: bool = False
+
+
+def set_query_limit(counter: Optional[Callable[[], int]], limit: int = 0, strict: bool = False):
+    """
+    Включает проверку запросов к базе данных, выполненных во время отрисовки.
+    Как правило это ленивые загрузки связей (order.subscription), которые вызывающий
+    код не загрузил заранее (см. get_relations). Если за одну отрисовку выполнено больше
+    limit запросов - выбрасывается QueryLimitError (strict) или пишется предупреждение в лог.
+
+    :param counter: Функция, возвращающая число выполненных к данному моменту запросов.
+        None - выключает проверку.
+    :param limit: Допустимое число запросов за отрисовку.
+    :param strict: Выбрасывать исключение вместо предупреждения.
+    """
+    global _query_counter, _query_limit, _query_limit_strict
+    _query_counter, _query_limit, _query_limit_strict = counter, limit, strict
+
+
+def _check_query_limit(path: str, queries: int):
+    if queries <= _query_limit:
+        return
+
+    message = f'{path}: Rendering executed {queries} database queries (limit is {_query_limit}), ' \
+              f'declare traversed relations with <?{RELATIONS_INSTRUCTION}?> and load them beforehand'
+    if _query_limit_strict:
+        raise QueryLimitError(message)
+    logger.warning(message)
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    currsize: int
+    render_hits: int = 0
+    render_misses: int = 0
+    string_hits: int = 0
+    string_misses: int = 0
+    string_currsize: int = 0
+
+
+@dataclasses.dataclass
+class CompiledTemplate:
+    """ Разобранный шаблон вместе с отпечатком файла, из которого он был получен """
+    path: str
+    document: Document
+    mtime: int
+    size: int
+    memoize: Optional[tuple[str, ...]] = None
+    """ Ключи контекста, от которых зависит результат отрисовки, если шаблон
+        объявил <?memoize ...?>, иначе None """
+    renders: 'collections.OrderedDict[Any, Any]' = dataclasses.field(default_factory=collections.OrderedDict)
+    """ Запомненные результаты отрисовки (LRU) """
+    relations: dict[str, tuple[str, ...]] = dataclasses.field(default_factory=dict)
+    """ Связи, по которым проходит шаблон, объявленные в <?relations ...?>:
+        переменная контекста -> пути по ForeignKey полям """
+
+
+MEMOIZE_INSTRUCTION = 'memoize'
+MEMOIZE_CACHE_SIZE = 32
+""" Наибольшее число запомненных результатов отрисовки для одного шаблона """
+
+
+_memoize_key_functions: list[Callable[[], Any]] = []
+
+
+def register_memoize_key(func: Callable[[], Any]) -> Callable[[], Any]:
+    """ Регистрирует функцию, значение которой добавляется к ключу запомненных
+        отрисовок. Для состояния, от которого зависит результат, но которое не
+        передаётся в контексте (например, текущий бот) """
+    _memoize_key_functions.append(func)
+    return func
+
+
+def _memoize_keys(document: Document) -> Optional[tuple[str, ...]]:
+    """ Извлекает ключи из инструкции <?memoize key1, key2?>, стоящей перед корневым элементом """
+    for node in document.childNodes:
+        if node.nodeType == Node.PROCESSING_INSTRUCTION_NODE and node.target == MEMOIZE_INSTRUCTION:
+            return tuple(str2list(node.data)) if node.data.strip() else ()
+    return None
+
+
+RELATIONS_INSTRUCTION = 'relations'
+
+
+def _relations(document: Document) -> dict[str, tuple[str, ...]]:
+    """ Извлекает связи из инструкций <?relations order.subscription, order.coupon.type?>,
+        стоящих перед корневым элементом """
+    relations = {}
+    for node in document.childNodes:
+        if node.nodeType != Node.PROCESSING_INSTRUCTION_NODE or node.target != RELATIONS_INSTRUCTION:
+            continue
+
+        for relation in str2list(node.data.strip()):
+            variable, _, path = relation.partition('.')
+            if not path:
+                raise ParsingError(f'Relation "{relation}" must be written as "variable.field[.field ...]"')
+            relations[variable] = (*relations.get(variable, ()), path)
+
+    return relations
+
+
+def _freeze(value: Any) -> Any:
+    """ Приводит значения контекста к хешируемому виду для ключа запомненной отрисовки """
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_freeze, value))
+    if isinstance(value, dict):
+        return frozenset((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset(map(_freeze, value))
+    return value
+
+
+_template_cache: dict[str, CompiledTemplate] = {}
+_template_cache_hits: int = 0
+_template_cache_misses: int = 0
+_render_cache_hits: int = 0
+_render_cache_misses: int = 0
+
+STRING_CACHE_SIZE = 128
+""" Наибольшее число разобранных шаблонов из строк (render_string), хранящихся в кеше """
+
+_string_cache: 'collections.OrderedDict[bytes, Document]' = collections.OrderedDict()
+_string_cache_hits: int = 0
+_string_cache_misses: int = 0
+
+_template_dependents: dict[str, set[str]] = {}
+""" Граф зависимостей: путь к встраиваемому шаблону -> пути шаблонов, которые его встраивают """
+
+
+def _normalize_path(path: Union[str, Path]) -> str:
+    return os.path.normpath(path)
+
+
+def _invalidate_dependents(path: str):
+    """ Удаляет из кеша все шаблоны, прямо или косвенно встраивающие указанный """
+    pending = list(_template_dependents.get(path, ()))
+    visited = set()
+
+    while pending:
+        dependent = pending.pop()
+        if dependent in visited:
+            continue
+        visited.add(dependent)
+
+        _template_cache.pop(dependent, None)
+        pending.extend(_template_dependents.get(dependent, ()))
+
+
+ENGINE_VERSION = 3
+""" Версия скомпилированного представления шаблонов. Должна увеличиваться при любом
+    изменении, делающем недействительными файлы дискового кеша """
+
+_disk_cache_directory: Optional[Path] = None
+
+
+def set_disk_cache_directory(directory: Union[str, Path, None]):
+    """ Устанавливает директорию дискового кеша шаблонов. None - отключает кеш """
+    global _disk_cache_directory
+    _disk_cache_directory = None if directory is None else Path(directory)
+
+
+def get_disk_cache_directory() -> Optional[Path]:
+    """ Возвращает директорию дискового кеша шаблонов """
+    return _disk_cache_directory
+
+
+def _iter_expressions(node: Node) -> Iterable[str]:
+    """ Возвращает все python-выражения шаблона: условия, источники циклов
+        и значения атрибутов со спецификатором "py" """
+    if node.nodeType == Node.ELEMENT_NODE:
+        for attribute, value in node.attrs:
+            if attribute in (ParsingScope.DISPLAY_ATTRIBUTE_IF, ParsingScope.DISPLAY_ATTRIBUTE_ELSE_IF):
+                yield value
+            elif attribute == ParsingScope.DUPLICATE_ATTRIBUTE:
+                yield value.partition(ParsingScope.DUPLICATE_SEPARATOR)[2]
+            elif attribute.endswith('.py'):
+                yield value
+
+    for child in node.childNodes:
+        yield from _iter_expressions(child)
+
+
+def _disk_cache_path(content: bytes) -> Path:
+    digest = hashlib.sha256(content).hexdigest()
+    return _disk_cache_directory / f'{digest}.v{ENGINE_VERSION}.{sys.implementation.cache_tag}.pickle'
+
+
+def _read_disk_cache(content: bytes) -> Optional[Document]:
+    """ Возвращает разобранный документ из дискового кеша, заодно заполняя
+        кеш скомпилированных выражений. None - если в кеше ничего нет или его
+        не удалось прочитать (повреждён, сохранён другой версией шаблонизатора) """
+    # noinspection PyBroadException
+    try:
+        with open(_disk_cache_path(content), 'rb') as file:
+            document, expressions = pickle.load(file)
+        expressions = {source: marshal.loads(code) for source, code in expressions.items()}
+    except Exception:
+        return None
+
+    for source, code in expressions.items():
+        if len(_compiled_expressions) >= EXPRESSION_CACHE_SIZE:
+            break
+        _compiled_expressions.setdefault(source, code)
+
+    return document
+
+
+def _write_disk_cache(content: bytes, document: Document):
+    """ Сохраняет разобранный документ и скомпилированные выражения шаблона. Ошибки
+        при записи игнорируются - дисковый кеш не обязателен для работы """
+    expressions = {}
+    for source in _iter_expressions(document):
+        with contextlib.suppress(SyntaxError):
+            expressions[source] = marshal.dumps(compile_expression(source))
+
+    path = _disk_cache_path(content)
+    temporary = path.with_suffix(f'.{os.getpid()}.tmp')
+
+    with contextlib.suppress(Exception):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporary, 'wb') as file:
+            pickle.dump((document, expressions), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+
+def get_template_line(node: Node) -> Optional[int]:
+    """ Возвращает номер строки файла шаблона, на которой начинается элемент,
+        для текста - строку родительского элемента. None, если номер неизвестен """
+    if node.nodeType != Node.ELEMENT_NODE:
+        node = node.parentNode
+    return getattr(node, 'line', None)
+
+
+def _parse_template(path: str) -> Document:
+    if _disk_cache_directory is None:
+        with open(path, 'rb') as file:
+            return parse_file(file)
+
+    with open(path, 'rb') as file:
+        content = file.read()
+
+    if (document := _read_disk_cache(content)) is not None:
+        return document
+
+    document = parse_string(content)
+    _write_disk_cache(content, document)
+    return document
+
+
+def load_template(path: Union[str, Path]) -> CompiledTemplate:
+    """
+    Возвращает разобранный шаблон. Шаблоны кешируются на уровне процесса,
+    файл разбирается повторно только если изменились время его модификации
+    или размер. При повторном разборе из кеша удаляются и все шаблоны,
+    которые встраивают данный (см. include_template).
+
+    Если задана директория дискового кеша, разобранный шаблон и его
+    скомпилированные выражения берутся оттуда по хешу содержимого файла.
+
+    :param path: Путь к файлу шаблона.
+    :return: Закешированный шаблон.
+    """
+    global _template_cache_hits
+    global _template_cache_misses
+
+    path = _normalize_path(path)
+    stat = os.stat(path)
+
+    cached = _template_cache.get(path)
+    if cached is not None and cached.mtime == stat.st_mtime_ns and cached.size == stat.st_size:
+        _template_cache_hits += 1
+        return cached
+
+    if cached is not None:
+        _invalidate_dependents(path)
+
+    _template_cache_misses += 1
+    document = _parse_template(path)
+    compiled = CompiledTemplate(path, document, stat.st_mtime_ns, stat.st_size, _memoize_keys(document),
+                                relations=_relations(document))
+    compiled.document.path = path
+    _template_cache[path] = compiled
+    return compiled
+
+
+def get_template_path(node: Node) -> Optional[str]:
+    """ Возвращает путь к файлу шаблона, которому принадлежит узел, или None,
+        если документ был получен не через load_template (например, render_string) """
+    document = node if node.ownerDocument is None else node.ownerDocument
+    return getattr(document, 'path', None)
+
+
+def include_template(path: Union[str, Path], node: Node = None) -> CompiledTemplate:
+    """
+    Возвращает разобранный встраиваемый шаблон, так же как load_template,
+    и запоминает, что шаблон, которому принадлежит node, зависит от него.
+
+    :param path: Путь к встраиваемому шаблону.
+    :param node: Узел, производящий встраивание.
+    :return: Закешированный шаблон.
+    """
+    compiled = load_template(path)
+
+    if node is not None and (dependent := get_template_path(node)) is not None:
+        _template_dependents.setdefault(compiled.path, set()).add(dependent)
+
+    return compiled
+
+
+def get_relations(path: Union[str, Path]) -> dict[str, tuple[str, ...]]:
+    """
+    Возвращает связи, объявленные шаблоном: для каждой переменной контекста -
+    пути по ForeignKey полям, которые шаблон проходит при отрисовке. Вызывающий
+    код может загрузить их заранее, одним запросом (см. ezqr.join_relations)::
+
+        │ <?relations orders.subscription?>
+        │ <message>
+        │     <p for="order in orders"> {order.subscription.title} </p>
+        │ </message>
+
+        >>> get_relations('op-message-order-list.xml')
+        {'orders': ('subscription',)}
+
+    """
+    return load_template(path).relations
+
+
+def get_dependents(path: Union[str, Path]) -> set[str]:
+    """ Возвращает пути шаблонов, напрямую встраивающих указанный """
+    return set(_template_dependents.get(_normalize_path(path), ()))
+
+
+def get_cache_info() -> CacheInfo:
+    """ Возвращает статистику кеша шаблонов: попадания, промахи и текущий размер,
+        попадания и промахи запомненных отрисовок, а также статистику кеша
+        шаблонов из строк (render_string) """
+    return CacheInfo(_template_cache_hits, _template_cache_misses, len(_template_cache),
+                     _render_cache_hits, _render_cache_misses,
+                     _string_cache_hits, _string_cache_misses, len(_string_cache))
+
+
+def clear_cache():
+    """ Очищает кеш шаблонов (вместе с запомненными отрисовками), кеш шаблонов
+        из строк, граф зависимостей и сбрасывает статистику """
+    global _template_cache_hits
+    global _template_cache_misses
+    global _render_cache_hits
+    global _render_cache_misses
+    global _string_cache_hits
+    global _string_cache_misses
+
+    _template_cache.clear()
+    _template_dependents.clear()
+    _string_cache.clear()
+    _template_cache_hits = 0
+    _template_cache_misses = 0
+    _render_cache_hits = 0
+    _render_cache_misses = 0
+    _string_cache_hits = 0
+    _string_cache_misses = 0
+
+
+def _load_string(string: str) -> Document:
+    """ Возвращает разобранный шаблон из строки. Документы хранятся в LRU кеше
+        по хешу содержимого, вместе с ними сохраняются и их скомпилированные функции """
+    global _string_cache_hits
+    global _string_cache_misses
+
+    key = hashlib.sha256(string.encode()).digest()
+
+    try:
+        document = _string_cache[key]
+    except KeyError:
+        pass
+    else:
+        _string_cache.move_to_end(key)
+        _string_cache_hits += 1
+        return document
+
+    _string_cache_misses += 1
+    document = parse_string(string)
+
+    _string_cache[key] = document
+    if len(_string_cache) > STRING_CACHE_SIZE:
+        _string_cache.popitem(last=False)
+
+    return document
 
 
 def render_string(string: str, context: dict, syntax: ParsingScope = None):
+    """
+    Отрисовывает шаблон из строки, например хранящийся в базе данных (описание
+    лотереи). Разобранный и скомпилированный шаблон запоминается по хешу строки,
+    так что повторная отрисовка той же строки не разбирает её заново. Кеш
+    ограничен STRING_CACHE_SIZE шаблонами, дольше всех не использованные удаляются.
+    """
     return render_document(
-        minidom.parseString(string),
+        _load_string(string),
         context,
         syntax=syntax
     )
 
 
 def render(path: str, context: dict, syntax: ParsingScope = None):
-    return render_document(
-        minidom.parse(path),
-        context,
-        path=path,
-        syntax=syntax
+    """
+    Отрисовывает шаблон из файла.
+
+    Если шаблон начинается с инструкции <?memoize key1, key2?>, результат
+    запоминается по значениям перечисленных ключей контекста (<?memoize?> - результат
+    не зависит от контекста) и при повторной отрисовке возвращается тот же объект.
+    Такие результаты общие для всех вызывающих и не должны изменяться, а сам
+    шаблон не должен зависеть от чего-либо кроме контекста (например, от текущего
+    пользователя, как <chat-current/>).
+
+    Пример::
+
+        │ <?memoize services?>
+        │ <message>
+        │     ...
+        │ </message>
+
+    """
+    global _render_cache_hits
+    global _render_cache_misses
+    global _uncacheable
+
+    compiled = load_template(path)
+
+    if compiled.memoize is None:
+        return render_document(compiled.document, context, path=path, syntax=syntax)
+
+    key = (
+        syntax or _default_syntax,
+        *(func() for func in _memoize_key_functions),
+        *(_freeze(context.get(name)) for name in compiled.memoize)
     )
+    try:
+        result = compiled.renders[key]
+    except TypeError:
+        # Значения не хешируются - отрисовываем без запоминания
+        return render_document(compiled.document, context, path=path, syntax=syntax)
+    except KeyError:
+        pass
+    else:
+        compiled.renders.move_to_end(key)
+        _render_cache_hits += 1
+        return result
+
+    _render_cache_misses += 1
+
+    previous, _uncacheable = _uncacheable, False
+    try:
+        result = render_document(compiled.document, context, path=path, syntax=syntax)
+        if _uncacheable:
+            return result
+    finally:
+        _uncacheable = previous or _uncacheable
+
+    compiled.renders[key] = result
+    if len(compiled.renders) > MEMOIZE_CACHE_SIZE:
+        compiled.renders.popitem(last=False)
+
+    return result
+
+
+def render_many(path: str, base_context: dict, per_item_contexts: Iterable[dict],
+                syntax: ParsingScope = None) -> Generator[Any, None, None]:
+    """
+    Отрисовывает один шаблон для множества контекстов: для каждого элемента
+    per_item_contexts - с base_context, дополненным (и переопределённым) item. Части шаблона,
+    не зависящие от ключей item, выполняются один раз, для остальных отрисовок
+    повторяются их готовые токены. Поэтому результаты разных отрисовок могут
+    содержать одни и те же объекты и не должны изменяться.
+
+    Пример использования::
+
+        >>> for chat_id, messages in zip(receivers, render_many(path, {'post': post},
+        ...                                                      ({'chat_id': c} for c in receivers))):
+        ...     await messages.send(chat_id)
+
+    :param path: Путь к файлу шаблона.
+    :param base_context: Общий для всех отрисовок контекст.
+    :param per_item_contexts: Изменяющиеся части контекста.
+    :param syntax: Синтаксис документа.
+    :return: Генератор результатов отрисовки, по одному на элемент per_item_contexts.
+    """
+    global _batch_replay
+
+    syntax = syntax or _default_syntax
+    if syntax is None:
+        raise ValueError('No default syntax is set, so it must be provided manually')
+
+    document = load_template(path).document
+    replay = _BatchReplay(document)
+
+    # Общая часть контекста собирается один раз, как в render_document
+    path = Path(path)
+    context = RenderContext(_global_context) \
+        .child({'__dir__': path.parent, '__file__': path}) \
+        .child(base_context)
+
+    for item in per_item_contexts:
+        replay.set_varying(frozenset(item))
+        queries = 0 if _query_counter is None else _query_counter()
+
+        previous, _batch_replay = _batch_replay, replay
+        try:
+            result = syntax.parse(document, context.child(item))
+        finally:
+            _batch_replay = previous
+
+        if _query_counter is not None:
+            _check_query_limit(str(path), _query_counter() - queries)
+
+        yield result
 
 
 __all__ = (
     'ReadOnlyDict',
+    'RenderContext',
     'MutableVariable',
     'TemplateModuleError',
     'RegistrationError',
@@ -812,16 +2234,28 @@ __all__ = (
     'ParsingCoroutineError',
     'SpecifierError',
     'ConvertingError',
+    'QueryLimitError',
     'ConvertBy',
     'str2bool',
     'str2list',
     'converting_specifier',
+    'FormatString',
+    'compile_format',
+    'html_escape',
     'f_converting_specifier',
     'context_var_specifier',
     'exec_python_specifier',
+    'EXPRESSION_CACHE_SIZE',
+    'compile_expression',
     'converters',
     'specifiers',
+    'format_variables',
+    'expression_variables',
+    'variable_collectors',
     'StopParsing',
+    'STATIC_SPECIFIERS',
+    'set_compilation_enabled',
+    'get_compilation_enabled',
     'ParsingScope',
     'register_text',
     'register',
@@ -831,6 +2265,28 @@ __all__ = (
     'get_default_syntax',
     'get_global_context',
     'render_document',
+    'CacheInfo',
+    'CompiledTemplate',
+    'MEMOIZE_INSTRUCTION',
+    'MEMOIZE_CACHE_SIZE',
+    'STRING_CACHE_SIZE',
+    'register_memoize_key',
+    'RELATIONS_INSTRUCTION',
+    'set_query_limit',
+    'ENGINE_VERSION',
+    'set_disk_cache_directory',
+    'get_disk_cache_directory',
+    'load_template',
+    'get_template_path',
+    'include_template',
+    'get_relations',
+    'get_dependents',
+    'get_cache_info',
+    'clear_cache',
     'render_string',
     'render',
+    'render_many',
+    'mark_uncacheable',
+    'set_profiler',
+    'get_template_line',
 )
@@ -1,2 +1,6 @@
 # noinspection PyUnresolvedReferences
 from ._template import *
+# noinspection PyUnresolvedReferences
+from ._preload import *
+# noinspection PyUnresolvedReferences
+from ._nodes import *
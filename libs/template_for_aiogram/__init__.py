@@ -3,3 +3,4 @@ from . import handlers as _
 
 # noinspection PyPep8Naming
 from .scopes import DOCUMENT as aiogram_syntax
+from .scopes import SCOPES as aiogram_scopes
@@ -1,4 +1,6 @@
+import functools
 import re
+import weakref
 from typing import Union
 
 from aiogram.types import InputFile, InlineKeyboardMarkup, WebAppInfo, LoginUrl, CallbackGame, InlineKeyboardButton, \
@@ -27,7 +29,8 @@ def messages(tag: Tag) -> MessageRenderList:
 
 
 @register([DOCUMENT, MESSAGES])
-def message(tag: Tag, *, requires: ConvertBy[str2list] = None) -> MessageRender:
+def message(tag: Tag, *, requires: ConvertBy[str2list] = None, split: bool = False) \
+        -> Union[MessageRender, MessageRenderList]:
     """
         Сообщение.
 
@@ -40,17 +43,49 @@ def message(tag: Tag, *, requires: ConvertBy[str2list] = None) -> MessageRender:
 
         Аргументы::
 
-            <message[ requires: list[str]/>
+            <message[ requires: list[str]][ split: bool]/>
             requires - Переменные окружения необходимые для отображения.
                 Проверит наличие до parsing-а.
+            split - Если текст не помещается в одно сообщение, разбить его
+                по границам секций и параграфов на несколько. Изображение
+                останется у первого сообщения, клавиатура - у последнего.
 
     """
     requires = requires or []
 
-    if expected := set(requires) - set(tag.context.keys()):
+    if expected := {name for name in requires if name not in tag.context}:
         raise ParsingError(f'Template requires additional {expected} context variables')
 
-    return MESSAGE.parse(tag.element, tag.context)
+    return MESSAGE.parse(tag.element, tag.context, split=split)
+
+
+_validated_call_sites: weakref.WeakKeyDictionary[Element, dict[str, CompiledTemplate]] = \
+    weakref.WeakKeyDictionary()
+""" Места встраивания (теги <template>), для которых уже проверено соответствие
+    переданных аргументов объявленным в шаблоне """
+
+
+def _validate_template_call(tag: Tag, tmpl: Element, src: str, provided: dict):
+    # Enforcing correct syntax
+
+    if tmpl.tagName != 'template':
+        raise ParsingError(f'Expected template file at "{src}"')
+
+    if unexpected := {name for name, _ in tmpl.attrs} - {'requires'}:
+        raise ParsingError(f'{tag.element.tagName}: Got unexpected arguments {unexpected}')
+
+    # Checking if there is any mismatch in required and provided arguments
+
+    if tmpl.hasAttribute('requires'):
+        required = set(str2list(tmpl.getAttribute('requires')))
+    else:
+        required = set()
+    provided = set(provided)
+
+    if unprovided := required - provided:
+        raise ParsingError(f'{tag.element.tagName}: Arguments {unprovided} were expected, but not provided')
+    if unexpected := provided - required:
+        raise ParsingError(f'{tag.element.tagName}: Got unexpected arguments {unexpected}')
 
 
 @register([MESSAGE, ELEMENT])
@@ -89,39 +124,26 @@ def template(tag: Tag, *, src: str, __rem: dict):
 
     """
 
-    from xml.dom import minidom
-    document = minidom.parse(src)
-    tmpl: minidom.Element = document.childNodes[0]
-
-    # Enforcing correct syntax
+    included = include_template(src, tag.element)
+    tmpl: Element = included.document.documentElement
 
-    if tmpl.tagName != 'template':
-        raise ParsingError(f'Expected template file at "{src}"')
+    # Проверка выполняется один раз для каждого места встраивания
+    # и повторяется только если встраиваемый шаблон изменился
 
-    if unexpected := set(tmpl.attributes.keys()) - {'requires'}:
-        raise ParsingError(f'{tag.element.tagName}: Got unexpected arguments {unexpected}')
-
-    # Checking if there is any mismatch in required and provided arguments
-
-    try:
-        required = set(str2list(tmpl.attributes['requires'].value))
-    except KeyError:
-        required = set()
-    provided = set(__rem)
-
-    if unprovided := required - provided:
-        raise ParsingError(f'{tag.element.tagName}: Arguments {unprovided} were expected, but not provided')
-    if unexpected := provided - required:
-        raise ParsingError(f'{tag.element.tagName}: Got unexpected arguments {unexpected}')
+    validated = _validated_call_sites.setdefault(tag.element, {})
+    if validated.get(included.path) is not included:
+        _validate_template_call(tag, tmpl, src, __rem)
+        validated[included.path] = included
 
     # Processing template elements
 
     cond_status = MutableVariable(None)
+    context = RenderContext(__rem)
     for element in tmpl.childNodes:
-        tag.process(element, ReadOnlyDict(__rem), cond_status)
+        tag.process(element, context, cond_status)
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def paste(_, value: str) -> Text:
     """
         Вставляет текст переданный в value в сыром виде.
@@ -150,16 +172,27 @@ def paste(_, value: str) -> Text:
 SPACING_PATTERN = re.compile(r'\s+')
 
 
-@register_text([MESSAGE, ELEMENT, NO_HTML])
+@functools.lru_cache(maxsize=4096)
+def _compile_text(value: str) -> Union[Text, FormatString]:
+    """ Нормализует пробелы и разбирает текст на литералы и поля один раз.
+        Текст без полей сразу возвращается готовым токеном """
+    words = re.split(SPACING_PATTERN, value)
+    text = compile_format(' '.join(words).strip(), escape=html_escape)
+    if text.literal is not None:
+        return Text(text.literal)
+    return text
+
+
+@register_text([MESSAGE, ELEMENT, NO_HTML], static=True)
 def _text_(tag: Tag) -> Paragraph:
     """ Не обрамлённый в теги текст """
-    words = re.split(SPACING_PATTERN, tag.element.nodeValue)
-    result = ' '.join(words).strip().format_map(tag.context)
-    result = result.replace('<', '&lt;').replace('>', '&gt;')
-    return Text(result)
+    text = _compile_text(tag.element.nodeValue)
+    if isinstance(text, Text):
+        return text
+    return Text(text.format(tag.context))
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def heading(tag: Tag) -> Paragraph:
     """
         Заголовок. Содержимое переводится в верхний регистр
@@ -188,7 +221,7 @@ def heading(tag: Tag) -> Paragraph:
     return Paragraph(f'<b>{NO_HTML.parse(tag.element, tag.context).upper()}</b>')
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def section(tag: Tag) -> Paragraph:
     """
         Секция.
@@ -217,7 +250,7 @@ def section(tag: Tag) -> Paragraph:
     return Section(ELEMENT.parse(tag.element, tag.context))
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def p(tag: Tag) -> Paragraph:
     """
         Параграф.
@@ -247,7 +280,7 @@ def p(tag: Tag) -> Paragraph:
     return Paragraph(ELEMENT.parse(tag.element, tag.context))
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def br(_) -> Paragraph:
     """
         Пустая строка.
@@ -275,7 +308,7 @@ def br(_) -> Paragraph:
     return Paragraph()
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def span(tag: Tag) -> Text:
     """
         Часть текста.
@@ -304,7 +337,7 @@ def span(tag: Tag) -> Text:
     return Text(ELEMENT.parse(tag.element, tag.context))
 
 
-@register([NO_HTML], name='span')
+@register([NO_HTML], name='span', static=True)
 def span_no_html(tag: Tag) -> Text:
     """
         Часть no-html текста.
@@ -332,7 +365,7 @@ def span_no_html(tag: Tag) -> Text:
     return Text(NO_HTML.parse(tag.element, tag.context))
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def a(tag: Tag, *, href: str) -> Text:
     """
         Ссылка.
@@ -365,7 +398,7 @@ def a(tag: Tag, *, href: str) -> Text:
     return Text(f'<a href="{href}">{NO_HTML.parse(tag.element, tag.context)}</a>')
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def b(tag: Tag) -> Text:
     """
         Жирный шрифт.
@@ -393,7 +426,7 @@ def b(tag: Tag) -> Text:
     return Text(f'<b>{ELEMENT.parse(tag.element, tag.context)}</b>')
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def i(tag: Tag) -> Text:
     """
         Курсив.
@@ -421,7 +454,7 @@ def i(tag: Tag) -> Text:
     return Text(f'<i>{ELEMENT.parse(tag.element, tag.context)}</i>')
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def u(tag: Tag) -> Text:
     """
         Подчёркнутый текст.
@@ -449,7 +482,7 @@ def u(tag: Tag) -> Text:
     return Text(f'<u>{ELEMENT.parse(tag.element, tag.context)}</u>')
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def s(tag: Tag) -> Text:
     """
         Зачёркнутый текст.
@@ -477,7 +510,7 @@ def s(tag: Tag) -> Text:
     return Text(f'<s>{ELEMENT.parse(tag.element, tag.context)}</s>')
 
 
-@register([MESSAGE, ELEMENT])
+@register([MESSAGE, ELEMENT], static=True)
 def code(tag: Tag) -> Text:
     """
         Моноширинный копируемый текст.
@@ -505,7 +538,7 @@ def code(tag: Tag) -> Text:
     return Text(f'<code>{NO_HTML.parse(tag.element, tag.context)}</code>')
 
 
-@register([MESSAGE])
+@register([MESSAGE], static=True)
 def img(_, *, src: str) -> Union[ImageID, ImageFile]:
     """
         Изображение.
@@ -531,7 +564,7 @@ def img(_, *, src: str) -> Union[ImageID, ImageFile]:
     raise ParsingError(f'img.src expected "str" or "InputFile", got "{type(src)}"')
 
 
-@register([MESSAGE])
+@register([MESSAGE], static=True)
 def anim(_, *, src: str) -> Union[AnimationID, AnimationFile]:
     """
         Анимация.
@@ -557,7 +590,7 @@ def anim(_, *, src: str) -> Union[AnimationID, AnimationFile]:
     raise ParsingError(f'anim.src expected "str" or "InputFile", got "{type(src)}"')
 
 
-@register([MESSAGE], name='inline-keyboard')
+@register([MESSAGE], name='inline-keyboard', static=True)
 def inline_keyboard(tag: Tag) -> InlineKeyboardMarkup:
     """
         Inline-клавиатура.
@@ -574,7 +607,7 @@ def inline_keyboard(tag: Tag) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=layout)
 
 
-@register([INLINE_KEYBOARD], name='row')
+@register([INLINE_KEYBOARD], name='row', static=True)
 def row_inline_keyboard(tag: Tag) -> KeyboardLayoutRow:
     """
         Строка inline-клавиатуры.
@@ -590,7 +623,7 @@ def row_inline_keyboard(tag: Tag) -> KeyboardLayoutRow:
     return INLINE_KEYBOARD_ROW.parse(tag.element, tag.context)
 
 
-@register([INLINE_KEYBOARD, INLINE_KEYBOARD_ROW], name='button')
+@register([INLINE_KEYBOARD, INLINE_KEYBOARD_ROW], name='button', static=True)
 def button_inline_keyboard(tag: Tag, *, text: str = None, url: str = None, callback_data: str = None,
                            web_app: WebAppInfo = None, login_url: LoginUrl = None,
                            switch_inline_query: str = None, switch_inline_query_current_chat: str = None,
@@ -627,7 +660,7 @@ def button_inline_keyboard(tag: Tag, *, text: str = None, url: str = None, callb
     )
 
 
-@register([MESSAGE], name='reply-keyboard')
+@register([MESSAGE], name='reply-keyboard', static=True)
 def reply_keyboard(tag: Tag, *, resize_keyboard: bool = None, one_time_keyboard: bool = None,
                    input_field_placeholder: str = None, selective: bool = None) -> ReplyKeyboardMarkup:
     """
@@ -654,7 +687,7 @@ def reply_keyboard(tag: Tag, *, resize_keyboard: bool = None, one_time_keyboard:
     )
 
 
-@register([REPLY_KEYBOARD], name='row')
+@register([REPLY_KEYBOARD], name='row', static=True)
 def row_reply_keyboard(tag: Tag) -> KeyboardLayoutRow:
     """
         Строка reply-клавиатуры.
@@ -670,7 +703,7 @@ def row_reply_keyboard(tag: Tag) -> KeyboardLayoutRow:
     return REPLY_KEYBOARD_ROW.parse(tag.element, tag.context)
 
 
-@register([REPLY_KEYBOARD, REPLY_KEYBOARD_ROW], name='button')
+@register([REPLY_KEYBOARD, REPLY_KEYBOARD_ROW], name='button', static=True)
 def button_reply_keyboard(tag: Tag, *, text: str = None, request_contact: bool = None, request_location: bool = None,
                           request_poll: KeyboardButtonPollType = None, web_app: WebAppInfo = None) -> KeyboardButton:
     """
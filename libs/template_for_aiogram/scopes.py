@@ -1,4 +1,4 @@
-from typing import Generator, Union
+from typing import Callable, Generator, Optional, Union
 
 from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, \
     KeyboardButton
@@ -43,6 +43,10 @@ def message_list_assembler() -> Generator[MessageRenderList, MessageRender, None
             messages.append(token)
             continue
 
+        elif isinstance(token, MessageRenderList):
+            messages.extend(token)
+            continue
+
         raise ParsingCoroutineError(f'Got unexpected token "{token}" (type: {token.__class__})')
 
     yield messages
@@ -51,93 +55,119 @@ def message_list_assembler() -> Generator[MessageRenderList, MessageRender, None
 MESSAGES = ParsingScope(message_list_assembler)
 
 
-# noinspection DuplicatedCode
-def message_assembler() -> Generator[MessageRender,
-                                     Union[ImageID, ImageFile, AnimationID, AnimationFile, Paragraph, Text,
-                                           InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove], None]:
-    message = MessageRender("")
-    layout = TextLayout()
+class TypeDispatch(dict):
+    """
+    Таблица "тип токена -> действие". Действие для класса токена ищется
+    по его MRO один раз, при первом появлении класса, дальше берётся из словаря.
+    Для классов без действия сохраняется None.
+    """
 
-    while (token := (yield)) is not StopParsing:
+    def __init__(self, actions: dict[type, Callable]):
+        super().__init__()
+        self._actions = actions
 
-        if isinstance(token, ImageID):
-            if message.photo is not None:
-                raise ParsingCoroutineError('Message can only have one photo')
-            if message.animation is not None:
-                raise ParsingCoroutineError('Message can not have both photo and animation')
-            message.photo = token
-            continue
+    def __missing__(self, token_type: type) -> Optional[Callable]:
+        action = next((self._actions[base] for base in token_type.__mro__ if base in self._actions), None)
+        self[token_type] = action
+        return action
 
-        if isinstance(token, ImageFile):
-            if message.photo is not None:
-                raise ParsingCoroutineError('Message can only have one photo')
-            if message.animation is not None:
-                raise ParsingCoroutineError('Message can not have both photo and animation')
-            message.photo = token.input_file
-            continue
 
-        if isinstance(token, AnimationID):
-            if message.animation is not None:
-                raise ParsingCoroutineError('Message can only have one animation')
-            if message.photo is not None:
-                raise ParsingCoroutineError('Message can not have both photo and animation')
-            message.animation = token
-            continue
+def _unexpected_token(token) -> ParsingCoroutineError:
+    return ParsingCoroutineError(f'Got unexpected token "{token}" (type: {token.__class__})')
 
-        if isinstance(token, AnimationFile):
-            if message.animation is not None:
-                raise ParsingCoroutineError('Message can only have one animation')
-            if message.photo is not None:
-                raise ParsingCoroutineError('Message can not have both photo and animation')
-            message.animation = token.input_file
-            continue
 
-        if isinstance(token, Section):
-            layout.add_section(token)
-            continue
+def _set_photo(message: MessageRender, photo):
+    if message.photo is not None:
+        raise ParsingCoroutineError('Message can only have one photo')
+    if message.animation is not None:
+        raise ParsingCoroutineError('Message can not have both photo and animation')
+    message.photo = photo
 
-        if isinstance(token, Paragraph):
-            layout.add_paragraph(token)
-            continue
 
-        if isinstance(token, (Text, str)):
-            layout.add_word(token)
-            continue
+def _set_animation(message: MessageRender, animation):
+    if message.animation is not None:
+        raise ParsingCoroutineError('Message can only have one animation')
+    if message.photo is not None:
+        raise ParsingCoroutineError('Message can not have both photo and animation')
+    message.animation = animation
 
-        if isinstance(token, (InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove)):
-            if message.keyboard is not None:
-                raise ParsingCoroutineError('Message can only have one keyboard')
-            message.keyboard = token
-            continue
 
-        raise ParsingCoroutineError(f'Got unexpected token "{token}" (type: {token.__class__})')
+def _set_keyboard(message: MessageRender, keyboard):
+    if message.keyboard is not None:
+        raise ParsingCoroutineError('Message can only have one keyboard')
+    message.keyboard = keyboard
 
-    message.text = layout.close()
-    yield message
 
+MESSAGE_ACTIONS = TypeDispatch({
+    ImageID: lambda message, _, token: _set_photo(message, token),
+    ImageFile: lambda message, _, token: _set_photo(message, token.input_file),
+    AnimationID: lambda message, _, token: _set_animation(message, token),
+    AnimationFile: lambda message, _, token: _set_animation(message, token.input_file),
+    Section: lambda _, layout, token: layout.add_section(token),
+    Paragraph: lambda _, layout, token: layout.add_paragraph(token),
+    str: lambda _, layout, token: layout.add_word(token),
+    InlineKeyboardMarkup: lambda message, _, token: _set_keyboard(message, token),
+    ReplyKeyboardMarkup: lambda message, _, token: _set_keyboard(message, token),
+    ReplyKeyboardRemove: lambda message, _, token: _set_keyboard(message, token),
+})
 
-MESSAGE = ParsingScope(message_assembler)
 
+TEXT_LENGTH_LIMIT = 4096
+""" Максимальная длина текста сообщения в Telegram """
 
-# noinspection DuplicatedCode
-def text_assembler() -> Generator[str, Union[Paragraph, Text], None]:
+CAPTION_LENGTH_LIMIT = 1024
+""" Максимальная длина подписи к фото или анимации в Telegram """
+
+
+def _split_message(message: MessageRender, layout: TextLayout) -> MessageRenderList:
+    """ Разбивает текст сообщения на несколько сообщений, укладывающихся в ограничения
+        Telegram. Медиа остаётся у первого сообщения, клавиатура переносится в последнее """
+    has_media = message.photo is not None or message.animation is not None
+    chunks = layout.split(TEXT_LENGTH_LIMIT, CAPTION_LENGTH_LIMIT if has_media else TEXT_LENGTH_LIMIT)
+
+    messages = MessageRenderList(MessageRender(text) for text in chunks)
+    messages[0].photo, messages[0].animation = message.photo, message.animation
+    messages[-1].keyboard = message.keyboard
+    return messages
+
+
+def message_assembler(split: bool = False) \
+        -> Generator[Union[MessageRender, MessageRenderList],
+                     Union[ImageID, ImageFile, AnimationID, AnimationFile, Paragraph, Text,
+                           InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove], None]:
+    message = MessageRender("")
     layout = TextLayout()
 
     while (token := (yield)) is not StopParsing:
+        if (action := MESSAGE_ACTIONS[type(token)]) is None:
+            raise _unexpected_token(token)
+        action(message, layout, token)
 
-        if isinstance(token, Section):
-            layout.add_section(token)
-            continue
+    if split:
+        yield _split_message(message, layout)
+        return
 
-        if isinstance(token, Paragraph):
-            layout.add_paragraph(token)
-            continue
+    message.text = layout.close()
+    yield message
 
-        if isinstance(token, (Text, str)):
-            layout.add_word(token)
-            continue
 
-        raise ParsingCoroutineError(f'Got unexpected token "{token}" (type: {token.__class__})')
+MESSAGE = ParsingScope(message_assembler)
+
+
+TEXT_ACTIONS = TypeDispatch({
+    Section: TextLayout.add_section,
+    Paragraph: TextLayout.add_paragraph,
+    str: TextLayout.add_word,
+})
+
+
+def text_assembler() -> Generator[str, Union[Paragraph, Text], None]:
+    layout = TextLayout()
+
+    while (token := (yield)) is not StopParsing:
+        if (action := TEXT_ACTIONS[type(token)]) is None:
+            raise _unexpected_token(token)
+        action(layout, token)
 
     yield layout.close()
 
@@ -146,21 +176,21 @@ ELEMENT = ParsingScope(text_assembler)
 NO_HTML = ParsingScope(text_assembler)
 
 
+KEYBOARD_ACTIONS = TypeDispatch({
+    KeyboardLayoutRow: KeyboardLayout.add_row,
+    InlineKeyboardButton: KeyboardLayout.add,
+    KeyboardButton: KeyboardLayout.add,
+})
+
+
 def keyboard_assembler() -> Generator[Union[list[list[InlineKeyboardButton]], list[list[KeyboardButton]]],
                                       Union[InlineKeyboardButton, KeyboardButton], None]:
     layout = KeyboardLayout()
 
     while (token := (yield)) is not StopParsing:
-
-        if isinstance(token, KeyboardLayoutRow):
-            layout.add_row(token)
-            continue
-
-        if isinstance(token, (InlineKeyboardButton, KeyboardButton)):
-            layout.add(token)
-            continue
-
-        raise ParsingCoroutineError(f'Got unexpected token "{token}" (type: {token.__class__})')
+        if (action := KEYBOARD_ACTIONS[type(token)]) is None:
+            raise _unexpected_token(token)
+        action(layout, token)
 
     yield layout.result()
 
@@ -178,7 +208,7 @@ def keyboard_row_assembler() -> Generator[KeyboardLayoutRow, Union[InlineKeyboar
             buttons.append(token)
             continue
 
-        raise ParsingCoroutineError(f'Got unexpected token "{token}" (type: {token.__class__})')
+        raise _unexpected_token(token)
 
     yield buttons
 
@@ -186,15 +216,30 @@ def keyboard_row_assembler() -> Generator[KeyboardLayoutRow, Union[InlineKeyboar
 INLINE_KEYBOARD_ROW = ParsingScope(keyboard_row_assembler)
 REPLY_KEYBOARD_ROW = ParsingScope(keyboard_row_assembler)
 
+SCOPES = (
+    DOCUMENT,
+    MESSAGES,
+    MESSAGE,
+    ELEMENT,
+    NO_HTML,
+    INLINE_KEYBOARD,
+    REPLY_KEYBOARD,
+    INLINE_KEYBOARD_ROW,
+    REPLY_KEYBOARD_ROW,
+)
+
 
 __all__ = (
     'DOCUMENT',
     'MESSAGES',
     'MESSAGE',
+    'TEXT_LENGTH_LIMIT',
+    'CAPTION_LENGTH_LIMIT',
     'ELEMENT',
     'NO_HTML',
     'INLINE_KEYBOARD',
     'REPLY_KEYBOARD',
     'INLINE_KEYBOARD_ROW',
     'REPLY_KEYBOARD_ROW',
+    'SCOPES',
 )
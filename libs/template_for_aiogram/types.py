@@ -1,3 +1,4 @@
+import re
 import typing
 from typing import TypeVar
 
@@ -6,50 +7,191 @@ from aiogram.types import InputFile
 T = TypeVar('T')
 
 
+_WORD, _PARAGRAPH, _SECTION = 0, 1, 2
+_SEPARATORS = (' ', '\n', '\n\n')
+
+
+_CHAR, _ENTITY, _OPEN_TAG, _CLOSE_TAG = range(4)
+_MARKUP = re.compile(r'<(/?)([a-zA-Z][\w-]*)?[^<>]*>|&#?\w+;')
+""" Тег или сущность HTML. Группа 1 - "/" закрывающего тега, группа 2 - имя тега """
+
+
+def _tokens(text: str) -> typing.Iterator[tuple[int, int, int, typing.Optional[re.Match]]]:
+    """ Разбивает HTML текст на символы, сущности и теги: (начало, конец, вид, совпадение) """
+    position = 0
+    for match in _MARKUP.finditer(text):
+        for index in range(position, match.start()):
+            yield index, index + 1, _CHAR, None
+        kind = _ENTITY if match.group().startswith('&') else _CLOSE_TAG if match.group(1) else _OPEN_TAG
+        yield match.start(), match.end(), kind, match
+        position = match.end()
+    for index in range(position, len(text)):
+        yield index, index + 1, _CHAR, None
+
+
+def _visible_length(text: str) -> int:
+    """ Длина HTML текста так, как её считает Telegram: без тегов, сущность - один символ """
+    if '<' not in text and '&' not in text:
+        return len(text)
+    return sum(kind in (_CHAR, _ENTITY) for _, _, kind, _ in _tokens(text))
+
+
+def _cut(text: str, limit: int) -> tuple[str, str]:
+    """
+    Разрезает HTML текст, видимая длина которого больше limit, на начало видимой
+    длиной не более limit и остаток. Режет по последнему переводу строки (границе
+    параграфа внутри секции), если его нет - по последнему пробельному символу,
+    иначе - после последнего помещающегося символа. Теги и сущности не разрезаются,
+    а теги, не закрытые к месту разреза, закрываются в начале и открываются
+    заново в остатке. Остаток без видимого текста - пустая строка.
+    """
+    newline = space = None
+    fit = 0
+    visible = 0
+
+    for start, end, kind, _ in _tokens(text):
+        if kind == _OPEN_TAG:
+            # Открывающий тег уходит в остаток вместе со своим текстом
+            continue
+        if kind == _CLOSE_TAG:
+            fit = end
+            continue
+        if visible >= limit:
+            break
+        if visible and text[start].isspace():
+            if text[start] == '\n':
+                newline = start
+            else:
+                space = start
+        visible += 1
+        fit = end
+
+    cut = newline or space or fit
+    head, tail = text[:cut].rstrip(), text[cut:].lstrip()
+
+    opened: list[tuple[str, str]] = []
+    for _, _, kind, match in _tokens(head):
+        if kind == _OPEN_TAG:
+            opened.append((match.group(2), match.group()))
+        elif kind == _CLOSE_TAG:
+            for index in range(len(opened) - 1, -1, -1):
+                if opened[index][0] == match.group(2):
+                    del opened[index:]
+                    break
+
+    # Теги, закрывающиеся сразу после места разреза, остаются в начале
+    while opened and (match := _MARKUP.match(tail)) and match.group(1) and match.group(2) == opened[-1][0]:
+        head += match.group()
+        opened.pop()
+        tail = tail[match.end():].lstrip()
+
+    head += ''.join(f'</{name}>' for name, _ in reversed(opened))
+    tail = ''.join(tag for _, tag in opened) + tail
+    return head, tail if _visible_length(tail) else ''
+
+
 class TextLayout:
+    """ Собирает текст из слов, параграфов и секций. Слова разделяются пробелом,
+        параграфы - переводом строки, секции - пустой строкой. Части текста
+        накапливаются в одном списке и объединяются один раз, в close() """
+
+    __slots__ = ('_parts', '_break')
+
     def __init__(self):
-        self._sections: list[str] = []
-        self._paragraphs: list[str] = []
-        self._words: list[str] = []
+        self._parts: list[str] = []
+        self._break: int = _WORD
+        """ Разделитель, который будет поставлен перед следующей частью текста """
 
     def add_word(self, word: str):
         word = word.strip()
         if not word:
             return
-        self._words.append(word)
+        if self._parts:
+            self._parts.append(_SEPARATORS[self._break])
+        self._parts.append(word)
+        self._break = _WORD
 
     def close_paragraph(self):
-        paragraph = ' '.join(self._words)
-        if not paragraph:
-            return
-        self._paragraphs.append(paragraph)
-        self._words.clear()
+        if self._break < _PARAGRAPH:
+            self._break = _PARAGRAPH
 
     def add_paragraph(self, paragraph: str):
-        self.close_paragraph()
         paragraph = paragraph.strip()
-        if not paragraph:
-            return
-        self._paragraphs.append(paragraph)
+        if paragraph:
+            if self._parts:
+                self._parts.append(_SEPARATORS[max(self._break, _PARAGRAPH)])
+            self._parts.append(paragraph)
+            self._break = _PARAGRAPH
+        else:
+            self.close_paragraph()
 
     def close_section(self):
-        self.close_paragraph()
-        section = '\n'.join(self._paragraphs)
-        if not section:
-            return
-        self._sections.append(section)
-        self._paragraphs.clear()
+        self._break = _SECTION
 
     def add_section(self, section: str):
-        self.close_section()
         section = section.strip()
-        if not section:
-            return
-        self._sections.append(section)
+        if section:
+            if self._parts:
+                self._parts.append(_SEPARATORS[_SECTION])
+            self._parts.append(section)
+        self._break = _SECTION
 
     def close(self) -> str:
         self.close_section()
-        return '\n\n'.join(self._sections)
+        return ''.join(self._parts)
+
+    def split(self, limit: int, first_limit: int = None) -> list[str]:
+        """
+        Как close(), но разбивает текст на части длиной не более limit символов
+        (первую часть - не более first_limit). Длина считается как в Telegram -
+        без HTML тегов. Часть обрезается по последней границе параграфа или
+        секции, если таких нет - по последней границе слов. Слово, параграф
+        или секция длиннее лимита разрезается внутри, не разрезая теги
+        и сущности и сохраняя разметку правильной (см. _cut).
+        Возвращает хотя бы одну часть.
+        """
+        self.close_section()
+
+        # Чётные элементы - части текста, нечётные - разделители между ними
+        parts = list(self._parts)
+        count = len(parts)
+        chunks = []
+
+        current_limit = first_limit or limit
+        if sum(map(len, parts)) <= current_limit:
+            return [''.join(parts)]
+
+        lengths = [_visible_length(part) for part in parts]
+        start = 0
+
+        while start < count:
+            length = lengths[start]
+
+            if length > current_limit:
+                chunk, parts[start] = _cut(parts[start], current_limit)
+                chunks.append(chunk)
+                lengths[start] = _visible_length(parts[start])
+                if not parts[start]:
+                    start += 2
+                current_limit = limit
+                continue
+
+            end = start + 2
+            paragraph = word = None
+            while end < count and length + lengths[end - 1] + lengths[end] <= current_limit:
+                length += lengths[end - 1] + lengths[end]
+                if parts[end - 1] == _SEPARATORS[_WORD]:
+                    word = end
+                else:
+                    paragraph = end
+                end += 2
+
+            cut = (paragraph or word or end) if end < count else count + 1
+            chunks.append(''.join(parts[start:cut - 1]))
+            start = cut
+            current_limit = limit
+
+        return chunks or ['']
 
 
 class KeyboardLayout:
@@ -1,6 +1,8 @@
 """ ... """
 import asyncio
 import datetime
+import glob
+import itertools
 import logging
 import os
 import sys
@@ -15,13 +17,15 @@ import settings
 # Добавляем папки с библиотеками и модулями в path
 sys.path.extend(settings.LIBS)
 
+import broadcast
 import ezqr
+import resources
 import response_system
 import response_system.core.responses
 import gls
 import template
 import userdata
-from template_for_aiogram import aiogram_syntax
+from template_for_aiogram import aiogram_syntax, aiogram_scopes
 
 logger = logging.getLogger('peewee')
 logger.addHandler(logging.StreamHandler())
@@ -30,6 +34,16 @@ logger.setLevel(logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+class Database(peewee.PostgresqlDatabase):
+    """ Подключение к базе данных, считающее выполненные запросы
+        (используется профилировщиком шаблонов) """
+    queries = 0
+
+    def execute_sql(self, *args, **kwargs):
+        self.queries += 1
+        return super().execute_sql(*args, **kwargs)
+
+
 def get_BaseModel(db):
     """ Функция возвращающая базовую модель peewee
        для переданной базы данных """
@@ -47,6 +61,32 @@ def get_BaseModel(db):
     return BaseModel
 
 
+def preload_templates():
+    """ Загружает и проверяет все шаблоны до запуска ботов. Ошибка
+        в любом из шаблонов прерывает запуск """
+    from apps.botpiska.services import SERVICES
+
+    service_templates = (
+        path
+        for service in SERVICES
+        for path in (service.showcase_template, service.order_template)
+        if path is not None
+    )
+    paths = itertools.chain(
+        *(sorted(glob.glob(pattern, recursive=True)) for pattern in settings.TEMPLATE_PRELOAD_PATTERNS),
+        sorted(service_templates)
+    )
+
+    report = template.preload(paths, aiogram_scopes)
+
+    for info in report.templates:
+        logger.debug(f"Template {info.path} requires {sorted(info.variables)}")
+
+    message = f"Preloaded {len(report.templates)} templates in {report.elapsed * 1000:.1f}ms"
+    logger.info(message)
+    print(message)
+
+
 def log_uncaught_exceptions(exc_type, exc_value, exc_traceback):
     if issubclass(exc_type, KeyboardInterrupt):
         sys.__excepthook__(exc_type, exc_value, exc_traceback)
@@ -79,12 +119,18 @@ async def main():
     print("Starting bot")
 
     template.set_default_syntax(aiogram_syntax)
+    template.set_disk_cache_directory(settings.TEMPLATE_CACHE_DIRECTORY)
+    # Поиск file-id ресурсов (спецификатор rs) - не ленивая загрузка связей, его не считаем
+    template.set_query_limit(lambda: gls.db.queries - resources.get_database_queries(),
+                             settings.TEMPLATE_QUERY_LIMIT, strict=settings.TEMPLATE_QUERY_LIMIT_STRICT)
 
     response_system.core.responses.__debugging__ = settings.DEBUG
 
     # noinspection PyUnresolvedReferences
     import template_extensions
 
+    preload_templates()
+
     # Инициализация ботов
     gls.storage = MemoryStorage()
     userdata.__storage__ = gls.storage
@@ -111,7 +157,7 @@ async def main():
     gls.qiwi = QiwiP2PClient(secret_p2p=settings.PAYMENTS_TOKEN)
 
     # Инициализация подключения к базе данных
-    gls.db = peewee.PostgresqlDatabase(settings.DATABASE_URI)
+    gls.db = Database(settings.DATABASE_URI)
     gls.BaseModel = get_BaseModel(gls.db)
     ezqr.set_default_db(gls.db)
 
@@ -138,6 +184,9 @@ async def main():
     # noinspection PyUnresolvedReferences
     import events
 
+    # Запускаем обработчики рассылок, в том числе прерванных перезапуском
+    broadcast.start([gls.bot, gls.operator_bot], workers=settings.BROADCAST_WORKERS, window=settings.BROADCAST_WINDOW)
+
     # Запускаем ботов
     await asyncio.gather(
         dispatcher.start_polling(gls.bot),
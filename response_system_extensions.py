@@ -1,11 +1,12 @@
 from __future__ import annotations
 
+import itertools
 import typing
 
 import aiogram
 import aiogram.types
-import aiogram.exceptions
 
+import broadcast
 import gls
 import template
 from template_for_aiogram import aiogram_syntax
@@ -13,7 +14,7 @@ from apps.botpiska.models import Employee
 from response_system.core import globals_
 from response_system.core.responses import TEditSuccessHandler, TBasicHandler, Response, TSendSuccessHandler, \
     TFeedbackSuccessHandler, TNotifyEverySuccessHandler, TNotifyBasicSuccessHandler, handle, \
-    TNotifyCompletionHandler, action_edit, action_send, action_feedback, __debugging__
+    TNotifyCompletionHandler, action_edit, action_send, action_feedback, chat_keys
 
 
 async def action_tmpl_notify(
@@ -27,37 +28,46 @@ async def action_tmpl_notify(
         on_every_error: TNotifyBasicSuccessHandler = None,
         on_completion: TNotifyCompletionHandler = None
 ):
-    if not include_chat_id:
-        message = template.render(path, context)
-    succeeded = 0
-
-    for chat in receivers:
-        if include_chat_id:
-            message = template.render(path, {
-                **{include_chat_id: chat},
-                **context
-            })
-
-        # noinspection PyBroadException,DuplicatedCode
-        try:
-            # noinspection PyUnboundLocalVariable
-            result = await message.send(chat, bot=bot)
-            await handle(on_every_success, result)
-            succeeded += 1
-
-        except Exception as error:
-            do_raise = __debugging__ and on_every_error is None
-
-            if isinstance(error, aiogram.exceptions.TelegramForbiddenError):
-                do_raise = __debugging__ and on_every_forbidden is None
-                await handle(on_every_forbidden, chat)
+    if include_chat_id:
+        # Шаблон компилируется один раз, не зависящие от чата части отрисовываются однократно
+        messages = template.render_many(path, context, ({include_chat_id: chat} for chat in receivers))
+    else:
+        messages = itertools.repeat(template.render(path, context))
+    # Сообщения отправляются одновременно, не более broadcast.WINDOW за раз
+    succeeded = await broadcast.send_all(zip(receivers, messages), bot, callbacks=broadcast.JobCallbacks(
+        on_every_success=on_every_success,
+        on_every_forbidden=on_every_forbidden,
+        on_every_error=on_every_error
+    ))
+    await handle(on_completion, succeeded, len(receivers))
 
-            await handle(on_every_error, chat)
 
-            if do_raise:
-                raise
+async def action_tmpl_broadcast(
+        path: str, context: dict,
+        receivers: typing.Sequence[int],
+        bot: aiogram.Bot,
+        include_chat_id: str,  # Добавляет чат отправки в контекст
+        progress_chat: int = None,
 
-    await handle(on_completion, succeeded, len(receivers))
+        on_every_success: TNotifyEverySuccessHandler = None,
+        on_every_forbidden: TNotifyBasicSuccessHandler = None,
+        on_every_error: TNotifyBasicSuccessHandler = None,
+        on_completion: TNotifyCompletionHandler = None
+):
+    """ Как action_tmpl_notify, но сообщения отправляются фоновыми обработчиками
+        рассылок (см. broadcast) - рассылка переживает перезапуск бота. Шаблон
+        отрисовывается обработчиком по мере отправки, поэтому контекст должен
+        состоять из значений JSON и моделей peewee (см. broadcast.enqueue_template) """
+    broadcast.enqueue_template(
+        path, context,
+        ((chat, {include_chat_id: chat} if include_chat_id else {}) for chat in receivers),
+        bot,
+        progress_chat=progress_chat,
+        on_every_success=on_every_success,
+        on_every_forbidden=on_every_forbidden,
+        on_every_error=on_every_error,
+        on_completion=on_completion
+    )
 
 
 # ---
@@ -74,17 +84,21 @@ def tmpl_edit(
 
         priority: int = 0
 ) -> Response:
+    original = original or globals_.message_var.get()
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_edit(
             template.render(path, context, syntax=aiogram_syntax).extract(),
-            original or globals_.message_var.get(),
-            bot or aiogram.Bot.get_current(),
+            original,
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error
         ),
-        priority
+        priority,
+        chat_keys(bot, [original.chat.id])
     )
     return response
 
@@ -100,17 +114,21 @@ def tmpl_send(
 
         priority: int = 2
 ) -> Response:
+    chat = chat or globals_.message_var.get().chat.id
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_send(
             template.render(path, context, syntax=aiogram_syntax),
-            chat or globals_.message_var.get().chat.id,
-            bot or aiogram.Bot.get_current(),
+            chat,
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error
         ),
-        priority
+        priority,
+        chat_keys(bot, [chat])
     )
     return response
 
@@ -127,18 +145,22 @@ def tmpl_feedback(
 
         priority: int = 3
 ) -> Response:
+    chat = chat or globals_.message_var.get().chat.id
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
         action_feedback(
             template.render(path, context, syntax=aiogram_syntax).extract(),
-            chat or globals_.message_var.get().chat.id,
-            bot or aiogram.Bot.get_current(),
+            chat,
+            bot,
             on_success=on_success,
             on_forbidden=on_forbidden,
             on_error=on_error,
             on_delete=on_delete
         ),
-        priority
+        priority,
+        chat_keys(bot, [chat])
     )
     return response
 
@@ -153,22 +175,28 @@ def tmpl_notify(
         on_every_forbidden: TNotifyBasicSuccessHandler = None,
         on_every_error: TNotifyBasicSuccessHandler = None,
         on_completion: TNotifyCompletionHandler = None,
+        progress_chat: int = None,
 
         priority: int = 4
 ) -> Response:
+    bot = bot or aiogram.Bot.get_current()
+
     response = Response()
     response.add_action(
-        action_tmpl_notify(
+        action_tmpl_broadcast(
             path, context,
             receivers,
-            bot or aiogram.Bot.get_current(),
+            bot,
             include_chat_id,
+            progress_chat,
             on_every_success=on_every_success,
             on_every_forbidden=on_every_forbidden,
             on_every_error=on_every_error,
             on_completion=on_completion
         ),
-        priority
+        priority,
+        # Действие только ставит рассылку в очередь, ни в одну переписку не пишет
+        frozenset()
     )
     return response
 
@@ -184,11 +212,13 @@ def tmpl_notify_employee(
 
         priority: int = 4
 ) -> Response:
+    receivers = Employee.get_all_chats()
+
     response = Response()
     response.add_action(
         action_tmpl_notify(
             path, context,
-            Employee.get_all_chats(),
+            receivers,
             gls.operator_bot,
             include_chat_id,
             on_every_success=on_every_success,
@@ -196,6 +226,7 @@ def tmpl_notify_employee(
             on_every_error=on_every_error,
             on_completion=on_completion
         ),
-        priority
+        priority,
+        chat_keys(gls.operator_bot, receivers)
     )
     return response
@@ -233,6 +233,28 @@ CREATE INDEX LotteryPrize_pk ON "LotteryPrize" (id);
 CREATE INDEX LotteryPrize_lottery_id ON "LotteryPrize" (lottery_id);
 CREATE INDEX LotteryPrize_coupon_type_id ON "LotteryPrize" (coupon_type_id);
 
+CREATE TABLE "BroadcastJob" (
+    id serial not null
+        PRIMARY KEY,
+    bot_id bigint not null,
+    messages text not null,
+    receivers text not null,
+    cursor int not null default 0,
+    succeeded int not null default 0,
+    failed int not null default 0,
+
+    template varchar,
+    context text,
+
+    progress_chat_id bigint,
+    progress_message_id bigint,
+
+    created_at timestamp not null,
+    finished_at timestamp
+);
+
+CREATE INDEX BroadcastJob_unfinished ON "BroadcastJob" (id) WHERE finished_at is null;
+
 CREATE TABLE "StatisticsTypeAction"(
     id varchar not null
         PRIMARY KEY,
@@ -5,6 +5,10 @@ import string
 import os
 
 
+# Корневая директория проекта
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
 # BOT -----------------------------------------------------
 
 # Токены с которыми будут запущены основной бот и бот оператора.
@@ -98,6 +102,29 @@ LOGGING_FILENAME_FORMAT = '%Y_%m_%d_%H_%M_%S_%f.log'
 # лучше оставить HTML
 DEFAULT_PARSE_MODE = 'HTML'  # See telegram api docs for more...
 
+# Glob-шаблоны путей к файлам шаблонов, которые будут загружены
+# и проверены при запуске. Шаблоны сервисов (apps.botpiska.services)
+# добавляются автоматически
+TEMPLATE_PRELOAD_PATTERNS = [
+    'apps/*/templates/**/*.xml',
+    'events/templates/**/*.xml',
+]
+
+# Директория для дискового кеша разобранных шаблонов и их скомпилированных
+# выражений, относительный путь - от корня проекта. Пустое значение отключает кеш
+TEMPLATE_CACHE_DIRECTORY = os.environ.get('TEMPLATE_CACHE_DIRECTORY', '.template_cache') or None
+if TEMPLATE_CACHE_DIRECTORY is not None:
+    TEMPLATE_CACHE_DIRECTORY = os.path.join(PROJECT_DIRECTORY, TEMPLATE_CACHE_DIRECTORY)
+
+# Допустимое число запросов к базе данных за одну отрисовку шаблона (ленивые
+# загрузки связей, поиск file-id ресурсов не считается). При превышении
+# пишется предупреждение в лог
+TEMPLATE_QUERY_LIMIT = 3
+
+# Выбрасывать исключение при превышении TEMPLATE_QUERY_LIMIT вместо предупреждения.
+# Включается явно: бюджет запросов проверен не для всех шаблонов
+TEMPLATE_QUERY_LIMIT_STRICT = 'TEMPLATE_QUERY_LIMIT_STRICT' in os.environ
+
 
 # MISC ----------------------------------------------------
 
@@ -110,3 +137,9 @@ NOTIFY_BEFORE = datetime.timedelta(days=3)  # 3
 
 # Процент, который мы будем брать от общей цены товара
 SEASON_BONUS_PERCENTAGE = 0.1
+
+# Сколько рассылок выполняется одновременно (см. libs/broadcast.py)
+BROADCAST_WORKERS = 2
+
+# Сколько сообщений одной рассылки отправляется одновременно
+BROADCAST_WINDOW = 8
@@ -44,10 +44,25 @@ set_global_context({
 def res_extract_func(value, context, _) -> aiogram.types.InputFile | str:
     """ Воспринимает переданное значение в качестве индекса файла.
         Производит поиск cache->database->filesystem """
-    return resources.resource(value.format_map(context))
+    resource = resources.resource(compile_format(value).format(context))
+
+    # Файл ещё не загружен: после первой отправки его нужно брать по file-id,
+    # поэтому такой результат нельзя переиспользовать
+    if isinstance(resource, aiogram.types.InputFile):
+        mark_uncacheable()
+
+    return resource
 
 
 specifiers.update(rs=res_extract_func)
+variable_collectors.update(rs=format_variables)
+
+
+# file-id ресурсов у каждого бота свой
+@register_memoize_key
+def current_bot_id() -> int | None:
+    bot = aiogram.Bot.get_current()
+    return bot.id if bot is not None else None
 
 
 # CONVERTERS --------------------------------------------------------
@@ -58,7 +73,7 @@ def to_style(name: str) -> progressbar.Style:
 
 # TAGS --------------------------------------------------------------
 
-@register([MESSAGE, ELEMENT], name='progressbar')
+@register([MESSAGE, ELEMENT], name='progressbar', static=True)
 def _progressbar(_, *, steps: int, of: int, width: int = None, style: ConvertBy[to_style] = None) -> str:
     """ Progressbar """
     return progressbar.progressbar(steps / of, width, style)
@@ -66,7 +81,7 @@ def _progressbar(_, *, steps: int, of: int, width: int = None, style: ConvertBy[
 
 # Python sometimes messes up annotations and turns them into strings,
 # fixed by providing annotations explicitly
-@register([MESSAGE, ELEMENT], annotations={'user': int, 'display': str})
+@register([MESSAGE, ELEMENT], annotations={'user': int, 'display': str}, static=True)
 def chat(_, *, user=None, display='Пользователь') -> Text:
     """ Ссылка на чат с пользователем, оформленная как его имя """
 
@@ -0,0 +1,42 @@
+""" Подготовка окружения для тестов шаблонизатора (см. template_cases.py) """
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import template_cases
+
+template_cases.prepare_environment()
+
+import template
+import template.dev
+from template_for_aiogram import aiogram_syntax
+# noinspection PyUnresolvedReferences
+import template_extensions
+
+template.set_default_syntax(aiogram_syntax)
+template.dev.specifiers['rs'] = template_cases.resource_specifier
+
+
+@pytest.fixture(params=['compiled', 'interpreted', 'disk-cache'])
+def engine(request, tmp_path):
+    """ Режим работы шаблонизатора: скомпилированные функции, интерпретация
+        дерева или загрузка разобранных шаблонов из дискового кеша """
+    compilation, directory = template.dev.get_compilation_enabled(), template.get_disk_cache_directory()
+
+    template.clear_cache()
+    template.dev.set_compilation_enabled(request.param != 'interpreted')
+    template.set_disk_cache_directory(tmp_path if request.param == 'disk-cache' else None)
+    if request.param == 'disk-cache':
+        # Первая отрисовка заполняет дисковый кеш, тест читает шаблоны уже из него
+        for path, context in template_cases.CASES:
+            template_cases.dump_result(lambda: template.render(path, context))
+        template.clear_cache()
+
+    yield request.param
+
+    template.clear_cache()
+    template.dev.set_compilation_enabled(compilation)
+    template.set_disk_cache_directory(directory)
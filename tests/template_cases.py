@@ -0,0 +1,164 @@
+"""
+Шаблоны проекта и контексты, на которых проверяется шаблонизатор, и приведение
+результата отрисовки к виду, который можно сравнить и сохранить в JSON.
+
+Модуль не импортирует шаблонизатор, поэтому используется и тестами, и
+update_template_baseline.py, отрисовывающим эти же случаи старой версией движка.
+"""
+import decimal
+import os
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / 'data' / 'template_baseline.json'
+
+ENVIRONMENT = dict.fromkeys(
+    ['TOKEN', 'OPERATOR_TOKEN', 'BOT_NAME', 'SUPPORT_CHAT_ID', 'TECH_SUPPORT_CHAT_ID',
+     'PAYMENTS', 'DATABASE_URL', 'LOGGING_DIRECTORY'],
+    '123'
+)
+""" Переменные окружения, без которых не импортируется settings """
+
+NS = types.SimpleNamespace
+
+
+def subscription(id_: int, title: str, short_title: str, monthly_price: str, price: str, is_featured: bool) -> NS:
+    return NS(id=id_, title=title, short_title=short_title, monthly_price=decimal.Decimal(monthly_price),
+              price=decimal.Decimal(price), is_featured=is_featured)
+
+
+SPOTIFY = subscription(7, 'Spotify <Individual>', 'Spotify', '199.5', '599', True)
+NETFLIX = subscription(8, 'Netflix', 'Netflix', '299', '299', False)
+COUPON = NS(code='ABC', discount=decimal.Decimal(15),
+            type=NS(id='T1', discount=15, subscription_group=NS(description='все')))
+
+
+def order(id_: int, employee: int = None, closed: bool = False, coupon: NS = None) -> NS:
+    return NS(id=id_, client_id=1000 + id_, subscription=SPOTIFY if id_ % 2 else NETFLIX,
+              processing_employee_id=employee, paid_amount=decimal.Decimal('12.3456'),
+              coupon_id=coupon and 1, coupon=coupon,
+              is_free=employee is None and not closed,
+              is_processed=employee is not None and not closed,
+              is_closed=closed)
+
+
+def prize(id_: int) -> NS:
+    return NS(id=id_, title=f'Prize {id_}', banner='b.png', description='desc', cost=100 * id_, coupon_type_id=3)
+
+
+SEASON = NS(title='S1', prizes=[prize(i) for i in range(1, 5)], current_prize=prize(2),
+            current_prize_index=1, current_prize_days_left=5)
+CLIENT = NS(season_points=150, rating_position=2, clients_invited=3)
+
+CASES: list[tuple[str, dict]] = [
+    ('apps/botpiska/templates/message-start.xml', {'services': []}),
+    ('apps/botpiska/templates/message-bill.xml', {
+        'bill-image': 'IMG', 'subscription': SPOTIFY, 'bill': NS(pay_url='http://x?a=1&b=2'), 'is_gifts_allowed': True
+    }),
+    ('apps/botpiska/templates/message-bill.xml', {
+        'bill-image': 'IMG', 'subscription': SPOTIFY, 'bill': NS(pay_url='http://x'), 'is_gifts_allowed': False
+    }),
+    ('apps/botpiska/templates/message-coupon-general.xml', {'coupon': COUPON}),
+    ('apps/botpiska/templates/message-coupon-general.xml', {'coupon': None}),
+    ('apps/botpiska/templates/message-gift.xml', {'gift-card-image': 'G', 'subscription': SPOTIFY, 'coupon': COUPON}),
+    ('apps/botpiska/templates/message-previous-state.xml', {}),
+    ('apps/botpiska/templates/message-search-exact.xml', {}),
+    ('apps/botpiska/templates/message-service-list.xml', {}),
+    ('apps/botpiska/templates/message-support.xml', {}),
+    ('apps/botpiska/templates/message-terms.xml', {}),
+    ('apps/botpiska/templates/op-message-start.xml', {}),
+    ('apps/botpiska/templates/services/chatgpt/order.xml', {'order': order(1), 'subscription': SPOTIFY}),
+    ('apps/botpiska/templates/services/chatgpt/showcase.xml', {'subscription_plans': [(SPOTIFY, None), (NETFLIX, 10)]}),
+    ('apps/botpiska/templates/services/netflix/showcase.xml', {'subscription_plans': [(SPOTIFY, None)]}),
+    ('apps/botpiska/templates/services/spotify/showcase.xml', {'subscription_plans': []}),
+    ('apps/botpiska/templates/services/steam/showcase.xml', {}),
+    ('apps/botpiska/templates/services/netflix/order.xml', {'order': order(2), 'subscription': NETFLIX}),
+    ('apps/coupons/templates/message-coupon-success.xml', {}),
+    ('apps/debug/templates/test.xml', {'a': False, 'b': True}),
+    ('apps/debug/templates/test.xml', {'a': False, 'b': False}),
+    ('apps/debug/templates/test.xml', {'a': True, 'b': False}),
+    ('apps/notifications/templates/message-renew.xml', {'subscription': SPOTIFY, 'featured': NETFLIX}),
+    ('apps/notifications/templates/message-renew.xml', {'subscription': SPOTIFY, 'featured': None}),
+    ('apps/order_processing/templates/op-message-order-detailed.xml', {'order': order(3, employee=5, coupon=COUPON)}),
+    ('apps/order_processing/templates/op-message-order-detailed.xml', {'order': order(4)}),
+    ('apps/order_processing/templates/op-message-order-detailed.xml', {'order': order(4, employee=3, closed=True)}),
+    ('apps/order_processing/templates/op-message-order-list.xml', {
+        'orders': [order(i, employee=i if i % 3 else None) for i in range(5)]
+    }),
+    ('apps/order_processing/templates/op-message-order-list.xml', {'orders': []}),
+    ('apps/order_processing/templates/op-message-order-new.xml', {'order': order(9)}),
+    ('apps/order_processing/templates/op-message-profile-private.xml', {}),
+    ('apps/order_processing/templates/order-status-notifications/closed.xml', {'order': order(1)}),
+    ('apps/order_processing/templates/order-status-notifications/returned.xml', {'order': order(1)}),
+    ('apps/order_processing/templates/order-status-notifications/taken.xml', {'order': order(1), 'operator': 1}),
+    ('apps/posting/templates/message-lottery-open.xml', {'prize': prize(1)}),
+    ('apps/posting/templates/message-lottery.xml', {'banner': 'B', 'content': '<b>x</b>', 'prize': prize(3)}),
+    ('apps/posting/templates/message-post-error.xml', {}),
+    ('apps/posting/templates/message-post-received.xml', {'reference_id': 'r1'}),
+    ('apps/posting/templates/message-post-request.xml', {}),
+    ('apps/seasons/templates/message-season-general.xml', {
+        'season': SEASON, 'client': CLIENT, 'is_prize_bought': False
+    }),
+    ('apps/seasons/templates/message-season-general.xml', {
+        'season': SEASON, 'client': NS(season_points=0, rating_position=9, clients_invited=0), 'is_prize_bought': True
+    }),
+    ('apps/seasons/templates/message-season-help.xml', {}),
+    ('apps/seasons/templates/message-season-invite.xml', {'deep-link': 'http://t.me/x'}),
+    ('apps/seasons/templates/message-season-not-found.xml', {}),
+    ('apps/seasons/templates/message-season-points-given.xml', {
+        'is_prize_bought': False, 'client': CLIENT, 'season': SEASON, 'subscription': SPOTIFY, 'bonus': 10
+    }),
+    ('apps/seasons/templates/message-season-prize.xml', {'prize': prize(1), 'deep-link': 'L'}),
+    ('events/templates/message-1p1-gift.xml', {'coupon': 'CPN'}),
+]
+
+STRING_CASE = ('<section><p for="p in prizes"> {p.title} </p></section>', {'prizes': [prize(1), prize(2)]})
+""" Шаблон для render_string (синтаксис ELEMENT) и его контекст """
+
+
+def case_id(index: int) -> str:
+    path, _ = CASES[index]
+    return f'{index:02}-{path.removeprefix("apps/").removesuffix(".xml")}'
+
+
+def resource_specifier(value: str, context: dict, _) -> str:
+    """ Заменяет спецификатор rs, которому нужна база данных """
+    return 'RS:' + value.format_map(context)
+
+
+def prepare_environment(root: Path = ROOT):
+    """ Переменные окружения, рабочая папка и sys.path, нужные для импорта
+        шаблонизатора проекта, расположенного в root """
+    for name, value in ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.chdir(root)
+    sys.path[:0] = [str(root), str(root / 'libs')]
+
+
+def dump_messages(messages) -> list[dict]:
+    """ MessageRenderList -> [{'text', 'photo', 'animation', 'keyboard'}, ...] """
+    return [
+        {
+            'text': message.text,
+            'photo': None if message.photo is None else str(message.photo),
+            'animation': None if message.animation is None else str(message.animation),
+            'keyboard': None if message.keyboard is None else {
+                'type': type(message.keyboard).__name__,
+                'data': message.keyboard.dict(exclude_none=True)
+            }
+        }
+        for message in messages
+    ]
+
+
+def dump_result(render) -> dict:
+    """ Результат отрисовки или ошибка, возникшая при ней """
+    try:
+        result = render()
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+    if isinstance(result, str):
+        return {'text': result}
+    return {'messages': dump_messages(result)}
@@ -0,0 +1,117 @@
+"""
+Одновременная отправка рассылки (broadcast.send_all): результат доставки
+и обработчики событий.
+"""
+import asyncio
+import types
+
+import aiogram.exceptions
+import aiogram.methods
+import aiogram.types
+import pytest
+
+import broadcast
+import rate_limit
+import resources
+from message_render import MessageRender, MessageRenderList
+
+BOT = types.SimpleNamespace(id=1)
+
+
+class FakeMessages(list):
+    """ Вместо MessageRenderList: запоминает получателей, для chat из fail - ошибка """
+
+    def __init__(self, fail: frozenset = frozenset()):
+        super().__init__()
+        self.fail = fail
+        self.sent: list[int] = []
+
+    async def send(self, chat: int, bot=None):
+        if chat in self.fail:
+            raise aiogram.exceptions.TelegramForbiddenError(aiogram.methods.SendMessage(chat_id=chat, text=''), 'blocked')
+        self.sent.append(chat)
+        return [chat]
+
+
+async def send(messages, chats, **callbacks) -> tuple[int, dict[int, bool]]:
+    results = {}
+    succeeded = await broadcast.send_all(
+        ((chat, messages) for chat in chats), BOT,
+        callbacks=broadcast.JobCallbacks(**callbacks),
+        on_result=lambda position, ok: results.__setitem__(position, ok)
+    )
+    return succeeded, results
+
+
+@pytest.mark.asyncio
+async def test_results_by_position():
+    messages = FakeMessages(fail=frozenset({3}))
+    forbidden = []
+
+    succeeded, results = await send(messages, range(1, 6), on_every_forbidden=forbidden.append)
+
+    assert succeeded == 4
+    assert results == {0: True, 1: True, 2: False, 3: True, 4: True}
+    assert sorted(messages.sent) == [1, 2, 4, 5]
+    assert forbidden == [3]
+
+
+@pytest.mark.asyncio
+async def test_failing_success_callback_keeps_delivery_successful():
+    """ Сообщение доставлено - ошибка on_every_success не делает доставку неудачной """
+    def on_every_success(_):
+        raise RuntimeError('callback')
+
+    messages = FakeMessages()
+    succeeded, results = await send(messages, range(1, 4), on_every_success=on_every_success)
+
+    assert succeeded == 3
+    assert results == {0: True, 1: True, 2: True}
+
+
+class PhotoBot:
+    """ Бот, отправляющий фото: загрузка файла выдаёт новый file_id """
+
+    def __init__(self):
+        self.id = 2
+        self.photos: list = []
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None):
+        self.photos.append(photo)
+        await asyncio.sleep(0.01)
+        file_id = photo if isinstance(photo, str) else f'uploaded-{len(self.photos)}'
+        return types.SimpleNamespace(photo=[types.SimpleNamespace(file_id=file_id)])
+
+
+@pytest.mark.asyncio
+async def test_file_is_uploaded_once(monkeypatch):
+    """ Файл загружает первый получатель, остальные - в том числе уже ожидающие
+        в окне отправки - отправляют его file_id """
+    uploaded = {}
+    monkeypatch.setattr(resources, 'find', lambda path, bot: uploaded.get((bot.id, str(path))))
+    monkeypatch.setattr(resources, 'load', lambda path, file_id, bot: uploaded.update({(bot.id, str(path)): file_id}))
+
+    bot = PhotoBot()
+    monkeypatch.setitem(rate_limit._limiters, bot.id, rate_limit.RateLimiter(rate=1000))
+    messages = MessageRenderList([MessageRender('text', photo=aiogram.types.FSInputFile('banner.png'))])
+
+    succeeded = await broadcast.send_all(((chat, messages) for chat in range(20)), bot)
+
+    assert succeeded == 20
+    assert [isinstance(photo, aiogram.types.FSInputFile) for photo in bot.photos] == [True] + [False] * 19
+    assert set(bot.photos[1:]) == {'uploaded-1'}
+    # Общие для получателей сообщения не изменяются
+    assert isinstance(messages[0].photo, aiogram.types.FSInputFile)
+
+
+def test_template_context_round_trip():
+    context = {'title': 'T', 'count': 3, 'items': [1, 2.5, None, True], 'nested': {'a': ('b', 'c')}}
+    data = broadcast._dump_value(context)
+
+    assert broadcast._load_value(data) == {**context, 'nested': {'a': ['b', 'c']}}
+
+
+@pytest.mark.parametrize('value', [object(), {1: 'a'}, {'$model': 'x'}, b'bytes'])
+def test_template_context_rejects_unsupported_values(value):
+    with pytest.raises(ValueError):
+        broadcast._dump_value({'value': value})
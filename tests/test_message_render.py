@@ -0,0 +1,77 @@
+"""
+Изменение сообщения (MessageRender.edit) не отправляется в Telegram, если
+сообщение уже было изменено на то же содержимое.
+"""
+import datetime
+import types
+
+import aiogram.types
+import pytest
+
+import message_render
+import rate_limit
+from message_render import MessageRender
+
+
+class EditBot:
+    """ Бот, запоминающий тексты изменений """
+
+    def __init__(self):
+        self.id = 3
+        self.edits: list[str] = []
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        self.edits.append(text)
+        return types.SimpleNamespace(chat_id=chat_id, message_id=message_id, text=text)
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    bot = EditBot()
+    monkeypatch.setitem(rate_limit._limiters, bot.id, rate_limit.RateLimiter(rate=1000, per_chat_burst=1000))
+    message_render.forget_all()
+    yield bot
+    message_render.forget_all()
+
+
+def message(message_id: int = 1) -> aiogram.types.Message:
+    return aiogram.types.Message(message_id=message_id, date=datetime.datetime.now(),
+                                 chat=aiogram.types.Chat(id=10, type='private'), text='old')
+
+
+@pytest.mark.asyncio
+async def test_unchanged_edit_is_skipped(bot):
+    original = message()
+    info = message_render.get_edit_cache_info()
+    skipped = info.skipped
+
+    await MessageRender('new').edit(original, bot=bot)
+    result = await MessageRender('new').edit(original, bot=bot)
+
+    assert bot.edits == ['new']
+    assert result is original
+    assert message_render.get_edit_cache_info().skipped == skipped + 1
+
+
+@pytest.mark.asyncio
+async def test_changed_edit_is_performed(bot):
+    original = message()
+
+    await MessageRender('first').edit(original, bot=bot)
+    await MessageRender('second').edit(original, bot=bot)
+    await MessageRender('first').edit(original, bot=bot)
+    # Другое сообщение того же чата запоминается отдельно
+    await MessageRender('first').edit(message(2), bot=bot)
+
+    assert bot.edits == ['first', 'second', 'first', 'first']
+
+
+@pytest.mark.asyncio
+async def test_forgotten_message_is_edited_again(bot):
+    original = message()
+
+    await MessageRender('new').edit(original, bot=bot)
+    message_render.forget_message(bot, original.chat.id, original.message_id)
+    await MessageRender('new').edit(original, bot=bot)
+
+    assert bot.edits == ['new', 'new']
@@ -0,0 +1,120 @@
+"""
+Ограничение частоты запросов (rate_limit): пополнение корзин, лимит на чат
+и приоритет интерактивных запросов над рассылками.
+"""
+import asyncio
+import types
+
+import pytest
+
+import rate_limit
+
+
+class Clock:
+    """ Часы планировщика: ожидание только сдвигает время """
+
+    def __init__(self):
+        self.now = 0.
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'asyncio', types.SimpleNamespace(sleep=clock.sleep))
+    return clock
+
+
+def test_bucket_refill():
+    bucket = rate_limit.TokenBucket(rate=2, capacity=3, now=0)
+
+    for _ in range(3):
+        assert bucket.delay(0) == 0
+        bucket.take()
+
+    assert bucket.delay(0) == pytest.approx(0.5)
+    assert bucket.delay(0.25) == pytest.approx(0.25)
+    assert bucket.delay(0.5) == 0
+    assert not bucket.is_full(0.5)
+
+    # Корзина не наполняется больше capacity
+    assert bucket.is_full(100)
+    assert bucket.tokens == 3
+
+
+@pytest.mark.asyncio
+async def test_per_chat_burst(clock):
+    limiter = rate_limit.RateLimiter(rate=100, per_chat_rate=2, per_chat_burst=3, clock=clock)
+
+    assert [await limiter.acquire(1) for _ in range(3)] == [0, 0, 0]
+    assert await limiter.acquire(1) == pytest.approx(0.5)
+    assert await limiter.acquire(1) == pytest.approx(0.5)
+
+    # Другой чат лимит первого не задерживает
+    assert await limiter.acquire(2) == 0
+
+    assert limiter.stats.acquired == 6
+    assert limiter.stats.delayed == 2
+    assert limiter.stats.total_wait == pytest.approx(1)
+    assert limiter.stats.max_wait == pytest.approx(0.5)
+
+
+@pytest.mark.asyncio
+async def test_global_refill(clock):
+    limiter = rate_limit.RateLimiter(rate=10, per_chat_rate=10, per_chat_burst=10, clock=clock)
+
+    for chat in range(10):
+        assert await limiter.acquire(chat) == 0
+
+    # Общая корзина пуста, в любой чат - через 1 / rate
+    assert await limiter.acquire(100) == pytest.approx(0.1)
+    assert await limiter.acquire(101) == pytest.approx(0.1)
+
+    clock.now += 1
+    assert await limiter.acquire(102) == 0
+
+
+@pytest.mark.asyncio
+async def test_interactive_goes_first():
+    limiter = rate_limit.RateLimiter(rate=50, per_chat_rate=1000, per_chat_burst=1000)
+    order = []
+
+    async def request(name):
+        await limiter.acquire(name)
+        order.append(name)
+
+    # Общая корзина пуста: ожидают все
+    limiter.bucket.tokens = 0
+
+    with rate_limit.broadcast():
+        broadcasts = [asyncio.ensure_future(request(f'broadcast-{i}')) for i in range(5)]
+    await asyncio.sleep(0)
+    assert limiter.stats.broadcast_waiting == 5
+
+    interactive = asyncio.ensure_future(request('interactive'))
+    await asyncio.sleep(0)
+    assert limiter.stats.interactive_waiting == 1
+
+    await asyncio.gather(interactive, *broadcasts)
+
+    # Рассылка, начавшая ждать раньше, всё равно пропускает интерактивный запрос
+    assert order[0] == 'interactive'
+    assert sorted(order[1:]) == [f'broadcast-{i}' for i in range(5)]
+    assert limiter._interactive_blocked == 0
+    assert limiter.stats.broadcast_waiting == limiter.stats.interactive_waiting == 0
+
+
+def test_limiter_per_bot(monkeypatch):
+    monkeypatch.setattr(rate_limit, '_limiters', {})
+    first, second = types.SimpleNamespace(id=1), types.SimpleNamespace(id=2)
+
+    assert rate_limit.get_limiter(first) is rate_limit.get_limiter(first)
+    assert rate_limit.get_limiter(first) is not rate_limit.get_limiter(second)
+    assert set(rate_limit.get_stats()) == {1, 2}
@@ -0,0 +1,117 @@
+"""
+Выполнение ответа (Response.execute): приоритеты выполняются по очереди,
+действия одного приоритета - одновременно, кроме пишущих в одну переписку.
+"""
+import asyncio
+import types
+
+import pytest
+
+from response_system.core.responses import Response, chat_keys
+
+BOT = types.SimpleNamespace(id=1)
+
+
+class Log:
+    """ Действия записывают в журнал начало и конец выполнения """
+
+    def __init__(self):
+        self.events: list[str] = []
+
+    async def action(self, name: str, delay: float = 0.01, error: Exception = None):
+        self.events.append(f'{name}+')
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        self.events.append(f'{name}-')
+
+    def before(self, first: str, second: str) -> bool:
+        """ first завершилось до начала second """
+        return self.events.index(f'{first}-') < self.events.index(f'{second}+')
+
+    def overlap(self, first: str, second: str) -> bool:
+        """ first и second выполнялись одновременно """
+        return not self.before(first, second) and not self.before(second, first)
+
+
+@pytest.fixture
+def log():
+    return Log()
+
+
+@pytest.mark.asyncio
+async def test_same_chat_in_order(log):
+    response = Response()
+    response.add_action(log.action('a1', 0.03), 0, chat_keys(BOT, [1]))
+    response.add_action(log.action('a2'), 0, chat_keys(BOT, [1]))
+    response.add_action(log.action('a3'), 0, chat_keys(BOT, [1]))
+    await response.execute()
+
+    assert log.events == ['a1+', 'a1-', 'a2+', 'a2-', 'a3+', 'a3-']
+
+
+@pytest.mark.asyncio
+async def test_other_chats_concurrent(log):
+    response = Response()
+    response.add_action(log.action('a', 0.03), 0, chat_keys(BOT, [1]))
+    response.add_action(log.action('b'), 0, chat_keys(BOT, [2]))
+    response.add_action(log.action('ab'), 0, chat_keys(BOT, [1, 2]))
+    await response.execute()
+
+    assert log.overlap('a', 'b')
+    # Действие в обе переписки ждёт оба предыдущих
+    assert log.before('a', 'ab') and log.before('b', 'ab')
+
+
+@pytest.mark.asyncio
+async def test_other_bots_concurrent(log):
+    response = Response()
+    response.add_action(log.action('a'), 0, chat_keys(types.SimpleNamespace(id=1), [1]))
+    response.add_action(log.action('b'), 0, chat_keys(types.SimpleNamespace(id=2), [1]))
+    await response.execute()
+
+    assert log.overlap('a', 'b')
+
+
+@pytest.mark.asyncio
+async def test_unknown_chats_barrier(log):
+    response = Response()
+    response.add_action(log.action('a'), 0, chat_keys(BOT, [1]))
+    response.add_action(log.action('b', 0.02), 0, chat_keys(BOT, [2]))
+    response.add_action(log.action('barrier'), 0)
+    response.add_action(log.action('c'), 0, chat_keys(BOT, [3]))
+    response.add_action(log.action('d'), 0, chat_keys(BOT, [4]))
+    await response.execute()
+
+    # Действие с неизвестными переписками ждёт все предыдущие, а последующие - его
+    assert log.before('a', 'barrier') and log.before('b', 'barrier')
+    assert log.before('barrier', 'c') and log.before('barrier', 'd')
+    assert log.overlap('a', 'b') and log.overlap('c', 'd')
+
+
+@pytest.mark.asyncio
+async def test_priorities_in_order(log):
+    response = Response()
+    response.add_action(log.action('late'), 2, chat_keys(BOT, [2]))
+    response.add_action(log.action('early', 0.03), 1, chat_keys(BOT, [1]))
+    response.add_action(log.action('early-too'), 1, chat_keys(BOT, [3]))
+    await response.execute()
+
+    assert log.overlap('early', 'early-too')
+    assert log.before('early', 'late') and log.before('early-too', 'late')
+
+
+@pytest.mark.asyncio
+async def test_failed_action_skips_dependants(log):
+    response = Response()
+    response.add_action(log.action('failed', error=RuntimeError('failed')), 0, chat_keys(BOT, [1]))
+    response.add_action(log.action('dependant'), 0, chat_keys(BOT, [1]))
+    response.add_action(log.action('other', 0), 0, chat_keys(BOT, [2]))
+
+    with pytest.raises(RuntimeError):
+        await response.execute()
+    await asyncio.sleep(0.02)
+
+    # Действие в ту же переписку не выполняется вовсе, в другую - выполняется
+    assert 'dependant+' not in log.events
+    assert log.events == ['failed+', 'other+', 'other-']
@@ -0,0 +1,143 @@
+"""
+Повтор запросов (retry): ожидание retry_after, отступ при ошибках сети
+и ограничение суммарного ожидания действия.
+"""
+import types
+
+import aiogram.exceptions
+import pytest
+
+import retry
+
+
+class Clock:
+    """ Время для retry: ожидание только сдвигает его """
+
+    def __init__(self):
+        self.now = 0.
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(retry, 'asyncio', types.SimpleNamespace(sleep=clock.sleep))
+    monkeypatch.setattr(retry, 'stats', retry.RetryStats())
+    return clock
+
+
+def retry_after(seconds):
+    return aiogram.exceptions.TelegramRetryAfter(None, 'Flood control exceeded', seconds)
+
+
+def network_error():
+    return aiogram.exceptions.TelegramNetworkError(None, 'Connection reset')
+
+
+class Request:
+    """ Запрос, который сначала выбрасывает errors по одной, затем возвращает 'ok' """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.mark.asyncio
+async def test_retry_after(clock):
+    request = Request(retry_after(2), retry_after(3))
+
+    assert await retry.call(request) == 'ok'
+    assert request.calls == 3
+
+    # Ждёт не меньше retry_after и не больше retry_after * (1 + JITTER)
+    assert len(clock.sleeps) == 2
+    for delay, expected in zip(clock.sleeps, (2, 3)):
+        assert expected <= delay <= expected * (1 + retry.JITTER)
+
+    assert retry.stats.retries == retry.stats.retry_after == 2
+    assert retry.stats.total_wait == pytest.approx(sum(clock.sleeps))
+    assert retry.stats.gave_up == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_after_listener(clock):
+    heard = []
+
+    with retry.listen(heard.append):
+        assert await retry.call(Request(retry_after(1), retry_after(4))) == 'ok'
+
+    # Слушатель узнаёт о retry_after до ожидания
+    assert heard == [1, 4]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_deadline(clock):
+    request = Request(retry_after(20), retry_after(20))
+
+    with pytest.raises(aiogram.exceptions.TelegramRetryAfter):
+        await retry.call(request)
+
+    # Второе ожидание превысило бы MAX_WAIT - ошибка передаётся без него
+    assert request.calls == 2
+    assert len(clock.sleeps) == 1
+    assert retry.stats.gave_up == 1
+
+
+@pytest.mark.asyncio
+async def test_action_deadline_is_shared(clock):
+    with retry.action(max_wait=5):
+        assert await retry.call(Request(retry_after(3))) == 'ok'
+
+        # Вложенный блок ограничение не продлевает
+        with retry.action(max_wait=100):
+            with pytest.raises(aiogram.exceptions.TelegramRetryAfter):
+                await retry.call(Request(retry_after(3)))
+
+    assert len(clock.sleeps) == 1
+    assert retry.stats.gave_up == 1
+
+
+@pytest.mark.asyncio
+async def test_network_error_backoff(clock, monkeypatch):
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: high)
+    request = Request(*(network_error() for _ in range(3)))
+
+    assert await retry.call(request) == 'ok'
+    assert request.calls == 4
+    assert clock.sleeps == [retry.BACKOFF_BASE, retry.BACKOFF_BASE * 2, retry.BACKOFF_BASE * 4]
+    assert retry.stats.network_errors == 3
+
+
+@pytest.mark.asyncio
+async def test_network_error_attempts(clock, monkeypatch):
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: 0)
+    request = Request(*(network_error() for _ in range(retry.MAX_ATTEMPTS + 1)))
+
+    with pytest.raises(aiogram.exceptions.TelegramNetworkError):
+        await retry.call(request)
+
+    assert request.calls == retry.MAX_ATTEMPTS
+    assert retry.stats.network_errors == retry.MAX_ATTEMPTS - 1
+    assert retry.stats.gave_up == 1
+
+
+def test_backoff_bounds(monkeypatch):
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: (low, high))
+
+    assert retry._backoff(1) == (0, retry.BACKOFF_BASE)
+    assert retry._backoff(2) == (0, retry.BACKOFF_BASE * 2)
+    assert retry._backoff(100) == (0, retry.BACKOFF_MAX)
@@ -0,0 +1,117 @@
+"""
+Отрисовка шаблонов проекта совпадает с эталоном, снятым с шаблонизатора до
+переработки (data/template_baseline.json, см. update_template_baseline.py):
+текст, медиа и клавиатуры каждого сообщения.
+"""
+import json
+
+import pytest
+
+import template
+from template_for_aiogram.scopes import ELEMENT
+
+import template_cases
+
+
+@pytest.fixture(scope='module')
+def baseline() -> dict:
+    return json.loads(template_cases.BASELINE_PATH.read_text(encoding='utf-8'))
+
+
+@pytest.mark.parametrize('index', range(len(template_cases.CASES)), ids=template_cases.case_id)
+def test_render_matches_baseline(engine, baseline, index):
+    path, context = template_cases.CASES[index]
+    expected = baseline[template_cases.case_id(index)]
+
+    # Вторая отрисовка идёт через кеши (разобранный шаблон, memoize)
+    assert template_cases.dump_result(lambda: template.render(path, context)) == expected
+    assert template_cases.dump_result(lambda: template.render(path, context)) == expected
+
+
+def test_render_string_matches_baseline(engine, baseline):
+    string, context = template_cases.STRING_CASE
+    expected = baseline['render_string']
+
+    assert template_cases.dump_result(lambda: template.render_string(string, context, syntax=ELEMENT)) == expected
+    assert template_cases.dump_result(lambda: template.render_string(string, context, syntax=ELEMENT)) == expected
+
+
+LOOPED_TEMPLATE = '''
+<message>
+    <p for="order in orders">row {order} for {chat_id}</p>
+    <p for="order in orders">row {order}</p>
+    <p>chat {chat_id}</p>
+</message>
+'''
+
+
+@pytest.mark.parametrize('path, base_context, per_item_contexts', [
+    (None, {'orders': [1, 2, 3]}, [{'chat_id': 10}, {'chat_id': 11}]),
+    ('apps/posting/templates/message-lottery.xml', {'banner': 'B', 'content': '<b>x</b>'},
+     [{'prize': template_cases.prize(i)} for i in (1, 2, 1)]),
+    ('apps/order_processing/templates/op-message-order-list.xml', {},
+     [{'orders': [template_cases.order(i) for i in range(count)]} for count in (3, 1, 0)]),
+], ids=['looped', 'lottery', 'order-list'])
+def test_render_many_matches_render(engine, tmp_path, path, base_context, per_item_contexts):
+    """ Узлы тела цикла не повторяются из первой отрисовки, даже если сам цикл
+        от изменяющихся переменных не зависит """
+    if path is None:
+        path = tmp_path / 'looped.xml'
+        path.write_text(LOOPED_TEMPLATE, encoding='utf-8')
+        path = str(path)
+
+    expected = [
+        template_cases.dump_messages(template.render(path, {**base_context, **context}))
+        for context in per_item_contexts
+    ]
+    actual = [
+        template_cases.dump_messages(messages)
+        for messages in template.render_many(path, base_context, per_item_contexts)
+    ]
+    assert actual == expected
+
+
+@pytest.mark.parametrize('content', [
+    b'',
+    b'garbage',
+    b'ctemplate._template\nMissingName\n.',  # AttributeError при загрузке
+    b'cmissing_module\nName\n.',  # ImportError (ModuleNotFoundError)
+], ids=['empty', 'garbage', 'missing-name', 'missing-module'])
+def test_unreadable_disk_cache_is_ignored(tmp_path, baseline, content):
+    """ Повреждённый или несовместимый дисковый кеш не мешает отрисовке """
+    path, context = template_cases.CASES[0]
+    expected = baseline[template_cases.case_id(0)]
+    directory = template.get_disk_cache_directory()
+
+    template.clear_cache()
+    template.set_disk_cache_directory(tmp_path)
+    try:
+        template.render(path, context)
+        files = [file for file in tmp_path.rglob('*') if file.is_file()]
+        assert files
+        for file in files:
+            file.write_bytes(content)
+
+        template.clear_cache()
+        assert template_cases.dump_result(lambda: template.render(path, context)) == expected
+    finally:
+        template.clear_cache()
+        template.set_disk_cache_directory(directory)
+
+
+@pytest.mark.parametrize('strict', [False, True], ids=['warn', 'strict'])
+def test_query_limit(caplog, strict):
+    """ По умолчанию превышение лимита запросов только пишется в лог """
+    path, context = template_cases.CASES[0]
+    queries = iter(range(0, 1000, 5))  # Каждая отрисовка "выполняет" 5 запросов
+
+    template.set_query_limit(lambda: next(queries), 3, strict=strict)
+    try:
+        if strict:
+            with pytest.raises(template.QueryLimitError):
+                template.render(path, context)
+        else:
+            template.render(path, context)
+            assert 'database queries (limit is 3)' in caplog.text
+    finally:
+        template.set_query_limit(None)
@@ -0,0 +1,48 @@
+"""
+Разбиение длинного текста на сообщения (TextLayout.split): части не длиннее
+лимита (без учёта HTML тегов, как в Telegram), теги и сущности не разрезаются,
+а разметка каждой части остаётся правильной.
+"""
+import re
+import xml.dom.minidom
+
+import pytest
+
+from template_for_aiogram.types import TextLayout
+
+
+def split(limit: int, *sections: str) -> list[str]:
+    layout = TextLayout()
+    for section in sections:
+        layout.add_section(section)
+    return layout.split(limit)
+
+
+def visible(chunk: str) -> str:
+    return re.sub(r'<[^>]*>', '', chunk)
+
+
+@pytest.mark.parametrize('sections, limit, expected', [
+    (['one two three four five'], 9, ['one two', 'three', 'four five']),
+    (['aaaa <a href="http://x">link</a> bbbbbbbb'], 12, ['aaaa <a href="http://x">link</a>', 'bbbbbbbb']),
+    (['xxxxxxxx&amp;yyyyyyyy'], 10, ['xxxxxxxx&amp;y', 'yyyyyyy']),
+    (['<b>' + 'a' * 20 + '</b>'], 10, ['<b>' + 'a' * 10 + '</b>', '<b>' + 'a' * 10 + '</b>']),
+    (['<b><i>aaa bbb</i> ccc</b> d'], 4, ['<b><i>aaa</i></b>', '<b><i>bbb</i></b>', '<b>ccc</b>', 'd']),
+    (['<b>aaa </b>bbbb'], 4, ['<b>aaa</b>', 'bbbb']),
+    (['<b>first</b>\n<i>second line</i>\nthird'], 20, ['<b>first</b>\n<i>second line</i>', 'third']),
+    (['a' * 25], 10, ['a' * 10, 'a' * 10, 'a' * 5]),
+    (['first', 'second'], 10, ['first', 'second']),
+], ids=['words', 'link', 'entity', 'long-tag', 'nested-tags', 'tag-closed-at-cut', 'section-paragraphs',
+        'long-word', 'sections'])
+def test_split(sections, limit, expected):
+    assert split(limit, *sections) == expected
+
+
+def test_long_section_chunks_are_well_formed():
+    paragraph = 'Текст <b>жирный <i>курсив</i></b> и <a href="https://t.me/x?a=1&amp;b=2">ссылка &lt;1&gt;</a>.'
+    chunks = split(40, '\n'.join([paragraph] * 30))
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert 0 < len(visible(chunk).replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')) <= 40
+        xml.dom.minidom.parseString(f'<root>{chunk}</root>')
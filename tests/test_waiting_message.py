@@ -0,0 +1,77 @@
+"""
+Сообщение ожидания (WaitingMessageManager): показывается только для долгих
+обработчиков, удаляется в фоне и не задерживает ответ обработчика.
+"""
+import asyncio
+import types
+
+import aiogram.types
+import pytest
+
+from response_system.core import middleware
+
+
+class WaitingRender:
+    """ Вместо MessageRender: отправка занимает latency секунд """
+
+    def __init__(self, latency: float = 0, error: Exception = None):
+        self.latency = latency
+        self.error = error
+        self.sent = 0
+        self.deleted = 0
+
+    async def send(self, chat_id, bot=None):
+        await asyncio.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        self.sent += 1
+        return types.SimpleNamespace(delete=self.delete)
+
+    async def delete(self):
+        self.deleted += 1
+
+
+@pytest.fixture(autouse=True)
+def chat():
+    aiogram.types.Chat.set_current(aiogram.types.Chat(id=10, type='private'))
+
+
+async def handle(render: WaitingRender, duration: float, delay: float = 0.05) -> float:
+    """ Выполняет "обработчик" длительностью duration, возвращает время выхода из менеджера """
+    loop = asyncio.get_running_loop()
+    async with middleware.WaitingMessageManager(render, delay):
+        await asyncio.sleep(duration)
+        started = loop.time()
+    return loop.time() - started
+
+
+@pytest.mark.asyncio
+async def test_fast_handler_does_not_show_waiting_message():
+    render = WaitingRender()
+    await handle(render, 0)
+    await asyncio.sleep(0.1)
+
+    assert render.sent == 0
+
+
+@pytest.mark.asyncio
+async def test_waiting_message_is_deleted_in_background():
+    render = WaitingRender(latency=0.2)
+    exit_time = await handle(render, 0.1)
+
+    # Отправка ещё идёт, но ответ обработчика её не ждёт
+    assert exit_time < 0.05
+    assert render.deleted == 0
+
+    await asyncio.sleep(0.3)
+    assert (render.sent, render.deleted) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_waiting_message_error_is_logged(caplog):
+    render = WaitingRender(latency=0.01, error=RuntimeError('boom'))
+    await handle(render, 0.1)
+    await asyncio.sleep(0.05)
+
+    assert not middleware._cleanups
+    assert 'Waiting message failed' in caplog.text
@@ -0,0 +1,48 @@
+"""
+Отрисовывает случаи из template_cases.py шаблонизатором и шаблонами проекта,
+расположенного в ROOT, и сохраняет результат в data/template_baseline.json.
+Эталон снимается с версии до переработки шаблонизатора, например::
+
+    git archive dfb2370 | tar -x -C /tmp/baseline
+    python tests/update_template_baseline.py /tmp/baseline
+
+"""
+import json
+import sys
+from pathlib import Path
+
+import template_cases
+
+
+def main(root: Path):
+    template_cases.prepare_environment(root)
+
+    import template
+    import template.dev
+    from template_for_aiogram import aiogram_syntax
+    from template_for_aiogram.scopes import ELEMENT
+    # noinspection PyUnresolvedReferences
+    import template_extensions
+
+    template.set_default_syntax(aiogram_syntax)
+    template.dev.specifiers['rs'] = template_cases.resource_specifier
+
+    baseline = {
+        template_cases.case_id(index): template_cases.dump_result(lambda: template.render(path, context))
+        for index, (path, context) in enumerate(template_cases.CASES)
+    }
+
+    string, context = template_cases.STRING_CASE
+    baseline['render_string'] = template_cases.dump_result(
+        lambda: template.render_string(string, context, syntax=ELEMENT)
+    )
+
+    template_cases.BASELINE_PATH.parent.mkdir(exist_ok=True)
+    template_cases.BASELINE_PATH.write_text(json.dumps(baseline, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+    print(f'Saved {len(baseline)} renders to {template_cases.BASELINE_PATH}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(Path(sys.argv[1]).resolve())